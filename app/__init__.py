@@ -24,7 +24,8 @@ database = SQLAlchemy(app)
 login = LoginManager(app)
 login.init_app(app)
 
-from app.data_service.models import DataLoader, TableJoiner, ActiveUserHandler
+from app.data_service.models import DataLoader, TableJoiner, ActiveUserHandler, UploadJobHandler, \
+    UploadRegistry, UploadSessionHandler, SearchIndexer, IndexAdvisor
 
 from app.user_service.models import UserDataAccess, User
 from app.data_transform.models import DateTimeTransformer, DataTransformer, NumericalTransformations, OneHotEncode, DataDeduplicator
@@ -39,6 +40,17 @@ active_user_handler = ActiveUserHandler()
 table_joiner = TableJoiner(data_loader)
 one_hot_encoder = OneHotEncode(data_loader)
 data_deduplicator = DataDeduplicator(data_loader)
+upload_registry = UploadRegistry(data_loader)
+search_indexer = SearchIndexer(data_loader)
+upload_job_handler = UploadJobHandler(data_loader, upload_registry, search_indexer)
+index_advisor = IndexAdvisor(data_loader, search_indexer)
+upload_session_handler = UploadSessionHandler(upload_job_handler)
+
+# Imports & index builds of processes of the app that stopped won't be finished anymore
+data_loader.drop_csv_parts()
+upload_job_handler.fail_interrupted_jobs()
+search_indexer.fail_interrupted_builds()
+index_advisor.fail_interrupted_builds()
 
 
 @login.user_loader
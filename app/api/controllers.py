@@ -1,11 +1,15 @@
 from functools import wraps
 
-from flask import abort, Blueprint, jsonify, request, send_from_directory, flash
+from flask import abort, Blueprint, json, jsonify, request, send_from_directory, flash, stream_with_context, \
+    Response
 from flask_login import current_user, login_user
 from passlib.hash import sha256_crypt
+from werkzeug.utils import secure_filename
 
 from app import data_loader, date_time_transformer, data_transformer, numerical_transformer, one_hot_encoder, \
-    data_deduplicator, active_user_handler, UPLOAD_FOLDER
+    data_deduplicator, active_user_handler, upload_job_handler, upload_session_handler, search_indexer, \
+    index_advisor, TABLE_STREAM_BATCH_SIZE, UPLOAD_FOLDER
+from app.data_service.controllers import allowed_file, queue_upload, upload_options
 from app.history.models import History
 from app.user_service.models import UserDataAccess
 
@@ -41,25 +45,60 @@ def get_table(dataset_id, table_name):
     active_user_handler.make_user_active_in_table(dataset_id, table_name, current_user.username)
     start = request.args.get('start')
     length = request.args.get('length')
-    order_column_idx = int(request.args.get('order[0][column]'))
-    order_column_name = request.args.get('columns[{}][data]'.format(order_column_idx))
-    order_direction = request.args.get('order[0][dir]')
-    ordering = (order_column_name, order_direction)
+    ordering = None
+    if request.args.get('order[0][column]') is not None:
+        order_column_idx = int(request.args.get('order[0][column]'))
+        order_column_name = request.args.get('columns[{}][data]'.format(order_column_idx))
+        order_direction = request.args.get('order[0][dir]')
+        ordering = (order_column_name, order_direction)
     search = request.args.get('search[value]')
+    # 'substring' or 'fulltext', a full-text search without ordering returns the most relevant rows first
+    search_type = request.args.get('search-type', 'substring')
+    # Keyset pagination: pass the cursor of the previous page (an empty one for the first page) instead of start
+    after = request.args.get('cursor')
+    # Only the id & these columns are fetched (e.g. the columns the client displays), pass one fields arg per column
+    fields = request.args.getlist('fields') or None
+    # 'object' (a dict per row) or 'array' (a list per row, in the order of id & the fields)
+    form = request.args.get('form', 'object')
+    # Rows are encoded while they're fetched, instead of building the whole response in memory
+    stream = request.args.get('stream') == 'true'
+    draw = int(request.args.get('draw'))
 
-    table = data_loader.get_table(dataset_id, table_name, offset=start, limit=length, ordering=ordering, search=search)
-    # Make proper data dict out of table rows
-    data = list()
-    for r_ix in range(len(table.rows)):
-        r = dict()
-        for c_ix in range(len(table.columns)):
-            r[table.columns[c_ix].name] = table.rows[r_ix][c_ix]
-        data.append(r)
-
-    return jsonify(draw=int(request.args.get('draw')),
+    try:
+        if form not in ('object', 'array'):
+            raise ValueError("Invalid form '{}'".format(form))
+        table = data_loader.get_table(dataset_id, table_name, offset=start, limit=length, ordering=ordering,
+                                      search=search, after=after, search_type=search_type, fields=fields,
+                                      stream=stream)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    index_advisor.record_page(dataset_id, table_name, ordering, search, search_type)
+    if stream:
+        return Response(stream_with_context(_stream_table(table, form, draw)), mimetype='application/json')
+
+    names = [column.name for column in table.columns]
+    data = table.rows if form == 'array' else [dict(zip(names, row)) for row in table.rows]
+    return jsonify(draw=draw,
                    recordsTotal=table.total_size,
-                   recordsFiltered=table.total_size,
-                   data=data)  # table.rows
+                   recordsFiltered=table.filtered_size,
+                   data=data,
+                   cursor=table.next_cursor)  # None without keyset pagination or on the last page
+
+
+def _stream_table(table, form, draw):
+    """ Yields the response of get_table in parts, the rows of the table are fetched while they're encoded """
+    names = [column.name for column in table.columns]
+    yield '{{"draw": {}, "recordsTotal": {}, "recordsFiltered": {}, "data": ['.format(
+        draw, table.total_size, table.filtered_size)
+    parts = list()
+    for row in table.rows:
+        parts.append(json.dumps(row if form == 'array' else dict(zip(names, row))))
+        if len(parts) == TABLE_STREAM_BATCH_SIZE:
+            yield ', '.join(parts)
+            parts = ['']  # the next part starts with a separator
+    yield ', '.join(parts)
+    # The cursor of the next page is known once all rows are fetched
+    yield '], "cursor": {}}}'.format(json.dumps(table.next_cursor))
 
 
 @api.route('/api/datasets/<int:dataset_id>/tables/<string:table_name>/history', methods=['GET'])
@@ -187,6 +226,44 @@ def delete_column(dataset_id, table_name):
         return jsonify({'error': True}), 400
 
 
+@api.route('/api/datasets/<int:dataset_id>/tables/<string:table_name>/search-index', methods=['GET'])
+@auth_required
+def get_search_index(dataset_id, table_name):
+    if (data_loader.has_access(current_user.username, dataset_id)) is False:
+        return abort(403)
+    try:
+        index = search_indexer.get_index(dataset_id, table_name, request.args.get('type', 'substring'))
+    except Exception:
+        return jsonify({'error': True}), 400
+    if index is None:
+        return abort(404)
+    return jsonify(state=index['state'], columns=json.loads(index['columns']), updated=str(index['updated']))
+
+
+@api.route('/api/datasets/<int:dataset_id>/tables/<string:table_name>/search-index', methods=['PUT'])
+@auth_required
+def build_search_index(dataset_id, table_name):
+    if (data_loader.has_access(current_user.username, dataset_id)) is False:
+        return abort(403)
+    try:
+        search_indexer.build_index(dataset_id, table_name, request.args.get('type', 'substring'))
+        return jsonify({'success': True}), 202
+    except Exception:
+        return jsonify({'error': True}), 400
+
+
+@api.route('/api/datasets/<int:dataset_id>/tables/<string:table_name>/search-index', methods=['DELETE'])
+@auth_required
+def drop_search_index(dataset_id, table_name):
+    if (data_loader.has_access(current_user.username, dataset_id)) is False:
+        return abort(403)
+    try:
+        search_indexer.drop_index(dataset_id, table_name, request.args.get('type', 'substring'))
+        return jsonify({'success': True}), 200
+    except Exception:
+        return jsonify({'error': True}), 400
+
+
 @api.route('/api/datasets/<int:dataset_id>/tables/<string:table_name>/date-time-transformations', methods=['PUT'])
 @auth_required
 def transform_date_or_time(dataset_id, table_name):
@@ -286,6 +363,103 @@ def export_table(dataset_id, table_name):
         return jsonify({'error': True}), 400
 
 
+@api.route('/api/datasets/<int:dataset_id>/uploads', methods=['POST'])
+@auth_required
+def add_upload(dataset_id):
+    if (data_loader.has_access(current_user.username, dataset_id)) is False:
+        return abort(403)
+    file = request.files.get('file')
+    if file is None or not allowed_file(file.filename):
+        return jsonify({'error': True}), 400
+    try:
+        job_id = queue_upload(dataset_id, file, request.form)
+        return jsonify({'success': True, 'job_id': job_id}), 202
+    except Exception:
+        return jsonify({'error': True}), 400
+
+
+@api.route('/api/datasets/<int:dataset_id>/uploads', methods=['GET'])
+@auth_required
+def get_uploads(dataset_id):
+    if (data_loader.has_access(current_user.username, dataset_id)) is False:
+        return abort(403)
+    try:
+        return jsonify(data=[job.to_dct() for job in upload_job_handler.get_jobs(dataset_id)])
+    except Exception:
+        return jsonify({'error': True}), 400
+
+
+@api.route('/api/datasets/<int:dataset_id>/uploads/<int:job_id>', methods=['GET'])
+@auth_required
+def get_upload(dataset_id, job_id):
+    if (data_loader.has_access(current_user.username, dataset_id)) is False:
+        return abort(403)
+    try:
+        job = upload_job_handler.get_job(dataset_id, job_id)
+    except Exception:
+        return jsonify({'error': True}), 400
+    if job is None:
+        return abort(404)
+    return jsonify(job.to_dct())
+
+
+@api.route('/api/datasets/<int:dataset_id>/upload-sessions', methods=['POST'])
+@auth_required
+def add_upload_session(dataset_id):
+    # Starts a chunked upload, the form holds the filename, the size (in bytes) of the file & the usual upload
+    # options. The chunks are then sent (in order) with PUT requests to the returned session.
+    if (data_loader.has_access(current_user.username, dataset_id)) is False:
+        return abort(403)
+    filename = secure_filename(request.form.get('filename', ''))
+    if not allowed_file(filename):
+        return jsonify({'error': True}), 400
+    try:
+        size = int(request.form.get('size'))
+        table_name, table_desc, type_deduction = upload_options(filename, request.form)
+        session = upload_session_handler.create_session(dataset_id, current_user.username, filename, size,
+                                                        table_name, table_desc, type_deduction)
+        return jsonify(session.to_dct()), 201
+    except Exception:
+        return jsonify({'error': True}), 400
+
+
+@api.route('/api/datasets/<int:dataset_id>/upload-sessions/<string:session_id>', methods=['GET'])
+@auth_required
+def get_upload_session(dataset_id, session_id):
+    # The offset of the session is where an interrupted upload should be resumed
+    if (data_loader.has_access(current_user.username, dataset_id)) is False:
+        return abort(403)
+    session = upload_session_handler.get_session(dataset_id, session_id)
+    if session is None:
+        return abort(404)
+    return jsonify(session.to_dct())
+
+
+@api.route('/api/datasets/<int:dataset_id>/upload-sessions/<string:session_id>', methods=['PUT'])
+@auth_required
+def add_upload_chunk(dataset_id, session_id):
+    # The request body is the next chunk, the 'Upload-Offset' header holds its offset in the file & the optional
+    # 'Upload-Checksum' header a checksum of it ('<algorithm> <hex digest>')
+    if (data_loader.has_access(current_user.username, dataset_id)) is False:
+        return abort(403)
+    session = upload_session_handler.get_session(dataset_id, session_id)
+    if session is None:
+        return abort(404)
+    try:
+        offset = int(request.headers.get('Upload-Offset'))
+    except (TypeError, ValueError):
+        return jsonify({'error': True, 'offset': session.received}), 400
+    if offset != session.received:
+        return jsonify({'error': True, 'offset': session.received}), 409
+    try:
+        session = upload_session_handler.write_chunk(dataset_id, session_id, offset, request.stream,
+                                                     request.headers.get('Upload-Checksum'))
+        return jsonify(session.to_dct())
+    except Exception:
+        session = upload_session_handler.get_session(dataset_id, session_id)
+        return jsonify({'error': True, 'offset': session.received if session else 0}), 400
+
+
 @api.route('/api/download/<string:filename>', methods=['GET'])
 @auth_required
 def download_file(filename):
@@ -305,10 +479,9 @@ def show_raw_data(dataset_id, table_name):
     raw_table_name = "_raw_" + table_name
     ordering = (data_loader.get_column_names(dataset_id, raw_table_name)[order_column], order_direction)
     table = data_loader.get_table(dataset_id, raw_table_name, offset=start, limit=length, ordering=ordering)
-    _table = data_loader.get_table(dataset_id, raw_table_name)
     return jsonify(draw=int(request.args.get('draw')),
-                   recordsTotal=len(_table.rows),
-                   recordsFiltered=len(_table.rows),
+                   recordsTotal=table.total_size,
+                   recordsFiltered=table.total_size,
                    data=table.rows)
 
 
@@ -438,6 +611,21 @@ def chart(dataset_id, table_name):
         return jsonify({'error': True}), 400
 
 
+@api.route('/api/datasets/<int:dataset_id>/tables/<string:table_name>/statistics', methods=['GET'])
+@auth_required
+def statistics(dataset_id, table_name):
+    if (data_loader.has_access(current_user.username, dataset_id)) is False:
+        return abort(403)
+    try:
+        column_name = request.args.get('col-name')
+        column_type = request.args.get('col-type')
+        numerical = column_type in ['integer', 'double', 'real']
+        stats = data_loader.get_statistics_for_column(dataset_id, table_name, column_name, numerical)
+        return jsonify(data=[[name, str(value)] for name, value in stats])
+    except Exception:
+        return jsonify({'error': True}), 400
+
+
 @api.route('/api/datasets/<int:dataset_id>/tables/<string:table_name>/one-hot-encode-column', methods=['PUT'])
 @auth_required
 def one_hot_encode(dataset_id, table_name):
@@ -1,17 +1,25 @@
 import os
+from uuid import uuid4
 
 from flask import Blueprint, request, render_template, redirect, url_for, abort, jsonify, flash
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 
-from app import app, data_loader, table_joiner, date_time_transformer,active_user_handler, data_deduplicator, ALLOWED_EXTENSIONS, UPLOAD_FOLDER
+from app import app, data_loader, table_joiner, date_time_transformer,active_user_handler, data_deduplicator, \
+    upload_job_handler, ALLOWED_EXTENSIONS, COLUMNAR_EXTENSIONS, COMPRESSED_EXTENSIONS, UPLOAD_FOLDER
 
+from app.data_service.helpers import save_stream
 from app.data_service.models import TableJoinPair
 
 data_service = Blueprint('data_service', __name__)
 
 
 def allowed_file(filename):
+    if '.' in filename and filename.rsplit('.', 1)[1].lower() in COMPRESSED_EXTENSIONS:
+        # Compressed CSV files & dumps are allowed, compressed archives & columnar files aren't
+        filename = filename.rsplit('.', 1)[0]
+        return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS and \
+               filename.rsplit('.', 1)[1].lower() not in ['zip'] + COLUMNAR_EXTENSIONS
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -54,9 +62,13 @@ def get_dataset(dataset_id):
 
     if len(tables) != 0:
         columns = data_loader.get_column_names(dataset_id, tables[0].name)
+    # Uploads that are still being imported
+    uploads = [job for job in upload_job_handler.get_jobs(dataset_id)
+               if job.state in ('queued', 'waiting', 'running')]
     active_user_handler.make_user_active_in_dataset(dataset_id, current_user.username)
     return render_template('data_service/dataset-view.html', ds=dataset, tables=tables, columns=columns,
-                           access_permission=access_permission, users_with_access=users_with_access)
+                           access_permission=access_permission, users_with_access=users_with_access,
+                           uploads=uploads)
 
 
 @data_service.route('/datasets/<int:dataset_id>/delete', methods=['POST'])
@@ -71,6 +83,54 @@ def delete_dataset(dataset_id):
     return redirect(url_for('data_service.get_datasets'), code=303)
 
 
+def upload_options(filename, form):
+    """
+     Returns the table name, table description & whether to deduce types for an upload from the upload form
+    """
+    type_deduction = (form.get('ds-type-deduction') is not None)  # Unchecked returns None
+    table_name = form.get('ds-table-name') or filename.rsplit('.')[0]
+    table_desc = form.get('ds-table-desc') or 'Default description'
+    table_name = table_name.replace('"', '')
+    if table_name.isspace():
+        table_name = filename.rsplit('.')[0]
+    return table_name, table_desc, type_deduction
+
+
+def queue_upload(dataset_id, file, form):
+    """
+     Saves an uploaded file & queues its import as an upload job. Returns the id of the job.
+    """
+    # TEMP solution: create UPLOAD_FOLDER if it doesn't exists to prevent 'file not found' error.
+    # This should probably be done in some setup function and not every time this method is called
+    if not os.path.exists(UPLOAD_FOLDER):
+        os.makedirs(UPLOAD_FOLDER)
+
+    filename = secure_filename(file.filename)
+    # Several uploads can be waiting in the queue at once, so every file gets a unique name on disk
+    path = os.path.join(UPLOAD_FOLDER, '{}_{}'.format(uuid4().hex, filename))
+    try:
+        # The digest is computed while saving, so the upload registry doesn't have to read the file again
+        digest = save_stream(file.stream, path)
+    except Exception as e:
+        app.logger.error("[ERROR] Failed to upload file '" + file.filename + "'")
+        app.logger.exception(e)
+        file.close()
+        if os.path.exists(path):
+            os.remove(path)
+        raise e
+    file.close()
+
+    try:
+        table_name, table_desc, type_deduction = upload_options(filename, form)
+        return upload_job_handler.submit_job(dataset_id, current_user.username, path, filename, table_name,
+                                             table_desc=table_desc, type_deduction=type_deduction, digest=digest)
+    except Exception as e:
+        app.logger.error("[ERROR] Failed to queue file '" + filename + "'")
+        app.logger.exception(e)
+        os.remove(path)
+        raise e
+
+
 @data_service.route('/datasets/<int:dataset_id>', methods=['POST'])
 def add_table(dataset_id):
     if (data_loader.has_access(current_user.username, dataset_id)) is False:
@@ -83,52 +143,14 @@ def add_table(dataset_id):
     if file.filename == '':
         return get_dataset(dataset_id)
 
-    # TEMP solution: create UPLOAD_FOLDER if it doesn't exists to prevent 'file not found' error.
-    # This should probably be done in some setup function and not every time this method is called
-    if not os.path.exists(UPLOAD_FOLDER):
-        os.makedirs(UPLOAD_FOLDER)
-
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        path = os.path.join(UPLOAD_FOLDER, filename)
-        try:
-            file.save(path)
-        except Exception as e:
-            app.logger.error("[ERROR] Failed to upload file '" + file.filename + "'")
-            app.logger.exception(e)
-            file.close()
-            os.remove(path)
-            flash(u"Failed to upload file.", 'danger')
-            return get_dataset(dataset_id)
-
         current_user.active_schema = dataset_id
-
         try:
-            type_deduction = (request.form.get('ds-type-deduction') is not None) # Unchecked returns None
-            table_name = request.form.get('ds-table-name') or filename.rsplit('.')[0]
-            table_desc = request.form.get('ds-table-desc') or 'Default description'
-            table_name = table_name.replace('"', '')
-            if table_name.isspace():
-                table_name = filename.rsplit('.')[0]
-            if filename[-3:] == "zip":
-                data_loader.process_zip(path, dataset_id, type_deduction=type_deduction)
-            elif filename[-3:] == "csv":
-                create_new = not data_loader.table_exists(table_name, dataset_id)
-                if create_new:
-                    data_loader.process_csv(path, dataset_id, table_name, table_description=table_desc, type_deduction=type_deduction)
-                else:
-                    data_loader.process_csv(path, dataset_id, table_name, table_description=table_desc, append=True, type_deduction=type_deduction)
-            else:
-                data_loader.process_dump(path, dataset_id, table_name=table_name, table_description=table_desc)
-            flash(u"Data has been imported.", 'success')
-        except Exception as e:
-            app.logger.error("[ERROR] Failed to process file '" + filename + "'")
-            app.logger.exception(e)
+            job_id = queue_upload(dataset_id, file, request.form)
+            flash(u"Your file is being imported (upload #{}), its tables will show up here once it's done."
+                  .format(job_id), 'success')
+        except Exception:
             flash(u"Data couldn't be imported.", 'danger')
-            return get_dataset(dataset_id)
-
-        file.close()
-        os.remove(path)
     return get_dataset(dataset_id)
 
 
@@ -137,8 +159,8 @@ def get_table(dataset_id, table_name):
     if (data_loader.has_access(current_user.username, dataset_id)) is False:
         return abort(403)
     try:
-        table = data_loader.get_table(dataset_id, table_name)
-        statistics = data_loader.get_statistics_for_all_columns(dataset_id, table_name, table.columns)
+        # Only the metadata of the table is rendered, the rows & column statistics are fetched through the API
+        table = data_loader.get_table(dataset_id, table_name, limit=0)
         time_date_transformations = date_time_transformer.get_transformations()
         backups = data_loader.get_backups(dataset_id, table_name)
 
@@ -148,7 +170,7 @@ def get_table(dataset_id, table_name):
         active_user_handler.make_user_active_in_table(dataset_id, table_name, current_user.username)
         return render_template('data_service/table-view.html', table=table,
                                time_date_transformations=time_date_transformations,
-                               statistics=statistics, raw_table_exists=raw_table_exists, backups=backups)
+                               raw_table_exists=raw_table_exists, backups=backups)
     except Exception:
         flash(u"Table couldn't be shown.", 'danger')
         return redirect(url_for('data_service.get_dataset', dataset_id=dataset_id), code=303)
@@ -219,7 +241,7 @@ def show_raw_data(dataset_id, table_name):
         return redirect(url_for('data_service.get_table', dataset_id=dataset_id, table_name=table_name))
     try:
         active_user_handler.make_user_active_in_table(dataset_id, table_name, current_user.username)
-        table = data_loader.get_table(dataset_id, raw_table_name)
+        table = data_loader.get_table(dataset_id, raw_table_name, limit=0)
         title = "Raw data for " + table_name
         return render_template('data_service/raw-table-view.html', table=table, title=title)
     except Exception:
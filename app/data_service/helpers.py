@@ -0,0 +1,638 @@
+import base64
+import bz2
+import gzip
+import hashlib
+import io
+import json
+import lzma
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.feather
+    import pyarrow.ipc
+    import pyarrow.parquet
+    import pyarrow.types
+except ImportError:  # Parquet & Arrow files can only be uploaded if pyarrow is installed
+    pyarrow = None
+
+from app import COLUMN_CACHE_SIZE, COLUMN_CACHE_TTL, COPY_BUFFER_SIZE, FULL_TEXT_CONFIG
+
+
+def _ci(*args: str):
+    if len(args) == 1:
+        return '"{}"'.format(str(args[0]).replace('"', '""'))
+    return ['"{}"'.format(str(arg).replace('"', '""')) for arg in args]
+
+
+class ProgressReader(io.RawIOBase):
+    """
+     Wraps a binary stream & calls callback (if given) with the amount of bytes every time something is read from it.
+     If digest (a hashlib object) is given, it's updated with everything that is read.
+    """
+
+    def __init__(self, stream, callback=None, digest=None):
+        self.stream = stream
+        self.callback = callback
+        self.digest = digest
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self.stream.readinto(buffer)
+        if count:
+            if self.callback is not None:
+                self.callback(count)
+            if self.digest is not None:
+                self.digest.update(memoryview(buffer)[:count])
+        return count
+
+    def close(self):
+        self.stream.close()
+        super().close()
+
+
+class RangeReader(io.RawIOBase):
+    """
+     Reads the bytes from start up to end of a binary file (which is closed along with it)
+    """
+
+    def __init__(self, stream, start, end):
+        self.stream = stream
+        self.stream.seek(start)
+        self.remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.remaining <= 0:
+            return 0
+        count = self.stream.readinto(memoryview(buffer)[:self.remaining])
+        self.remaining -= count
+        return count
+
+    def close(self):
+        self.stream.close()
+        super().close()
+
+
+# Compressed uploads are decompressed while they're being read, nothing is decompressed to disk
+_DECOMPRESSORS = {'gz': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}
+
+
+def get_compression(filename):
+    """
+     Returns the compression of a file ('gz', 'bz2' or 'xz') based on its extension, or None if it isn't compressed
+    """
+    extension = filename.rsplit('.', 1)[-1].lower()
+    return extension if extension in _DECOMPRESSORS else None
+
+
+def strip_compression(filename):
+    """
+     Returns the filename without its compression extension (e.g. 'data.csv.gz' -> 'data.csv')
+    """
+    return filename.rsplit('.', 1)[0] if get_compression(filename) else filename
+
+
+def get_format(filename):
+    """
+     Returns the format of a file (e.g. 'csv', 'zip', 'parquet'), which is its extension without compression
+    """
+    return strip_compression(filename).rsplit('.', 1)[-1].lower()
+
+
+def open_text(stream, progress=None, compression=None, digest=None):
+    """
+     Decodes a binary stream as text, decompressing it first if a compression is given.
+     If progress is given, the (compressed) bytes that are read are reported to it.
+     If digest (a hashlib object) is given, the (compressed) bytes that are read are hashed with it.
+    """
+    if progress is not None or digest is not None:
+        stream = io.BufferedReader(ProgressReader(stream, progress.add_bytes if progress else None, digest))
+    if compression is not None:
+        stream = _DECOMPRESSORS[compression](stream)
+    return io.TextIOWrapper(stream)
+
+
+def save_stream(stream, path):
+    """
+     Writes a binary stream to the given path & returns its SHA-256 digest (as a hex string)
+    """
+    digest = hashlib.sha256()
+    with open(path, 'wb') as output:
+        for block in iter(lambda: stream.read(COPY_BUFFER_SIZE), b''):
+            digest.update(block)
+            output.write(block)
+    return digest.hexdigest()
+
+
+def file_digest(path):
+    """
+     Returns the SHA-256 digest (as a hex string) of a file
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as stream:
+        for block in iter(lambda: stream.read(COPY_BUFFER_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@contextmanager
+def open_upload(file, progress=None):
+    """
+     Opens the given path as a text stream (reporting the bytes that are read to progress, if given).
+     Compressed files (see get_compression) are decompressed as they're read.
+     Text streams (e.g. ZIP archive members or uploads that are still arriving) are used as is.
+    """
+    if isinstance(file, str):
+        with open(file, 'rb') as stream:
+            yield open_text(stream, progress, get_compression(file))
+    else:
+        yield file
+
+
+def copy_csv(cursor, schema_name, table_name, columns, stream, header=False):
+    """
+     Streams CSV formatted data from a file-like object into the given table using COPY ... FROM STDIN.
+     The data is sent to the server COPY_BUFFER_SIZE bytes at a time, so the file never has to fit in memory.
+     Returns the amount of rows that were loaded.
+    """
+    query = 'COPY {}.{} ({}) FROM STDIN WITH (FORMAT csv{});'.format(*_ci(schema_name, table_name),
+                                                                    ', '.join(_ci(column) for column in columns),
+                                                                    ', HEADER true' if header else '')
+    cursor.copy_expert(query, stream, size=COPY_BUFFER_SIZE)
+    return cursor.rowcount
+
+
+def csv_ranges(path, parts):
+    """
+     Splits a CSV file into (at most) parts byte ranges of about the same size that hold whole records, so the ranges
+     can be parsed separately. The first range starts after the header. Returns a list of (start, end) tuples.
+     A record ends at a newline that isn't inside a quoted value, so the file is scanned once to keep track of the
+     quotes (an escaped quote "" counts twice & doesn't change whether a value is quoted).
+    """
+    size = os.path.getsize(path)
+    targets = [0] + [size * p_ix // parts for p_ix in range(1, parts)]
+    boundaries = list()
+    quoted = False
+    offset = 0
+    with open(path, 'rb') as stream:
+        for block in iter(lambda: stream.read(COPY_BUFFER_SIZE), b''):
+            position = 0
+            # Look for the first record boundary at or after each target, starting with the end of the header
+            while len(boundaries) < len(targets):
+                newline = block.find(b'\n', max(position, targets[len(boundaries)] - offset))
+                if newline == -1:
+                    break
+                quoted ^= block.count(b'"', position, newline) % 2 == 1
+                position = newline + 1
+                if not quoted:
+                    boundaries.append(offset + position)
+            if len(boundaries) == len(targets):
+                break
+            quoted ^= block.count(b'"', position) % 2 == 1
+            offset += len(block)
+
+    boundaries = [boundary for boundary in boundaries if boundary < size] + [size]
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _csv_value(value):
+    return '' if value is None else '"{}"'.format(str(value).replace('"', '""'))
+
+
+def copy_rows(cursor, schema_name, table_name, columns, rows):
+    """
+     Copies a list of rows (lists of strings, None stands for NULL) into the given table.
+     Returns the amount of rows that were loaded.
+    """
+    buffer = io.StringIO()
+    # Quote every value, so only NULL is written as an unquoted (and thus NULL) empty field. The csv module can't be
+    # used for this, it quotes None as well.
+    buffer.writelines(','.join(_csv_value(value) for value in row) + '\n' for row in rows)
+    buffer.seek(0)
+    return copy_csv(cursor, schema_name, table_name, columns, buffer)
+
+
+# Values that are loaded as NULL into typed (non-text) columns
+NULL_MARKERS = ('', 'NA', 'N/A', '#N/A', 'NULL', 'null', 'NaN', 'nan')
+
+# Column types that CSV values can be copied into as they are
+TEXT_TYPES = ('text', 'character varying', 'character varying(255)', 'varchar(255)')
+
+_INTEGER = re.compile(r'^\s*[+-]?\d+\s*$')
+_BIGINT_MAX = 2 ** 63 - 1
+
+
+def infer_sql_type(values):
+    """
+     Picks the PostgreSQL type for a column from a sample of its values (strings, None stands for NULL):
+     'bigint', 'double precision', 'timestamp' or, if nothing else fits, 'text'.
+    """
+    values = [value for value in values if value is not None and value not in NULL_MARKERS]
+    if not len(values):
+        return 'text'
+    if all(_INTEGER.match(value) and abs(int(value)) <= _BIGINT_MAX for value in values):
+        return 'bigint'
+    try:
+        [float(value) for value in values]
+        return 'double precision'
+    except ValueError:
+        pass
+    try:
+        pd.to_datetime(values, errors='raise')
+        return 'timestamp'
+    except (ValueError, OverflowError, TypeError):
+        return 'text'
+
+
+def cast_expression(column, column_type):
+    """
+     Returns the expression that converts a text column of a staging table to the given type
+    """
+    if column_type in TEXT_TYPES:
+        return _ci(column)
+    return 'CASE WHEN {0} IN ({1}) THEN NULL ELSE {0}::{2} END'.format(
+        _ci(column), ', '.join("'{}'".format(marker) for marker in NULL_MARKERS), column_type)
+
+
+def reconcile_columns(header, columns):
+    """
+     Maps the header of a file that is appended to a table onto the columns of that table: a header matches the
+     column with the same name or, failing that, the one that only differs in case & surrounding whitespace.
+     Returns the matched columns in the order of the header, raises a ValueError if a header matches no column
+     (or the same column as another header).
+    """
+    normalized = dict()
+    for column in columns:
+        normalized.setdefault(column.strip().lower(), column)
+
+    matched = list()
+    for name in header:
+        column = name if name in columns else normalized.get(name.strip().lower())
+        if column is None:
+            raise ValueError("Column '{}' doesn't exist in the table (expected one of: {})".format(
+                name, ', '.join(columns)))
+        if column in matched:
+            raise ValueError("Columns '{}' and '{}' both map to column '{}'".format(
+                header[matched.index(column)], name, column))
+        matched.append(column)
+    return matched
+
+
+def encode_cursor(ordering, row_id, value=None):
+    """
+     Returns the cursor token for keyset pagination that points just after a row, given by its id & (if the pages are
+     ordered by another column) its value of that column. ordering is the (column, asc|desc) tuple of the pages.
+    """
+    token = json.dumps([ordering[0], ordering[1], None if value is None else str(value), row_id])
+    return base64.urlsafe_b64encode(token.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token, ordering):
+    """
+     Returns the (id, value) tuple of the row a cursor token (see encode_cursor) points after.
+     Raises a ValueError if the token is invalid or was made for pages with another ordering.
+    """
+    try:
+        column, direction, value, row_id = json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if [column, direction] != list(ordering) or not isinstance(row_id, int):
+        raise ValueError('The cursor was made for another ordering of the table')
+    return row_id, value
+
+
+# The kinds of search of the table view: a substring of a value, or the words of the text of a row (full-text)
+SEARCH_TYPES = ('substring', 'fulltext')
+# Column types (as named by DataLoader.get_column_names_and_types) of which the text doesn't depend on any setting
+PLAIN_TEXT_TYPES = ('text', 'character', 'integer', 'smallint', 'numeric', 'boolean', 'uuid', 'json', 'jsonb')
+
+
+def search_expression(columns):
+    """
+     Returns the text expression that the search index of a table is built on (see SearchIndexer): the text of the
+     given columns, separated by a control character that isn't searched for, so a search can't match across columns
+    """
+    return '({})'.format(" || E'\\x1f' || ".join("coalesce(public.search_text({}), '')".format(_ci(column))
+                                                   for column in columns))
+
+
+def column_search_text(column, column_type):
+    """
+     Returns the text of a column as search_expression has it, for a search without the index. Only the values of
+     which the text depends on the settings of the session (e.g. dates & floating point numbers) go through the
+     search_text function, which is a lot slower than a cast.
+    """
+    if column_type in PLAIN_TEXT_TYPES:
+        return '{}::text'.format(_ci(column))
+    return 'public.search_text({})'.format(_ci(column))
+
+
+def search_document(columns):
+    """
+     Returns the tsvector expression that the full-text search of a table matches (see search_expression).
+     The text search configuration is given explicitly, which makes the expression immutable, so it can be indexed.
+    """
+    return "to_tsvector('{}', {})".format(FULL_TEXT_CONFIG, search_expression(columns))
+
+
+def fulltext_query(search):
+    """ Returns the tsquery expression of a full-text search, which matches rows that contain all words of search """
+    return "plainto_tsquery('{}', '{}')".format(FULL_TEXT_CONFIG, search.replace("'", "''").replace('%', '%%'))
+
+
+def like_pattern(search):
+    """
+     Returns the quoted LIKE pattern of a substring search. Wildcards in search are matched as they are, so a search
+     can't match across the columns of search_expression.
+    """
+    pattern = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return "'%%{}%%'".format(pattern.replace("'", "''").replace('%', '%%'))
+
+
+def raw_table_query(schema_name, table_name, columns, after_id=0, create=True):
+    """
+     Returns the query that fills the raw table of a table from the rows in the table itself (with id > after_id),
+     so uploaded data only has to be parsed and sent to the server once.
+     If create = True the raw table is created, otherwise the rows are appended to the existing raw table
+    """
+    column_list = ', '.join(_ci(column) for column in ['id'] + list(columns))
+    select_query = 'SELECT {} FROM {}.{} WHERE id > {}'.format(column_list, *_ci(schema_name, table_name),
+                                                               int(after_id))
+    if create:
+        return 'CREATE TABLE {}.{} AS {};'.format(*_ci(schema_name, '_raw_' + table_name), select_query)
+    return 'INSERT INTO {}.{} ({}) {};'.format(*_ci(schema_name, '_raw_' + table_name), column_list, select_query)
+
+
+# Everything that changes the meaning of a ';' in a SQL dump: quotes, comments and the ';' itself
+_SQL_SPECIAL = re.compile(r"['\";]|--|/\*")
+_SQL_CLOSING = {"'": "'", '"': '"', '--': '\n', '/*': '*/'}
+_SQL_IDENTIFIER = r'(?:"(?:[^"]|"")*"|[^\s.,()"]+)'
+_INSERT_HEAD = re.compile(r'\s*INSERT\s+INTO\s+((?:{0}\.)?{0})\s*(?:\(([^)]*)\))?\s*VALUES\s*'.format(_SQL_IDENTIFIER),
+                          re.IGNORECASE)
+_VALUES_TOKEN = re.compile(r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|[(),]|[^'"(),]+""")
+
+
+def split_sql_statements(stream, block_size=COPY_BUFFER_SIZE):
+    """
+     Reads a SQL dump block by block and yields its statements one by one (without the ';').
+     A ';' inside a quoted value, a quoted identifier or a comment doesn't end a statement. Comments are dropped.
+    """
+    statement = list()
+    pending = ''
+    inside = None  # The quote/comment we're currently in
+    while True:
+        block = stream.read(block_size)
+        text = pending + block
+        # Unless this is the end of the dump, the last character could be the first half of '--', '/*' or '*/',
+        # so it's only handled once the next block has been read
+        limit = len(text) - 1 if block else len(text)
+        pos = 0
+        while True:
+            if inside is None:
+                match = _SQL_SPECIAL.search(text, pos)
+                if match is None or match.start() >= limit:
+                    statement.append(text[pos:limit])
+                    break
+                token = match.group()
+                if token == ';':
+                    statement.append(text[pos:match.start()])
+                    yield ''.join(statement)
+                    statement = list()
+                else:
+                    # Quotes are part of the statement, comments aren't
+                    statement.append(text[pos:match.end() if token in '\'"' else match.start()])
+                    inside = token
+                pos = match.end()
+            else:
+                # A doubled quote inside a quoted value is handled as closing & reopening the quote
+                end = text.find(_SQL_CLOSING[inside], pos)
+                if end == -1 or end >= limit:
+                    if inside in '\'"':
+                        statement.append(text[pos:limit])
+                    break
+                end += len(_SQL_CLOSING[inside])
+                # A comment still separates the tokens around it
+                statement.append(text[pos:end] if inside in '\'"' else ' ')
+                inside = None
+                pos = end
+        pending = text[max(pos, limit):]
+
+        if not block:
+            break
+
+    if ''.join(statement).strip():
+        yield ''.join(statement)
+
+
+def _unquote_identifier(identifier):
+    identifier = identifier.strip()
+    if identifier.startswith('"'):
+        return identifier[1:-1].replace('""', '"')
+    return identifier
+
+
+def _sql_value(tokens):
+    value = ''.join(tokens).strip()
+    if value.upper() == 'NULL':
+        return None
+    if value.startswith("'"):
+        # Quoted literal, possibly followed by a cast (e.g. '2018-01-01'::date)
+        return value[1:value.rfind("'")].replace("''", "'")
+    return value
+
+
+def _parse_values(text):
+    depth = 0
+    row = list()
+    value = list()
+    for match in _VALUES_TOKEN.finditer(text):
+        token = match.group()
+        if token == '(':
+            depth += 1
+            if depth == 1:
+                row = list()
+                value = list()
+                continue
+        elif token == ')':
+            depth -= 1
+            if depth == 0:
+                row.append(_sql_value(value))
+                yield row
+                continue
+        elif token == ',' and depth == 1:
+            row.append(_sql_value(value))
+            value = list()
+            continue
+        if depth:
+            value.append(token)
+
+
+def parse_insert(statement):
+    """
+     Parses an 'INSERT INTO table_name [(column1, column2, ...)] VALUES (value1, value2, ...), (...), ...' statement.
+     Returns a (table name, column names or None, row generator) tuple, or None if this isn't an INSERT statement.
+     Quoted values are unquoted and NULL becomes None, all other values are returned as they're written.
+    """
+    match = _INSERT_HEAD.match(statement)
+    if match is None:
+        return None
+    table_name = _unquote_identifier(re.findall(_SQL_IDENTIFIER, match.group(1))[-1])
+    columns = None
+    if match.group(2) is not None:
+        columns = [_unquote_identifier(column) for column in re.findall(_SQL_IDENTIFIER, match.group(2))]
+    return table_name, columns, _parse_values(statement[match.end():])
+
+
+def open_columnar(path):
+    """
+     Opens a Parquet (.parquet), Feather (.feather) or Arrow IPC (.arrow) file. Returns its Arrow schema, its amount
+     of rows and a generator that reads its record batches one by one, so only one batch has to be in memory at a
+     time. Feather files are read as a whole, version 1 of the format (which older versions of pyarrow write) isn't
+     made of record batches.
+    """
+    if pyarrow is None:
+        raise Exception("Parquet & Arrow files can't be imported, pyarrow isn't installed")
+
+    if get_format(path) == 'parquet':
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+
+        def batches():
+            if hasattr(parquet_file, 'iter_batches'):
+                for batch in parquet_file.iter_batches():
+                    yield batch
+            else:
+                # Older versions of pyarrow can only read whole row groups
+                for r_ix in range(parquet_file.num_row_groups):
+                    for batch in parquet_file.read_row_group(r_ix).to_batches():
+                        yield batch
+
+        return parquet_file.schema.to_arrow_schema(), parquet_file.metadata.num_rows, batches()
+
+    if get_format(path) == 'feather':
+        if hasattr(pyarrow.feather, 'read_table'):
+            table = pyarrow.feather.read_table(path)
+        else:
+            # Older versions of pyarrow can only read Feather files into a DataFrame
+            table = pyarrow.Table.from_pandas(pyarrow.feather.read_feather(path), preserve_index=False)
+        return table.schema, table.num_rows, iter(table.to_batches())
+
+    # The file is memory mapped, reading a batch only touches the part of the file that holds it
+    reader = pyarrow.ipc.open_file(pyarrow.memory_map(path, 'r'))
+    row_count = sum(reader.get_batch(b_ix).num_rows for b_ix in range(reader.num_record_batches))
+    return reader.schema, row_count, (reader.get_batch(b_ix) for b_ix in range(reader.num_record_batches))
+
+
+def arrow_sql_type(arrow_type):
+    """
+     Returns the PostgreSQL type for a column of the given Arrow type. Nested types (lists, structs, ...) become text.
+    """
+    types = pyarrow.types
+    if types.is_dictionary(arrow_type):
+        return arrow_sql_type(arrow_type.value_type)
+    if types.is_boolean(arrow_type):
+        return 'boolean'
+    if types.is_int8(arrow_type) or types.is_int16(arrow_type) or types.is_uint8(arrow_type):
+        return 'smallint'
+    if types.is_int32(arrow_type) or types.is_uint16(arrow_type):
+        return 'integer'
+    if types.is_int64(arrow_type) or types.is_uint32(arrow_type):
+        return 'bigint'
+    if types.is_uint64(arrow_type):
+        return 'numeric(20)'
+    if types.is_float16(arrow_type) or types.is_float32(arrow_type):
+        return 'real'
+    if types.is_float64(arrow_type):
+        return 'double precision'
+    if types.is_decimal(arrow_type):
+        return 'numeric({}, {})'.format(arrow_type.precision, arrow_type.scale)
+    if types.is_date(arrow_type):
+        return 'date'
+    if types.is_timestamp(arrow_type):
+        return 'timestamp with time zone' if arrow_type.tz else 'timestamp'
+    if types.is_time(arrow_type):
+        return 'time'
+    if types.is_binary(arrow_type) or types.is_fixed_size_binary(arrow_type):
+        return 'bytea'
+    return 'text'
+
+
+def arrow_rows(batch):
+    """
+     Converts a record batch to a list of rows that can be passed to copy_rows.
+     Binary values are written in PostgreSQL's hex format and nested values as JSON.
+    """
+    types = pyarrow.types
+    columns = list()
+    for column, field in zip(batch.columns, batch.schema):
+        values = column.to_pylist()
+        if types.is_binary(field.type) or types.is_fixed_size_binary(field.type):
+            values = [None if value is None else '\\x' + value.hex() for value in values]
+        elif types.is_nested(field.type):
+            values = [None if value is None else json.dumps(value, default=str) for value in values]
+        columns.append(values)
+    return [list(row) for row in zip(*columns)]
+
+
+class ColumnCache:
+    """
+     Keeps the columns (names & types, in order) of tables in memory, so they're only looked up in the (slow)
+     information_schema once. The cache is shared by all ColumnCaches & filled by DataLoader.get_column_names_and_types.
+     Every change of the columns of a table has to invalidate its entry: History.bump_version does so for all logged
+     changes & undos, other changes (e.g. renaming or dropping tables) invalidate the entry themselves.
+     The COLUMN_CACHE_SIZE most recently used tables are kept, for at most COLUMN_CACHE_TTL seconds, which bounds how
+     long changes by other processes of the app can go unnoticed.
+    """
+
+    # (schema id, table name) -> (time cached, [(name, type), ...]), least recent first
+    _columns = OrderedDict()
+    _lock = threading.Lock()
+    # Bumped by every invalidation, so columns that were looked up before an invalidation aren't cached after it
+    _generation = 0
+
+    def get(self, schema_id, table_name):
+        """ Returns the cached [(name, type), ...] of a table, or None """
+        key = (str(schema_id), table_name)
+        with ColumnCache._lock:
+            if key not in ColumnCache._columns:
+                return None
+            cached, columns = ColumnCache._columns[key]
+            if time.monotonic() - cached > COLUMN_CACHE_TTL:
+                del ColumnCache._columns[key]
+                return None
+            ColumnCache._columns.move_to_end(key)
+            return columns
+
+    def generation(self):
+        """ Returns the generation to pass to set for columns that are looked up now """
+        return ColumnCache._generation
+
+    def set(self, schema_id, table_name, columns, generation):
+        """ Caches the [(name, type), ...] of a table, unless an entry was invalidated since generation """
+        with ColumnCache._lock:
+            if generation != ColumnCache._generation:
+                return
+            ColumnCache._columns[(str(schema_id), table_name)] = (time.monotonic(), list(columns))
+            while len(ColumnCache._columns) > COLUMN_CACHE_SIZE:
+                ColumnCache._columns.popitem(last=False)
+
+    def invalidate(self, schema_id, table_name=None):
+        """ Drops the cached columns of a table, or of all tables of the dataset if table_name isn't given """
+        with ColumnCache._lock:
+            ColumnCache._generation += 1
+            if table_name is not None:
+                ColumnCache._columns.pop((str(schema_id), table_name), None)
+                return
+            for key in [key for key in ColumnCache._columns if key[0] == str(schema_id)]:
+                del ColumnCache._columns[key]
@@ -1,14 +1,31 @@
 import csv
-import re
-import shutil
-import pandas as pd
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from uuid import uuid4
 from zipfile import ZipFile
-from psycopg2 import IntegrityError
-
-from app import app, database as db, ACTIVE_USER_TIME_SECONDS, BACKUP_LIMIT
+from psycopg2 import DataError, IntegrityError
+
+from app import app, database as db, ACTIVE_USER_TIME_SECONDS, BACKUP_LIMIT, COLUMNAR_EXTENSIONS, COPY_BUFFER_SIZE, \
+    CSV_PARALLEL_SIZE, CSV_WORKERS, DUMP_BATCH_SIZE, FILTERED_COUNT_CACHE_SIZE, INDEX_ADVISOR_INTERVAL, \
+    INDEX_ADVISOR_MIN_ROWS, INDEX_ADVISOR_MIN_USES, INDEX_ADVISOR_RETRY_HOURS, INDEX_ADVISOR_UNUSED_DAYS, \
+    PAGE_CACHE_SIZE, PAGE_CACHE_TTL, ROW_COUNT_ESTIMATE_THRESHOLD, SEARCH_INDEX_MIN_ROWS, SEARCH_INDEX_WORKERS, \
+    TABLE_STREAM_BATCH_SIZE, TYPE_SAMPLE_HEAD, TYPE_SAMPLE_SIZE, UPLOAD_CHUNK_SIZE, UPLOAD_DEDUPLICATION, \
+    UPLOAD_FOLDER, UPLOAD_PROGRESS_INTERVAL, UPLOAD_SESSION_POLL_INTERVAL, UPLOAD_SESSION_STALL_TIMEOUT, \
+    UPLOAD_SESSION_TIMEOUT, UPLOAD_SESSION_WORKERS, UPLOAD_WORKERS, ZIP_WORKERS
 from app.history.models import History
 from app.data_transform.helpers import create_serial_sequence
+from app.data_service.helpers import arrow_rows, arrow_sql_type, cast_expression, column_search_text, copy_csv, \
+    copy_rows, csv_ranges, decode_cursor, encode_cursor, file_digest, fulltext_query, get_compression, get_format, \
+    infer_sql_type, like_pattern, open_columnar, open_text, open_upload, parse_insert, raw_table_query, \
+    reconcile_columns, search_document, search_expression, split_sql_statements, ColumnCache, RangeReader, \
+    SEARCH_TYPES, TEXT_TYPES
 
 history = History()
 
@@ -25,6 +42,16 @@ def _cv(*args: str):
     return ["'{}'".format(str(arg).replace("'", "''")) for arg in args]
 
 
+def _escape_percent(text):
+    # Free text (e.g. error messages) ends up in the query itself, where a single % is a placeholder
+    return text.replace('%', '%%')
+
+
+def _suffixed_name(name, suffix):
+    # Like PostgreSQL names a pkey/sequence: identifiers are cut at 63 bytes, so the name is shortened to fit the suffix
+    return name.encode('utf-8')[:63 - len(suffix)].decode('utf-8', 'ignore') + suffix
+
+
 class Dataset:
     def __init__(self, id, name, desc, owner, moderators=None, active_users_count=0):
         self.name = name
@@ -45,14 +72,17 @@ class Column:
 
 
 class Table:
-    def __init__(self, name, desc, rows=None, columns=None, active_users_count=0, total_size=0):
+    def __init__(self, name, desc, rows=None, columns=None, active_users_count=0, total_size=0, total_size_exact=True):
         self.name = name
         self.desc = desc
         self.rows = rows or []
         self.columns = columns or []
         self.active_users_count = active_users_count
         self.total_size = total_size
+        self.total_size_exact = total_size_exact  # False if total_size is an estimate (see RowCounter)
+        self.filtered_size = total_size  # rows that match the search of the page
         self.dataset = None
+        self.next_cursor = None  # cursor token for the next page (keyset pagination)
 
     def __eq__(self, other):
         return self.name == other.name and self.desc == other.desc
@@ -173,7 +203,209 @@ class ActiveUserHandler:
             raise e
 
 
+class RowCounter:
+    """
+     Counts the rows of tables without scanning them for every page that is shown.
+     Exact counts are kept in the Row_Count table & are changed along with the table: rows that are added or deleted
+     update the count, other (logged) changes drop it (see History.log_action). A count is also only used as long as
+     the table isn't replaced by a new one (with another oid).
+     Tables of which PostgreSQL estimates at least ROW_COUNT_ESTIMATE_THRESHOLD rows aren't counted at all, for them
+     the estimate of the planner (pg_class.reltuples, scaled to the current size of the table) is used instead.
+     Only tables with metadata keep a count: other tables (e.g. the raw tables of uploads) are changed without
+     updating Row_Count, so they're counted every time.
+     The amount of rows that match a search is cached in memory per version of the table, see get_filtered_count.
+    """
+
+    # (schema id, table name, table version, search) -> amount of rows, shared by all RowCounters, least recent first
+    _filtered_counts = OrderedDict()
+    _filtered_counts_lock = threading.Lock()
+
+    def __init__(self):
+        pass
+
+    def get_count(self, schema_id, table_name):
+        """ Returns the (amount of rows, whether it's exact) of a table """
+        schema_name = 'schema-' + str(schema_id)
+        try:
+            row = db.engine.execute(
+                'SELECT c.oid, c.reltuples, c.relpages, pg_relation_size(c.oid) / current_setting(\'block_size\')::int '
+                'AS pages, m.id_table IS NOT NULL AS has_metadata, r.table_oid, r.row_count FROM pg_class c '
+                'LEFT JOIN metadata m ON m.id_dataset = {0} AND m.id_table = {1} LEFT JOIN Row_Count r '
+                'ON r.id_dataset = {0} AND r.id_table = {1} WHERE c.oid = to_regclass({2});'.format(
+                    *_cv(schema_name, table_name, '{}.{}'.format(*_ci(schema_name, table_name))))).first()
+            if row is None:
+                # Only the metadata of the table exists
+                return 0, True
+            if row['has_metadata'] and row['row_count'] is not None and row['table_oid'] == row['oid']:
+                return row['row_count'], True
+
+            # reltuples is -1 (PostgreSQL 14+) for tables that were never vacuumed or analyzed
+            reltuples = max(row['reltuples'], 0)
+            estimate = reltuples / row['relpages'] * row['pages'] if row['relpages'] > 0 else reltuples
+            if estimate >= ROW_COUNT_ESTIMATE_THRESHOLD:
+                return int(estimate), False
+
+            row_count = db.engine.execute('SELECT count(*) FROM {}.{};'.format(
+                *_ci(schema_name, table_name))).first()[0]
+            if row['has_metadata']:
+                self.set_count(schema_id, table_name, row_count)
+            return row_count, True
+        except Exception as e:
+            app.logger.error("[ERROR] Couldn't count the rows of table '{}'".format(table_name))
+            app.logger.exception(e)
+            raise e
+
+    def set_count(self, schema_id, table_name, row_count):
+        """ Saves the exact amount of rows of a table """
+        schema_name = 'schema-' + str(schema_id)
+        db.engine.execute(
+            'INSERT INTO Row_Count (id_dataset, id_table, table_oid, row_count) VALUES ({0}, {1}, {2}::regclass, {3}) '
+            'ON CONFLICT (id_dataset, id_table) DO UPDATE SET table_oid = {2}::regclass, row_count = {3};'.format(
+                *_cv(schema_name, table_name, '{}.{}'.format(*_ci(schema_name, table_name))), int(row_count)))
+
+    def add_rows(self, schema_id, table_name, row_delta):
+        """ Changes the saved amount of rows of a table (if any) by row_delta & bumps the version of the table """
+        schema_name = 'schema-' + str(schema_id)
+        db.engine.execute('UPDATE Row_Count SET row_count = row_count + {} WHERE id_dataset={} AND id_table={};'.format(
+            int(row_delta), *_cv(schema_name, table_name)))
+        history.bump_version(schema_id, table_name)
+
+    def get_version(self, schema_id, table_name):
+        """
+         Returns the version of a table: its oid (which changes if it's replaced) & the version in its metadata
+         (which is bumped by every change, see History.log_action). None if the table has no metadata.
+        """
+        schema_name = 'schema-' + str(schema_id)
+        row = db.engine.execute('SELECT to_regclass({})::oid AS oid, version FROM metadata WHERE id_dataset={} AND '
+                                'id_table={};'.format(*_cv('{}.{}'.format(*_ci(schema_name, table_name)), schema_name,
+                                                           table_name))).first()
+        return None if row is None else (row['oid'], row['version'])
+
+    def get_filtered_count(self, schema_id, table_name, search, condition):
+        """
+         Returns the amount of rows of a table that match a search, of which condition is the WHERE condition.
+         The counts are cached per version of the table (see get_version), so paging through the results of a search
+         (or going back to an earlier search) doesn't count them again until the table changes.
+         The FILTERED_COUNT_CACHE_SIZE most recently used counts are kept.
+        """
+        schema_name = 'schema-' + str(schema_id)
+        try:
+            version = self.get_version(schema_id, table_name)
+            key = (str(schema_id), table_name, version, search)
+            if version is not None:
+                with RowCounter._filtered_counts_lock:
+                    if key in RowCounter._filtered_counts:
+                        RowCounter._filtered_counts.move_to_end(key)
+                        return RowCounter._filtered_counts[key]
+
+            row_count = db.engine.execute('SELECT count(*) FROM {}.{} WHERE {};'.format(
+                *_ci(schema_name, table_name), condition)).first()[0]
+            if version is not None:
+                with RowCounter._filtered_counts_lock:
+                    RowCounter._filtered_counts[key] = row_count
+                    while len(RowCounter._filtered_counts) > FILTERED_COUNT_CACHE_SIZE:
+                        RowCounter._filtered_counts.popitem(last=False)
+            return row_count
+        except Exception as e:
+            app.logger.error("[ERROR] Couldn't count the rows of table '{}' that match the search".format(table_name))
+            app.logger.exception(e)
+            raise e
+
+
+class PageCache:
+    """
+     Keeps the pages of tables that were shown recently in memory, so a page that several users look at is only
+     fetched once. Pages are cached per version of their table (see RowCounter.get_version), which every change of
+     the table bumps, so a cached page is never served after its table has changed. Looking up the version is the
+     only query for a cached page.
+     The PAGE_CACHE_SIZE most recently used pages are kept, for at most PAGE_CACHE_TTL seconds.
+    """
+
+    # (schema id, table name, table version, page arguments) -> (time cached, page), least recent first
+    _pages = OrderedDict()
+    _pages_lock = threading.Lock()
+
+    def __init__(self):
+        pass
+
+    def get_page(self, key):
+        """ Returns a copy of the cached Table with the given key, or None if it isn't cached (anymore) """
+        with PageCache._pages_lock:
+            if key not in PageCache._pages:
+                return None
+            cached, page = PageCache._pages[key]
+            if time.monotonic() - cached > PAGE_CACHE_TTL:
+                del PageCache._pages[key]
+                return None
+            PageCache._pages.move_to_end(key)
+        return self._copy(page)
+
+    def set_page(self, key, table):
+        """ Caches a copy of a Table """
+        page = self._copy(table)
+        with PageCache._pages_lock:
+            PageCache._pages[key] = (time.monotonic(), page)
+            PageCache._pages.move_to_end(key)
+            while len(PageCache._pages) > PAGE_CACHE_SIZE:
+                PageCache._pages.popitem(last=False)
+
+    def _copy(self, table):
+        # The rows of a Table are lists, which its user may change
+        copy = Table(table.name, table.desc, rows=[list(row) for row in table.rows], columns=list(table.columns),
+                     total_size=table.total_size, total_size_exact=table.total_size_exact)
+        copy.filtered_size = table.filtered_size
+        copy.dataset = table.dataset
+        copy.next_cursor = table.next_cursor
+        return copy
+
+
+class ServerProcess:
+    """
+     Tells the processes of the app apart, so a process can clean up the work that another process left unfinished
+     when it stopped (e.g. its upload jobs & index builds) without touching the work of processes that still run.
+     Every process gets a number from the Server_Process sequence & holds an advisory lock on it for as long as it
+     runs, on a connection of its own: PostgreSQL releases the lock as soon as the process (or its connection) is gone.
+    """
+
+    # The first key of the advisory locks of the processes, the second key is the number of the process
+    _lock_key = 5001
+    _id = None
+    _connection = None
+    _id_lock = threading.Lock()
+
+    def __init__(self):
+        pass
+
+    def get_id(self):
+        """ Returns the number of this process, the first call takes its advisory lock """
+        with ServerProcess._id_lock:
+            if ServerProcess._id is None:
+                connection = db.engine.raw_connection()
+                # The lock lasts as long as the connection, so the connection can't go back to the pool
+                connection.detach()
+                cursor = connection.cursor()
+                cursor.execute("SELECT nextval('Server_Process');")
+                process_id = cursor.fetchone()[0]
+                cursor.execute('SELECT pg_advisory_lock({}, {});'.format(ServerProcess._lock_key, int(process_id)))
+                connection.commit()
+                ServerProcess._connection = connection
+                ServerProcess._id = process_id
+            return ServerProcess._id
+
+    def gone(self, owner):
+        """
+         Returns a SQL condition that holds if the process with the number in the SQL expression owner isn't running
+         anymore, or if owner is NULL
+        """
+        return ("NOT EXISTS (SELECT 1 FROM pg_locks WHERE locktype = 'advisory' AND granted AND "
+                "database = (SELECT oid FROM pg_database WHERE datname = current_database()) AND "
+                "classid = {} AND objid = ({})::oid AND objsubid = 2)".format(ServerProcess._lock_key, owner))
+
+
 class DataLoader:
+    # The schema of the tables that the parts of a large CSV file are loaded into, see _copy_csv
+    _part_schema = '_csv_parts'
+
     def __init__(self):
         pass
 
@@ -241,6 +473,7 @@ class DataLoader:
             db.engine.execute('DELETE FROM Dataset WHERE id = {};'.format(_cv(schema_name)))
 
             db.engine.execute('DROP SCHEMA IF EXISTS {} CASCADE;'.format(_ci(schema_name)))
+            ColumnCache().invalidate(schema_id)
 
             # check if there are datasets. If not, clean available_schema
             rows = db.engine.execute('SELECT COUNT(*) FROM Dataset;')
@@ -286,9 +519,11 @@ class DataLoader:
             app.logger.exception(e)
             raise e
 
-    def create_table(self, name, schema_id, columns, desc="Default description", raw=False, metadata_only=False):
+    def create_table(self, name, schema_id, columns, desc="Default description", raw=False, metadata_only=False,
+                     types=None):
         """
          This method takes a schema, name and a list of columns and creates the corresponding table
+         If types is given, it holds the PostgreSQL type of each column (default: varchar(255))
         """
 
         connection = db.engine.connect()
@@ -301,8 +536,9 @@ class DataLoader:
 
                 query += 'id serial primary key'  # Since we don't know what the actual primary key should be, just assign an id
 
-                for column in columns:
-                    query = query + ', \n\"' + column.replace('"', '') + '\" varchar(255)'
+                types = types or ['varchar(255)'] * len(columns)
+                for column, column_type in zip(columns, types):
+                    query = query + ', \n\"' + column.replace('"', '') + '\" ' + column_type
                 query += '\n);'
 
                 raw_table_query = query.format(*_ci(schema_name, raw_table_name))
@@ -327,13 +563,7 @@ class DataLoader:
                 raise e
 
             # Log action to history
-            history.log_action(schema_id, name, datetime.now(), 'Created table',
-                               'DROP TABLE IF EXISTS {}.{};'.format(*_ci(schema_name, name)) +
-                               'DROP TABLE IF EXISTS {}.{};'.format(*_ci(schema_name, raw_table_name)) +
-                               'DELETE FROM METADATA WHERE ID_DATASET={} AND ID_TABLE={};'.format(
-                                   *_cv(schema_name, name)) +
-                               'DELETE FROM HISTORY WHERE ID_DATASET={} AND ID_TABLE={};'.format(
-                                   *_cv(schema_name, name)))
+            self._log_created_table(schema_id, name)
 
             transaction.commit()
 
@@ -343,6 +573,79 @@ class DataLoader:
             app.logger.exception(e)
             raise e
 
+    def _lock_for_append(self, cursor, schema_name, tablename):
+        """
+         Locks a table that rows are appended to until the transaction of cursor ends & returns its highest id.
+         Appends to the table wait for each other, so the rows with a higher id are the ones this transaction adds.
+        """
+        cursor.execute('LOCK TABLE {}.{} IN SHARE ROW EXCLUSIVE MODE;'.format(*_ci(schema_name, tablename)))
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM {}.{};'.format(*_ci(schema_name, tablename)))
+        return cursor.fetchone()[0]
+
+    def _report_loaded_ids(self, cursor, schema_name, tablename, last_id, progress):
+        """ Reports the ids of the rows a load added after last_id to progress (see UploadProgress.loaded_ids) """
+        if progress is None:
+            return
+        cursor.execute('SELECT MAX(id) FROM {}.{} WHERE id > {};'.format(*_ci(schema_name, tablename), int(last_id)))
+        max_id = cursor.fetchone()[0]
+        progress.loaded_ids = None if max_id is None else (last_id + 1, max_id)
+
+    def _log_created_table(self, schema_id, name):
+        schema_name = 'schema-' + str(schema_id)
+        history.log_action(schema_id, name, datetime.now(), 'Created table',
+                           'DROP TABLE IF EXISTS {}.{};'.format(*_ci(schema_name, name)) +
+                           'DROP TABLE IF EXISTS {}.{};'.format(*_ci(schema_name, '_raw_' + name)) +
+                           'DELETE FROM METADATA WHERE ID_DATASET={} AND ID_TABLE={};'.format(
+                               *_cv(schema_name, name)) +
+                           'DELETE FROM HISTORY WHERE ID_DATASET={} AND ID_TABLE={};'.format(
+                               *_cv(schema_name, name)))
+
+    def _create_staging_table(self, cursor, schema_id, columns, types=None):
+        """
+         Creates a table without primary key for the rows of a new table to be loaded into (in the transaction of
+         cursor). Loading into it skips the index maintenance, see _promote_staging_table.
+         Returns the name of the staging table.
+        """
+        schema_name = 'schema-' + str(schema_id)
+        staging_name = '_staging_' + uuid4().hex
+        types = types or ['varchar(255)'] * len(columns)
+        cursor.execute('CREATE TABLE {}.{} (id serial, {});'.format(
+            *_ci(schema_name, staging_name),
+            ', '.join(_ci(column) + ' ' + column_type for column, column_type in zip(columns, types))))
+        return staging_name
+
+    def _promote_staging_table(self, cursor, schema_id, staging_name, name, desc='Default description'):
+        """
+         Turns a loaded staging table into the table name: the primary key is built in one go now that all rows are
+         in, the table is renamed and its metadata is added.
+         All of this happens in the transaction of the load, so the table only appears once it's complete. The caller
+         logs the new table (see _log_created_table) once the load is committed.
+        """
+        schema_name = 'schema-' + str(schema_id)
+        cursor.execute('ALTER TABLE {}.{} ADD CONSTRAINT {} PRIMARY KEY (id);'.format(
+            *_ci(schema_name, staging_name, self._free_relation_name(cursor, schema_name, name, '_pkey'))))
+        cursor.execute('SELECT pg_get_serial_sequence({}, {});'.format(
+            *_cv('{}.{}'.format(*_ci(schema_name, staging_name)), 'id')))
+        sequence = cursor.fetchone()[0]
+        cursor.execute('ALTER SEQUENCE {} RENAME TO {};'.format(
+            sequence, _ci(self._free_relation_name(cursor, schema_name, name, '_id_seq'))))
+        cursor.execute('ALTER TABLE {}.{} RENAME TO {};'.format(*_ci(schema_name, staging_name, name)))
+        cursor.execute('INSERT INTO metadata VALUES({}, {}, {});'.format(*_cv(schema_name, name, desc)))
+
+    def _free_relation_name(self, cursor, schema_name, name, suffix):
+        """
+         Returns the name PostgreSQL would give the pkey/sequence (suffix) of table name. Like PostgreSQL, a number is
+         added to the suffix if a relation (e.g. a backup or a user's table) already has that name in the schema.
+        """
+        candidate = _suffixed_name(name, suffix)
+        number = 0
+        while True:
+            cursor.execute('SELECT to_regclass({}) IS NULL;'.format(_cv('{}.{}'.format(*_ci(schema_name, candidate)))))
+            if cursor.fetchone()[0]:
+                return candidate
+            number += 1
+            candidate = _suffixed_name(name, suffix + str(number))
+
     def delete_table(self, name, schema_id):
         connection = db.engine.connect()
         transaction = connection.begin()
@@ -361,6 +664,20 @@ class DataLoader:
             # Delete history
             history_query = 'DELETE FROM HISTORY WHERE id_dataset={} AND id_table={};'.format(*_cv(schema_name, name))
 
+            connection.execute('DELETE FROM Row_Count WHERE id_dataset={} AND id_table={};'.format(
+                *_cv(schema_name, name)))
+            # The search index itself is dropped along with the table
+            connection.execute('DELETE FROM Search_Index WHERE id_dataset={} AND id_table={};'.format(
+                *_cv(schema_name, name)))
+            connection.execute('DELETE FROM Advised_Index WHERE id_dataset={} AND id_table={};'.format(
+                *_cv(schema_name, name)))
+            connection.execute('DELETE FROM Column_Usage WHERE id_dataset={} AND id_table={};'.format(
+                *_cv(schema_name, name)))
+
+            # Evict the uploads that were loaded into this table from the upload registry
+            connection.execute('DELETE FROM Upload_Registry WHERE id_dataset={} AND table_name={};'.format(
+                *_cv(schema_name, name)))
+
             # Delete backups
             backups = self.get_backups(schema_id, name)
             for backup in backups:
@@ -373,6 +690,8 @@ class DataLoader:
             connection.execute(dedup_table_query)
 
             transaction.commit()
+            # The table, its raw table & its dedup tables are gone
+            ColumnCache().invalidate(schema_id)
         except Exception as e:
             transaction.rollback()
             app.logger.error("[ERROR] Failed to delete table '" + name + "'")
@@ -418,7 +737,9 @@ class DataLoader:
                                                                                     column_tuple),
                                                                                 values_query)
                     history.log_action(schema_id, table_name, datetime.now(), 'Deleted row #' + str(row_id),
-                                       inverse_query)
+                                       inverse_query, row_delta=-1)
+                else:
+                    RowCounter().add_rows(schema_id, table_name, -1)
         except Exception as e:
             app.logger.error("[ERROR] Unable to delete row from table '" + table_name + "'")
             app.logger.exception(e)
@@ -472,7 +793,9 @@ class DataLoader:
             self.delete_row(schema_id, table_name, to_delete, False)
 
             if len(to_delete):
-                history.log_action(schema_id, table_name, datetime.now(), 'Deleted rows on predicate', inverse_query)
+                # delete_row already counted the deleted rows
+                history.log_action(schema_id, table_name, datetime.now(), 'Deleted rows on predicate', inverse_query,
+                                   row_delta=0)
         except Exception as e:
             app.logger.error('[ERROR] Unable to fetch rows to delete from ' + table_name)
             app.logger.exception(e)
@@ -534,7 +857,9 @@ class DataLoader:
             row_id = db.engine.execute('SELECT MAX(id) FROM {}.{};'.format(*_ci(schemaname, table))).fetchone()[0]
             inverse_query = 'DELETE FROM {}.{} WHERE id={};'.format(*_ci(schemaname, table), _cv(row_id))
             history.log_action(schema_id, table, datetime.now(), 'Added row with values ' + ' '.join(values),
-                               inverse_query)
+                               inverse_query, row_delta=1)
+        else:
+            RowCounter().add_rows(schema_id, table, 1)
 
     def insert_column(self, schema_id, table_name, column_name, column_type, enable_history=True):
         schema_name = 'schema-' + str(schema_id)
@@ -554,6 +879,8 @@ class DataLoader:
                 *_ci(schema_name, table_name, column_name))
             history.log_action(schema_id, table_name, datetime.now(), 'Added column with name ' + column_name,
                                inverse_query)
+        else:
+            ColumnCache().invalidate(schema_id, table_name)
 
     def rename_column(self, schema_id, table_name, column_name, new_column_name):
         schema_name = 'schema-' + str(schema_id)
@@ -599,142 +926,483 @@ class DataLoader:
 
     # Data uploading handling
     def process_csv(self, file, schema_id, tablename, table_description='Default description', append=False,
-                    type_deduction=False):
+                    type_deduction=False, progress=None):
         """
-         This method takes a filename for a CSV file and processes it into a table.
+         This method takes a filename (or an opened text stream) for a CSV file and processes it into a table.
          A table name should be provided by the user / caller of this method.
-         If append = True, a table should already exist & the data will be added to this table
+         If append = True, a table should already exist & the data will be added to this table (see _append_csv)
+         The data is streamed into the database using COPY, so the file never has to fit in memory.
+         Large files are loaded in parallel parts, see _split_csv.
+         If progress (an UploadProgress) is given, the bytes read & rows loaded are reported to it.
+         Returns the amount of rows that were loaded.
         """
 
-        try:
-            table_exists = self.table_exists(tablename, schema_id)
-            if append and not table_exists:
-                app.logger.error("[ERROR] Appending to non-existent table.")
-                return
-            elif not append and table_exists:
-                app.logger.error("[ERROR] Cannot overwrite existing table.")
-                return
+        table_exists = self.table_exists(tablename, schema_id)
+        if append and not table_exists:
+            app.logger.error("[ERROR] Appending to non-existent table.")
+            return
+        elif not append and table_exists:
+            app.logger.error("[ERROR] Cannot overwrite existing table.")
+            return
 
-            raw_tablename = '_raw_' + tablename
-            schema_name = 'schema-' + str(schema_id)
-
-            with open(file, "r") as csv:
-                for line in csv:
-                    if not append:
-                        columns = line.strip().split(',')
-                        if not type_deduction:
-                            self.create_table(tablename, schema_id, columns, desc=table_description, raw=True)
-                        else:
-                            # Fancy
-                            self.create_table(tablename, schema_id, columns, desc=table_description, metadata_only=True)
-                    break
+        raw_tablename = '_raw_' + tablename
+        schema_name = 'schema-' + str(schema_id)
+        start_time = time.perf_counter()
 
-            df = pd.read_csv(file)
-            for column in df.columns:
-                if pd.api.types.is_string_dtype(df[column]):
-                    df[column] = pd.to_datetime(df[column], errors='ignore')
-            df.index.name = 'id'
-            df.to_sql(name=tablename, con=db.engine, schema=schema_name, index=type_deduction, if_exists='append')
-            df.to_sql(name=raw_tablename, con=db.engine, schema=schema_name, index=type_deduction, if_exists='append')
-            if type_deduction:
-                create_serial_sequence(schema_name, tablename)
+        parts = self._split_csv(file)
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            last_id = self._lock_for_append(cursor, schema_name, tablename) if append else 0
+
+            # When loading in parts, only the header is read here & the parts report their own progress
+            with open_upload(file, None if parts else progress) as csv_file:
+                header = [column.replace('"', '') for column in next(csv.reader([csv_file.readline()]))]
+                if parts and progress is not None:
+                    progress.add_bytes(parts[0][2])
+                if append:
+                    row_count, columns = self._append_csv(cursor, csv_file, schema_id, tablename, header, parts,
+                                                          progress)
+                elif not type_deduction:
+                    columns = header
+                    # A new table is loaded into a staging table that takes its place once all rows are in
+                    staging_name = self._create_staging_table(cursor, schema_id, columns)
+
+                    # Let the server parse the rest of the file, this is a lot faster than parsing it ourselves
+                    row_count = self._copy_csv(cursor, csv_file, schema_name, staging_name, columns, parts,
+                                               progress)
+                    self._promote_staging_table(cursor, schema_id, staging_name, tablename, table_description)
+                else:
+                    row_count = self._copy_csv_typed(cursor, csv_file, schema_id, tablename, table_description,
+                                                     header, parts, progress)
+                    columns = header
+
+            # Derive the raw data from the rows that were just loaded instead of loading the file a second time
+            create_raw = not (append and self.table_exists(raw_tablename, schema_id))
+            cursor.execute(raw_table_query(schema_name, tablename, columns, last_id, create=create_raw))
+            self._report_loaded_ids(cursor, schema_name, tablename, last_id, progress)
+            connection.commit()
         except Exception as e:
+            # A new table was never promoted, so this also removes its staging table
+            connection.rollback()
             app.logger.error("[ERROR] Failed to process csv")
             app.logger.exception(e)
-            # delete all tables and entries where necessary
-            self.delete_table(tablename, schema_id)
-
             raise e
+        finally:
+            connection.close()
+            # The tables of the parts are only dropped now, the transaction of the load held locks on them
+            for part_name, _, _, _ in parts or list():
+                db.engine.execute('DROP TABLE IF EXISTS {}.{};'.format(*_ci(self._part_schema, part_name)))
+
+        self._count_loaded_rows(schema_id, tablename, row_count, append)
+        if progress is not None:
+            progress.add_rows(row_count)
+        elapsed = time.perf_counter() - start_time
+        app.logger.info("[INFO] Loaded {} rows into '{}' in {:.2f}s ({:.0f} rows/sec)".format(
+            row_count, tablename, elapsed, row_count / elapsed if elapsed else row_count))
+        return row_count
+
+    def _count_loaded_rows(self, schema_id, tablename, row_count, append):
+        # The rows of a load are counted anyway, so the row count of the table doesn't have to be counted again
+        if append:
+            RowCounter().add_rows(schema_id, tablename, row_count)
+        else:
+            # A new table is only logged once its load is committed, a failed load leaves no history behind
+            self._log_created_table(schema_id, tablename)
+            RowCounter().set_count(schema_id, tablename, row_count)
 
-    def process_zip(self, file, schema_id, type_deduction=False):
+    def _copy_csv_typed(self, cursor, csv_file, schema_id, tablename, table_description, columns, parts=None,
+                        progress=None):
         """
-         This method takes a ZIP archive filled with CSV files, and processes them individually
-         The name of the CSV file will be used as table name. If a table with the same name is found
-         the data will be appended
+         Loads a CSV file (of which the header with the columns was read) into a new table with type deduction:
+         the file is copied as text into a temporary staging table, the column types are deduced from a sample of it
+         (the first TYPE_SAMPLE_HEAD rows plus TYPE_SAMPLE_SIZE randomly chosen rows) and the rows are then converted
+         & inserted on the server into a staging table that is promoted afterwards (see _promote_staging_table).
+         If a row outside of the sample doesn't fit the deduced type of a column, that column falls back to text.
+         Returns the amount of rows that were loaded.
+        """
+        schema_name = 'schema-' + str(schema_id)
+        self._copy_csv_text(cursor, csv_file, columns, parts, progress)
+
+        cursor.execute('SELECT {0} FROM "_staging" WHERE "_line" <= {1} UNION ALL '
+                       '(SELECT {0} FROM "_staging" WHERE "_line" > {1} ORDER BY random() LIMIT {2});'.format(
+                           ', '.join(_ci(column) for column in columns), TYPE_SAMPLE_HEAD, TYPE_SAMPLE_SIZE))
+        sample = cursor.fetchall()
+        types = [infer_sql_type([row[c_ix] for row in sample]) for c_ix in range(len(columns))]
+        staging_name = self._create_staging_table(cursor, schema_id, columns, types)
+
+        while True:
+            cursor.execute('SAVEPOINT "typed_insert";')
+            try:
+                row_count = self._insert_converted(cursor, schema_name, staging_name, columns, types)
+                self._promote_staging_table(cursor, schema_id, staging_name, tablename, table_description)
+                return row_count
+            except DataError:
+                cursor.execute('ROLLBACK TO SAVEPOINT "typed_insert";')
+                # Sequences aren't rolled back, the ids of the next attempt start at 1 again
+                cursor.execute('SELECT setval(pg_get_serial_sequence({}, {}), 1, false);'.format(
+                    *_cv('{}.{}'.format(*_ci(schema_name, staging_name)), 'id')))
+
+            # Find the columns with values that don't fit the deduced type & fall back to text for them
+            fallback = list()
+            for c_ix, (column, column_type) in enumerate(zip(columns, types)):
+                if column_type == 'text':
+                    continue
+                cursor.execute('SAVEPOINT "typed_column";')
+                try:
+                    cursor.execute('SELECT count({}) FROM "_staging";'.format(cast_expression(column, column_type)))
+                except DataError:
+                    cursor.execute('ROLLBACK TO SAVEPOINT "typed_column";')
+                    fallback.append(c_ix)
+            if not len(fallback):
+                raise Exception("Couldn't convert the rows of '{}' to the deduced column types".format(tablename))
+            for c_ix in fallback:
+                app.logger.warning("[WARNING] Column '{}' of '{}' contains values that aren't of type {}, "
+                                   "falling back to text".format(columns[c_ix], tablename, types[c_ix]))
+                cursor.execute('ALTER TABLE {}.{} ALTER {} TYPE text;'.format(*_ci(schema_name, staging_name,
+                                                                                  columns[c_ix])))
+                types[c_ix] = 'text'
+
+    def _append_csv(self, cursor, csv_file, schema_id, tablename, header, parts=None, progress=None):
+        """
+         Appends a CSV file (of which the header was read) to an existing table. The header is matched to the columns
+         of the table once (see reconcile_columns), columns that the file doesn't have are left NULL.
+         If all matched columns hold text, the file is copied straight into the table. Otherwise it's copied as text
+         into a temporary staging table & converted to the types of the table on the server in a single INSERT.
+         Afterwards only the statistics of the matched columns are updated.
+         Returns the amount of rows that were appended and the (table) columns they were appended to.
+        """
+        schema_name = 'schema-' + str(schema_id)
+        types = self._get_column_types(cursor, schema_id, tablename)
+        columns = reconcile_columns(header, [column for column in types if column != 'id'])
+        types = [types[column] for column in columns]
+
+        if all(column_type in TEXT_TYPES for column_type in types):
+            row_count = self._copy_csv(cursor, csv_file, schema_name, tablename, columns, parts, progress)
+        else:
+            self._copy_csv_text(cursor, csv_file, columns, parts, progress)
+            row_count = self._insert_converted(cursor, schema_name, tablename, columns, types)
+
+        # The planner statistics of the other columns didn't change, so only these have to be sampled again
+        cursor.execute('ANALYZE {}.{} ({});'.format(*_ci(schema_name, tablename),
+                                                    ', '.join(_ci(column) for column in columns)))
+        return row_count, columns
+
+    def _copy_csv_text(self, cursor, csv_file, columns, parts=None, progress=None):
+        """
+         Copies (the rest of) a CSV file as text into the temporary table "_staging", which numbers its lines
+        """
+        cursor.execute('CREATE TEMP TABLE "_staging" ("_line" bigserial, {}) ON COMMIT DROP;'.format(
+            ', '.join(_ci(column) + ' text' for column in columns)))
+        self._copy_csv(cursor, csv_file, 'pg_temp', '_staging', columns, parts, progress)
+
+    def _split_csv(self, file):
+        """
+         Splits a large CSV file into parts that are loaded at the same time, see _copy_csv.
+         Returns a list of (name of the table for the part, path, start, end) tuples, where start & end are the byte
+         range of the part in the file (see csv_ranges), or None if the file is loaded at once: if it's a stream, if
+         it's compressed (so it can't be read from the middle) or if it's smaller than CSV_PARALLEL_SIZE.
+         The names of the tables start with the number of this process (see ServerProcess), see drop_csv_parts.
+        """
+        if not isinstance(file, str) or get_compression(file) is not None or CSV_WORKERS < 2 or \
+                os.path.getsize(file) < CSV_PARALLEL_SIZE:
+            return None
+        ranges = csv_ranges(file, CSV_WORKERS)
+        if len(ranges) < 2:
+            return None
+        part_prefix = '_part_{}_{}'.format(ServerProcess().get_id(), uuid4().hex)
+        return [('{}_{}'.format(part_prefix, p_ix), file, start, end) for p_ix, (start, end) in enumerate(ranges)]
+
+    def _copy_csv(self, cursor, csv_file, schema_name, tablename, columns, parts=None, progress=None):
+        """
+         Copies (the rest of) a CSV file into a table. If the file was split into parts (see _split_csv), every part
+         is copied into an UNLOGGED table of its own (in the schema _part_schema) over a separate connection, all at
+         the same time. The server parses each COPY in its own backend process, so the parsing is spread over the
+         cores of the server. The parts are then inserted into the table in order (in the transaction of cursor), so
+         the rows keep the order of the file. The caller drops the tables of the parts once this transaction is over,
+         the tables of a load that was interrupted are dropped later on (see drop_csv_parts).
+         Returns the amount of rows that were copied.
+        """
+        if parts is None:
+            return copy_csv(cursor, schema_name, tablename, columns, csv_file)
+
+        part_schema_name = self._part_schema
+        for part_name, _, _, _ in parts:
+            db.engine.execute('CREATE UNLOGGED TABLE {}.{} ({});'.format(
+                *_ci(part_schema_name, part_name), ', '.join(_ci(column) + ' text' for column in columns)))
+        with ThreadPoolExecutor(max_workers=CSV_WORKERS) as executor:
+            futures = [executor.submit(self._copy_csv_part, part_schema_name, part_name, columns, path, start, end,
+                                       progress) for part_name, path, start, end in parts]
+        for future in futures:
+            future.result()
+
+        row_count = 0
+        column_list = ', '.join(_ci(column) for column in columns)
+        for part_name, _, _, _ in parts:
+            cursor.execute('INSERT INTO {}.{} ({}) SELECT {} FROM {}.{};'.format(
+                *_ci(schema_name, tablename), column_list, column_list, *_ci(part_schema_name, part_name)))
+            row_count += cursor.rowcount
+        return row_count
+
+    def drop_csv_parts(self):
+        """
+         Drops the tables of the parts of CSV files (see _copy_csv) that are left behind by the loads of processes of
+         the app that stopped, as well as those that were created in the schemas of datasets by earlier versions.
+         The parts of the loads of processes that are still running are left alone (see ServerProcess).
+         This is called when the server starts.
         """
-        connection = db.engine.connect()
-        transaction = connection.begin()
         try:
+            # The number of the process that loads a part is in the name of its table, see _split_csv
+            owner = "substring(tablename FROM '^_part_([0-9]{1,9})_[0-9a-f]{32}_')::integer"
+            rows = db.engine.execute(
+                "SELECT schemaname, tablename FROM pg_tables WHERE (schemaname = {} AND {}) OR "
+                "(schemaname LIKE 'schema-%%' AND tablename ~ '^_part_[0-9a-f]{{32}}_[0-9]+$');".format(
+                    _cv(self._part_schema), ServerProcess().gone(owner))).fetchall()
+            for row in rows:
+                db.engine.execute('DROP TABLE IF EXISTS {}.{};'.format(*_ci(row['schemaname'], row['tablename'])))
+        except Exception as e:
+            app.logger.error("[ERROR] Unable to drop the tables of interrupted CSV loads")
+            app.logger.exception(e)
+            raise e
 
-            with ZipFile(file) as archive:
-                # Extract each file, one by one
-                members = archive.infolist()
+    def _copy_csv_part(self, schema_name, part_name, columns, path, start, end, progress):
+        connection = db.engine.raw_connection()
+        try:
+            with open_text(RangeReader(open(path, 'rb'), start, end), progress) as csv_file:
+                copy_csv(connection.cursor(), schema_name, part_name, columns, csv_file)
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            app.logger.error("[ERROR] Failed to load bytes {}-{} of '{}'".format(start, end, path))
+            app.logger.exception(e)
+            raise e
+        finally:
+            connection.close()
 
-                for m in members:
+    def _insert_converted(self, cursor, schema_name, tablename, columns, types):
+        """
+         Converts the rows of "_staging" to the given column types & inserts them into a table on the server.
+         Returns the amount of rows that were inserted.
+        """
+        # A freshly filled temporary table is scanned in insertion order, so no (expensive) sort is needed
+        cursor.execute('INSERT INTO {}.{} ({}) SELECT {} FROM "_staging";'.format(
+            *_ci(schema_name, tablename), ', '.join(_ci(column) for column in columns),
+            ', '.join(cast_expression(column, column_type) for column, column_type in zip(columns, types))))
+        return cursor.rowcount
 
-                    csv = archive.extract(m, "../output/temp")
+    def _get_column_types(self, cursor, schema_id, table_name):
+        """
+         Returns a dict with the full PostgreSQL type (e.g. 'character varying(255)') of every column of a table
+        """
+        schema_name = 'schema-' + str(schema_id)
+        cursor.execute('SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute '
+                       'WHERE attrelid = {}::regclass AND attnum > 0 AND NOT attisdropped ORDER BY attnum;'.format(
+                           _cv('{}.{}'.format(*_ci(schema_name, table_name)))))
+        return dict(cursor.fetchall())
 
-                    # Determine if this file should append an already existing table & process
-                    tablename = m.filename.split('.csv')[0]
-                    tablename = tablename.split('/')[-1]
+    def process_columnar(self, file, schema_id, tablename, table_description='Default description', append=False,
+                         progress=None):
+        """
+         This method takes a Parquet or Arrow IPC (Feather) file and processes it into a table.
+         The column types are taken from the Arrow schema of the file, so no type deduction is needed, and the file
+         is loaded one record batch at a time.
+         If progress is given, the rows loaded (& an estimate of the bytes read) are reported to it.
+         Returns the amount of rows that were loaded.
+        """
 
-                    create_new = not self.table_exists(tablename, schema_id)
+        table_exists = self.table_exists(tablename, schema_id)
+        if append and not table_exists:
+            app.logger.error("[ERROR] Appending to non-existent table.")
+            return
+        elif not append and table_exists:
+            app.logger.error("[ERROR] Cannot overwrite existing table.")
+            return
 
-                    if create_new:
-                        self.process_csv(csv, schema_id, tablename, type_deduction=type_deduction)
-                    else:
-                        self.process_csv(csv, schema_id, tablename, True, type_deduction=type_deduction)
+        raw_tablename = '_raw_' + tablename
+        schema_name = 'schema-' + str(schema_id)
+        start_time = time.perf_counter()
 
-                # Clean up temp folder
-                shutil.rmtree("../output/temp")
-                transaction.commit()
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            last_id = self._lock_for_append(cursor, schema_name, tablename) if append else 0
+
+            schema, total_rows, batches = open_columnar(file)
+            columns = [name.replace('"', '') for name in schema.names]
+            # A new table is loaded into a staging table that takes its place once all rows are in
+            target = tablename if append else self._create_staging_table(
+                cursor, schema_id, columns, [arrow_sql_type(field.type) for field in schema])
+
+            file_size = os.path.getsize(file)
+            row_count = 0
+            for batch in batches:
+                count = copy_rows(cursor, schema_name, target, columns, arrow_rows(batch))
+                if progress is not None and total_rows:
+                    # Columnar files aren't read front to back, so the bytes read are estimated from the rows loaded
+                    progress.add_bytes((row_count + count) * file_size // total_rows -
+                                       row_count * file_size // total_rows)
+                    progress.add_rows(count)
+                row_count += count
+            if not append:
+                self._promote_staging_table(cursor, schema_id, target, tablename, table_description)
+
+            # Derive the raw data from the rows that were just loaded instead of loading the file a second time
+            create_raw = not (append and self.table_exists(raw_tablename, schema_id))
+            cursor.execute(raw_table_query(schema_name, tablename, columns, last_id, create=create_raw))
+            self._report_loaded_ids(cursor, schema_name, tablename, last_id, progress)
+            connection.commit()
+        except Exception as e:
+            # A new table was never promoted, so this also removes its staging table
+            connection.rollback()
+            app.logger.error("[ERROR] Failed to process columnar file")
+            app.logger.exception(e)
+            raise e
+        finally:
+            connection.close()
 
+        self._count_loaded_rows(schema_id, tablename, row_count, append)
+        elapsed = time.perf_counter() - start_time
+        app.logger.info("[INFO] Loaded {} rows into '{}' in {:.2f}s ({:.0f} rows/sec)".format(
+            row_count, tablename, elapsed, row_count / elapsed if elapsed else row_count))
+        return row_count
+
+    def process_zip(self, file, schema_id, type_deduction=False, progress=None):
+        """
+         This method takes a ZIP archive filled with (possibly compressed) CSV files, and processes them individually
+         The name of the CSV file will be used as table name. If a table with the same name is found
+         the data will be appended
+         The members are streamed out of the archive (nothing is extracted to disk) and loaded concurrently by
+         ZIP_WORKERS workers, each with its own connection.
+         Members that end up in the same table are loaded by the same worker, in archive order.
+         If progress is given, the (decompressed) bytes read & rows loaded are reported to it.
+         Returns a dict with the error for every member that couldn't be loaded.
+        """
+        try:
+            # Group the members per table, so a table is never created & appended to at the same time
+            tables = OrderedDict()
+            with ZipFile(file) as archive:
+                for m in archive.infolist():
+                    if m.is_dir():
+                        continue
+                    tablename = m.filename.split('.csv')[0]
+                    tablename = tablename.split('/')[-1]
+                    tables.setdefault(tablename, list()).append(m.filename)
         except Exception as e:
-            transaction.rollback()
             app.logger.error("[ERROR] Failed to load from .zip archive '" + file + "'")
             app.logger.exception(e)
+            raise e
 
-            # Clean up temp folder
-            shutil.rmtree("../output/temp")
+        failed = dict()
+        with ThreadPoolExecutor(max_workers=ZIP_WORKERS) as executor:
+            futures = [executor.submit(self._process_zip_members, file, schema_id, tablename, members, type_deduction,
+                                       progress) for tablename, members in tables.items()]
+            for future in futures:
+                failed.update(future.result())
 
-            raise e
+        for member in failed:
+            app.logger.error("[ERROR] Failed to load '{}' from .zip archive '{}'".format(member, file))
+        return failed
+
+    def _process_zip_members(self, file, schema_id, tablename, members, type_deduction=False, progress=None):
+        """
+         Loads the given members of a ZIP archive one after the other into the same table.
+         Returns a dict with the error for every member that couldn't be loaded.
+        """
+        errors = dict()
+        with ZipFile(file) as archive:
+            for member in members:
+                try:
+                    # Determine if this file should append an already existing table & process
+                    create_new = not self.table_exists(tablename, schema_id)
 
-    def process_dump(self, file, schema_id, table_name, table_description='Default description', ):
+                    # The member is decompressed while it's being loaded, nothing is extracted to disk
+                    with archive.open(member) as member_file:
+                        csv_file = open_text(member_file, progress, get_compression(member))
+                        self.process_csv(csv_file, schema_id, tablename, append=not create_new,
+                                         type_deduction=type_deduction, progress=progress)
+                except Exception as e:
+                    errors[member] = e
+        return errors
+
+    def process_dump(self, file, schema_id, table_name, table_description='Default description', progress=None):
 
         """
-         This method takes a SQL dump file and processes the INSERT statements,
+         This method takes a SQL dump file (or an opened text stream) and processes the INSERT statements,
          either by creating tables and filling them or by filling pre-existing tables.
          All other statements (DELETE, DROP, ...) won't be executed.
+         The dump is read one statement at a time and its rows are copied into the tables in batches of
+         DUMP_BATCH_SIZE rows, all in a single transaction.
+         If progress is given, the bytes read & rows loaded are reported to it.
         """
-        connection = db.engine.connect()
-        transaction = connection.begin()
+        schema_name = 'schema-' + str(schema_id)
+        # Maps every table that is filled by this dump to its columns & the last id it had before the dump
+        loaded_tables = OrderedDict()
+        # Amount of rows that are loaded into every table
+        loaded_rows = dict()
+        # Rows waiting to be copied, per (table, columns) combination
+        batches = OrderedDict()
+
+        connection = db.engine.raw_connection()
         try:
-            with open(file, 'r') as dump:
-                # Read the file as a string, split on ';' and check each statement individually
-                for statement in dump.read().strip().split(';'):
-                    if len(statement.split()) and statement.split()[0] == 'INSERT':  # Only handle INSERT statements
-                        # NOTE: An INSERT statement looks like this:
-                        # INSERT INTO table_name (column1, column2, column3, ...) VALUES (value1, value2, value3, ...);
-
-                        tablename = statement.split()[2] or table_name
-                        raw_table_name = "_raw_" + tablename
-                        values_list = list()
-                        for values_tuple in re.findall(r'\(.*?\)', statement[statement.find('VALUES'):]):
-                            # Tuple is any match of the above regex, e.g. (values1, values2, values3, ...)
-                            # after VALUES, i.e. the column names (if they're given) aren't matched
-                            values_list.append(re.sub(r'\s|\(|\)', '', values_tuple).split(','))
-
-                        if re.search(r'{}\s\(.*?\)\sVALUES'.format(tablename), statement):
-                            # Matches 'table_name (column1, column2, column3, ...) VALUES', \s stands for whitespace
-                            columns = re.sub(r'\s|\(|\)', '',
-                                             re.findall(r'\(.*?\)', statement[:statement.find('VALUES')])[0]).split(',')
-                        else:
-                            columns = ['col' + str(i) for i in range(1, len(values_list[0]) + 1)]
-
-                        if not self.table_exists(tablename, schema_id):
-                            self.create_table(tablename, schema_id, columns, desc=table_description, raw=True)
-                        for values in values_list:
-                            val_dict = dict()
-                            for c_ix in range(len(columns)):
-                                val_dict[columns[c_ix]] = values[c_ix]
-                            self.insert_row(tablename, schema_id, columns, val_dict, False)
-                            self.insert_row(raw_table_name, schema_id, columns, val_dict, False)
-            transaction.commit()
+            cursor = connection.cursor()
+            with open_upload(file, progress) as dump:
+                for statement in split_sql_statements(dump):
+                    insert = parse_insert(statement)
+                    if insert is None:  # Only handle INSERT statements
+                        continue
+
+                    tablename, columns, rows = insert
+                    tablename = tablename or table_name
+                    for values in rows:
+                        if columns is None:
+                            columns = ['col' + str(i) for i in range(1, len(values) + 1)]
+
+                        if tablename not in loaded_tables:
+                            last_id = None
+                            if not self.table_exists(tablename, schema_id):
+                                self.create_table(tablename, schema_id, columns, desc=table_description)
+                            else:
+                                last_id = self._lock_for_append(cursor, schema_name, tablename)
+                            loaded_tables[tablename] = (columns, last_id)
+
+                        batch = batches.setdefault((tablename, tuple(columns)), list())
+                        batch.append(values)
+                        if len(batch) >= DUMP_BATCH_SIZE:
+                            loaded_rows[tablename] = loaded_rows.get(tablename, 0) + self._copy_dump_batch(
+                                cursor, schema_name, tablename, columns, batch, progress)
+
+            for (tablename, columns), batch in batches.items():
+                if len(batch):
+                    loaded_rows[tablename] = loaded_rows.get(tablename, 0) + self._copy_dump_batch(
+                        cursor, schema_name, tablename, columns, batch, progress)
+
+            # Derive the raw data from the loaded rows instead of inserting every row a second time
+            for tablename, (columns, last_id) in loaded_tables.items():
+                create_raw = last_id is None or not self.table_exists('_raw_' + tablename, schema_id)
+                cursor.execute(raw_table_query(schema_name, tablename, columns, last_id or 0, create=create_raw))
+            connection.commit()
+            for tablename, row_count in loaded_rows.items():
+                RowCounter().add_rows(schema_id, tablename, row_count)
 
         except Exception as e:
-            transaction.rollback()
+            connection.rollback()
             app.logger.error("[ERROR] Failed to load from sql dump")
             app.logger.exception(e)
+            # delete the tables this dump created
+            for tablename, (columns, last_id) in loaded_tables.items():
+                if last_id is None:
+                    self.delete_table(tablename, schema_id)
+            raise e
+        finally:
+            connection.close()
+
+    def _copy_dump_batch(self, cursor, schema_name, tablename, columns, batch, progress=None):
+        """ Copies a batch of rows from a SQL dump into its table & empties the batch, returns the amount of rows """
+        row_count = copy_rows(cursor, schema_name, tablename, columns, batch)
+        del batch[:]
+        if progress is not None:
+            progress.add_rows(row_count)
+        return row_count
 
     # Data access handling
     def get_user_datasets(self, user_id):
@@ -900,7 +1568,9 @@ class DataLoader:
             for row in rows:
                 active_users = ActiveUserHandler().active_users_in_table_count_excluding_requesting_user(schema_id, row[
                     'id_table'], user_id)
-                t = Table(row['id_table'], row['metadata'], active_users_count=active_users)
+                table_size, table_size_exact = RowCounter().get_count(schema_id, row['id_table'])
+                t = Table(row['id_table'], row['metadata'], active_users_count=active_users, total_size=table_size,
+                          total_size_exact=table_size_exact)
                 tables.append(t)
 
             return tables
@@ -909,42 +1579,97 @@ class DataLoader:
             app.logger.exception(e)
             raise e
 
-    def get_table(self, schema_id, table_name, offset=0, limit='ALL', ordering=None, search=None):
+    def get_table(self, schema_id, table_name, offset=0, limit='ALL', ordering=None, search=None, after=None,
+                  search_type='substring', fields=None, stream=False):
         """
          This method returns a list of 'Table' objects associated with the requested dataset
+         If after is given, the page is found with keyset pagination instead of offset: after is the cursor token
+         of the previous page ('' for the first page) & the token of this page is set as next_cursor of the table.
+         This costs the same for every page, where an offset has to skip all rows before it.
+         search_type is one of SEARCH_TYPES, the rows of a full-text search are ranked by relevance if no ordering
+         is given (and the page isn't found with keyset pagination).
+         If fields is given, only the id & these columns are fetched (in this order).
+         If stream = True, the rows of the table are a generator that fetches them from a server-side cursor in
+         batches of TABLE_STREAM_BATCH_SIZE, next_cursor is set once the generator is exhausted.
+         Pages (not whole tables or streams) are cached, see PageCache.
         """
         try:
+            if search_type not in SEARCH_TYPES:
+                raise ValueError("Invalid search type '{}'".format(search_type))
+            page_key = None
+            if not stream and limit != 'ALL':
+                version = RowCounter().get_version(schema_id, table_name)
+                if version is not None:
+                    page_key = (str(schema_id), table_name, version, str(offset), str(limit), ordering, search,
+                                search_type, after, None if fields is None else tuple(fields))
+                    table = PageCache().get_page(page_key)
+                    if table is not None:
+                        return table
+
             columns = self.get_column_names(schema_id, table_name)
+            table_columns = self.get_column_names_and_types(schema_id, table_name)
+            if fields is not None:
+                unknown_fields = [field for field in fields if field not in columns]
+                if unknown_fields:
+                    raise ValueError("Unknown columns: {}".format(', '.join(unknown_fields)))
+                by_name = {column.name: column for column in table_columns}
+                table_columns = [by_name['id']] + [by_name[field] for field in fields if field != 'id']
+            selected = [column.name for column in table_columns]
 
             schema_name = 'schema-' + str(schema_id)
+            if after is not None:
+                # Pages are ordered by the column (if any) & then by id, which makes the order of the rows unique
+                ordering = (ordering[0], ordering[1].lower()) if ordering is not None else ('id', 'asc')
+                if ordering[1] not in ('asc', 'desc'):
+                    raise ValueError("Invalid ordering direction '{}'".format(ordering[1]))
+                offset = 0
+
             # Get all tables from the metadata table in the schema
             ordering_query = ''
             if ordering is not None:
                 # ordering tuple is of the form (columns, asc|desc)
                 ordering_query = 'ORDER BY {} {}'.format(_ci(ordering[0]), ordering[1])
+                if after is not None and ordering[0] != 'id':
+                    ordering_query += ', "id" {}'.format(ordering[1])
 
-            search_query = ''
+            conditions = list()
+            search_condition = None
             if search is not None and search != '':
-                search_query = "WHERE ("
-                # Fill in the search for every column except ID
-                for col in columns[1:]:
-                    search_query += "{}::text LIKE '%%{}%%' OR ".format(_ci(col), search)
-                search_query = search_query[:-3] + ")"
-
-            rows = db.engine.execute(
-                'SELECT * FROM {}.{} {} {} LIMIT {} OFFSET {};'.format(*_ci(schema_name, table_name), search_query,
-                                                                       ordering_query, limit, offset))
+                search_condition = self._search_condition(schema_id, table_name, columns[1:], search, search_type)
+                conditions.append(search_condition)
+                if search_type == 'fulltext' and ordering is None:
+                    ordering_query = 'ORDER BY ts_rank({}, {}) DESC, "id"'.format(search_document(columns[1:]),
+                                                                                 fulltext_query(search))
+            if after:
+                conditions.append(self._keyset_condition(ordering, *decode_cursor(after, ordering)))
+            search_query = 'WHERE ' + ' AND '.join(conditions) if len(conditions) else ''
+
+            # The next cursor needs the value of the ordering column of the last row, even if it isn't selected
+            hidden = [ordering[0]] if after is not None and ordering[0] not in selected else []
+            query = 'SELECT {} FROM {}.{} {} {} LIMIT {} OFFSET {};'.format(
+                ', '.join(_ci(column) for column in selected + hidden), *_ci(schema_name, table_name), search_query,
+                ordering_query, limit, offset)
 
             # Get total size (of unfiltered table)
-            size_query = 'SELECT count(*) FROM {}.{};'.format(*_ci(schema_name, table_name))
-            size_result = db.engine.execute(size_query)
-            table_size = [r[0] for r in size_result][0]
+            table_size, table_size_exact = RowCounter().get_count(schema_id, table_name)
 
-            table = Table(table_name, '',
-                          columns=self.get_column_names_and_types(schema_id, table_name), total_size=table_size)
+            table = Table(table_name, '', columns=table_columns, total_size=table_size,
+                          total_size_exact=table_size_exact)
             table.dataset = schema_id
+            if search_condition is not None:
+                table.filtered_size = RowCounter().get_filtered_count(schema_id, table_name, (search_type, search),
+                                                                      search_condition)
+            if stream:
+                table.rows = self._stream_rows(table, query, len(selected), limit, ordering, after)
+                return table
+
+            rows = db.engine.execute(query).fetchall()
             for row in rows:
-                table.rows.append(list(row))
+                table.rows.append(list(row)[:len(selected)])
+            if rows:
+                self._set_next_cursor(table, rows[-1], len(rows), limit, ordering, after)
+            if page_key is not None:
+                PageCache().set_page(page_key, table)
             return table
 
         except Exception as e:
@@ -952,21 +1677,85 @@ class DataLoader:
             app.logger.exception(e)
             raise e
 
+    def _stream_rows(self, table, query, width, limit, ordering, after):
+        """ Yields the rows of a page of a table from a server-side cursor (see get_table) """
+        connection = db.engine.connect().execution_options(stream_results=True)
+        try:
+            result = connection.execute(query)
+            row_count = 0
+            last_row = None
+            while True:
+                batch = result.fetchmany(TABLE_STREAM_BATCH_SIZE)
+                if not batch:
+                    break
+                for row in batch:
+                    yield list(row)[:width]
+                row_count += len(batch)
+                last_row = batch[-1]
+            if last_row is not None:
+                self._set_next_cursor(table, last_row, row_count, limit, ordering, after)
+        except Exception as e:
+            app.logger.error("[ERROR] Couldn't stream table '{}'".format(table.name))
+            app.logger.exception(e)
+            raise e
+        finally:
+            connection.close()
+
+    def _set_next_cursor(self, table, last_row, row_count, limit, ordering, after):
+        # A page that isn't full is the last one
+        if after is not None and limit != 'ALL' and row_count == int(limit):
+            table.next_cursor = encode_cursor(ordering, last_row['id'],
+                                              None if ordering[0] == 'id' else last_row[ordering[0]])
+
+    def _search_condition(self, schema_id, table_name, columns, search, search_type='substring'):
+        """
+         Returns the condition for the rows in which one of the given columns contains search, or for a full-text
+         search the rows of which the text of the given columns contains all words of search.
+         If the table has a search index on these columns (see SearchIndexer), the condition uses it.
+        """
+        if search_type == 'fulltext':
+            # The condition is the indexed expression itself, so PostgreSQL uses the index as long as the columns match
+            return '{} @@ {}'.format(search_document(columns), fulltext_query(search))
+
+        schema_name = 'schema-' + str(schema_id)
+        index = db.engine.execute(
+            "SELECT columns FROM Search_Index WHERE id_dataset={} AND id_table={} AND search_type = 'substring' "
+            "AND state = 'ready';".format(*_cv(schema_name, table_name))).first()
+        if index is not None and json.loads(index['columns']) == list(columns):
+            return '{} LIKE {}'.format(search_expression(columns), like_pattern(search))
+
+        search_query = "("
+        # Fill in the search for every column except ID, with the same text & pattern as the index so the results are
+        # the same
+        types = {column.name: column.type for column in self.get_column_names_and_types(schema_id, table_name)}
+        for col in columns:
+            search_query += "{} LIKE {} OR ".format(column_search_text(col, types.get(col)), like_pattern(search))
+        return search_query[:-3] + ")"
+
+    def _keyset_condition(self, ordering, row_id, value):
+        """
+         Returns the condition for the rows that come after the row with the given id & value of the ordering column.
+         PostgreSQL sorts NULL as the highest value, so NULLs come last in ascending & first in descending order.
+        """
+        column, direction = ordering
+        comparison = '>' if direction == 'asc' else '<'
+        if column == 'id':
+            return '"id" {} {}'.format(comparison, int(row_id))
+        if value is None:
+            # Only NULLs are left in ascending order, in descending order all non NULL values are still to come
+            condition = '({} IS NULL AND "id" {} {})'.format(_ci(column), comparison, int(row_id))
+            return condition if direction == 'asc' else '({} OR {} IS NOT NULL)'.format(condition, _ci(column))
+        # The row comparison can use an index on (column, id)
+        condition = '({}, "id") {} ({}, {})'.format(_ci(column), comparison, _cv(_escape_percent(value)),
+                                                    int(row_id))
+        return '({} OR {} IS NULL)'.format(condition, _ci(column)) if direction == 'asc' else condition
+
     def get_column_names(self, schema_id, table_name):
         """
          This method returns a list of column names associated with the given table
         """
         try:
-            schema = "schema-" + str(schema_id)
-            rows = db.engine.execute(
-                'SELECT column_name FROM information_schema.columns WHERE table_schema={} AND table_name={};'.format(
-                    *_cv(schema, table_name))).fetchall()
-            result = list()
-            for row in rows:
-                result.append(row[0])
-
-            return result
-
+            return [column.name for column in self.get_column_names_and_types(schema_id, table_name)]
         except Exception as e:
             app.logger.error("[ERROR] Couldn't fetch column names for table '" + table_name + "'.")
             app.logger.exception(e)
@@ -974,26 +1763,34 @@ class DataLoader:
 
     def get_column_names_and_types(self, schema_id, table_name):
         """
-         This method returns a list of column names associated with the given table
+         This method returns a list of column names associated with the given table, in the order of the table.
+         The columns are cached, see ColumnCache.
         """
         try:
-            schema = "schema-" + str(schema_id)
-            rows = db.engine.execute(
-                'SELECT column_name, data_type FROM information_schema.columns WHERE table_schema={} AND table_name={};'.format(
-                    *_cv(schema, table_name)))
-            result = list()
-            for row in rows:
-                type = row[1]
-                if type == "double precision":
-                    type = "double"
-                elif type == "timestamp without time zone" or type == "timestamp with time zone":
-                    type = "timestamp"
-                elif type == "character varying":
-                    type = "text"
-                elif type == "bigint":
-                    type = "integer"
-                result.append(Column(row[0], type))
-            return result
+            column_cache = ColumnCache()
+            columns = column_cache.get(schema_id, table_name)
+            if columns is None:
+                generation = column_cache.generation()
+                schema = "schema-" + str(schema_id)
+                rows = db.engine.execute(
+                    'SELECT column_name, data_type FROM information_schema.columns WHERE table_schema={} AND '
+                    'table_name={} ORDER BY ordinal_position;'.format(*_cv(schema, table_name)))
+                columns = list()
+                for row in rows:
+                    type = row[1]
+                    if type == "double precision":
+                        type = "double"
+                    elif type == "timestamp without time zone" or type == "timestamp with time zone":
+                        type = "timestamp"
+                    elif type == "character varying":
+                        type = "text"
+                    elif type == "bigint":
+                        type = "integer"
+                    columns.append((row[0], type))
+                # A table that doesn't exist (yet) has no columns
+                if columns:
+                    column_cache.set(schema_id, table_name, columns, generation)
+            return [Column(name, type) for name, type in columns]
         except Exception as e:
             app.logger.error("[ERROR] Couldn't fetch column names/types for table '" + table_name + "'.")
             app.logger.exception(e)
@@ -1023,6 +1820,21 @@ class DataLoader:
             db.engine.execute(
                 'UPDATE history SET id_table={} WHERE id_dataset={} and id_table={};'.format(
                     *_cv(new_table_name, schema_name, old_table_name)))
+            db.engine.execute(
+                'UPDATE Upload_Registry SET table_name={} WHERE id_dataset={} and table_name={};'.format(
+                    *_cv(new_table_name, schema_name, old_table_name)))
+            db.engine.execute(
+                'UPDATE Row_Count SET id_table={} WHERE id_dataset={} and id_table={};'.format(
+                    *_cv(new_table_name, schema_name, old_table_name)))
+            db.engine.execute(
+                'UPDATE Search_Index SET id_table={} WHERE id_dataset={} and id_table={};'.format(
+                    *_cv(new_table_name, schema_name, old_table_name)))
+            db.engine.execute(
+                'UPDATE Advised_Index SET id_table={} WHERE id_dataset={} and id_table={};'.format(
+                    *_cv(new_table_name, schema_name, old_table_name)))
+            db.engine.execute(
+                'UPDATE Column_Usage SET id_table={} WHERE id_dataset={} and id_table={};'.format(
+                    *_cv(new_table_name, schema_name, old_table_name)))
             if new_table_name != old_table_name:
                 db.engine.execute(
                     'ALTER TABLE {}.{} RENAME TO {};'.format(*_ci(schema_name, old_table_name, new_table_name)))
@@ -1030,6 +1842,7 @@ class DataLoader:
                 raw_table_new_name = "_raw_" + new_table_name
                 db.engine.execute(
                     'ALTER TABLE {}.{} RENAME TO {};'.format(*_ci(schema_name, raw_table_old_name, raw_table_new_name)))
+                ColumnCache().invalidate(schema_id)
         except Exception as e:
             app.logger.error("[ERROR] Couldn't update table metadata for table " + old_table_name + ".")
             app.logger.exception(e)
@@ -1141,18 +1954,6 @@ class DataLoader:
             ["Amount of empty elements", self.calculate_amount_of_empty_elements(schema_id, table_name, column, )])
         return stats
 
-    def get_statistics_for_all_columns(self, schema_id, table_name, columns):
-        """calculate statistics of a column"""
-        stats = list()
-        for column in columns:
-            type = column.type
-            numerical = False
-            if type == "integer" or type == "double" or type == "real":
-                numerical = True
-
-            stats.append([column.name, self.get_statistics_for_column(schema_id, table_name, column.name, numerical)])
-        return stats
-
     # Raw data & backups
     def revert_back_to_raw_data(self, schema_id, table_name):
         schema_name = "schema-" + str(schema_id)
@@ -1168,6 +1969,7 @@ class DataLoader:
                     *_cv(schema_name, table_name)))
             transaction.commit()
             create_serial_sequence(schema_name, table_name)
+            ColumnCache().invalidate(schema_id, table_name)
         except Exception as e:
             transaction.rollback()
             app.logger.error("[ERROR] Couldn't convert back to raw data")
@@ -1242,6 +2044,7 @@ class DataLoader:
                     *_cv(schema_name, table_name), timestamp))
             transaction.commit()
             create_serial_sequence(schema_name, table_name)
+            ColumnCache().invalidate(schema_id, table_name)
         except Exception as e:
             transaction.rollback()
             app.logger.error("[ERROR] Couldn't restore backup for table '{}'".format(table_name))
@@ -1473,6 +2276,8 @@ class TableJoiner:
 
         schema_name = "schema-" + str(dataset_id)
 
+        # The temporary table is created again for every join
+        ColumnCache().invalidate(dataset_id, temp_table_name)
         column_names = self.data_loader.get_column_names(dataset_id, temp_table_name)
 
         new_table_query = 'CREATE TABLE {}.{} AS SELECT \"id\"'.format(*_ci(schema_name, new_table_name))
@@ -1574,3 +2379,1024 @@ class TableJoiner:
                            'DELETE FROM HISTORY WHERE ID_DATASET={} AND ID_TABLE={};'.format(
                                *_cv(schema_name, table_name))
                            )
+
+
+class UploadJob:
+    def __init__(self, id, dataset, filename, table_name, state, bytes_total=0, bytes_processed=0, rows_loaded=0,
+                 error=None, created=None, updated=None, duplicate_of=None):
+        self.id = id
+        self.dataset = dataset
+        self.filename = filename
+        self.table_name = table_name
+        self.state = state
+        self.bytes_total = bytes_total
+        self.bytes_processed = bytes_processed
+        self.rows_loaded = rows_loaded
+        self.error = error
+        self.created = created
+        self.updated = updated
+        self.duplicate_of = duplicate_of
+
+    def to_dct(self):
+        return {'id': self.id, 'filename': self.filename, 'table_name': self.table_name, 'state': self.state,
+                'bytes_total': self.bytes_total, 'bytes_processed': self.bytes_processed,
+                'rows_loaded': self.rows_loaded, 'error': self.error, 'duplicate_of': self.duplicate_of,
+                'created': str(self.created) if self.created else None,
+                'updated': str(self.updated) if self.updated else None}
+
+
+class UploadProgress:
+    """
+     Keeps count of the bytes read & rows loaded by an upload job (possibly from several threads) and writes them
+     to its job record, at most once every UPLOAD_PROGRESS_INTERVAL seconds.
+     A load into a single table also sets loaded_ids to the (first, last) id of the rows it added, for UploadRegistry.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.bytes_processed = 0
+        self.rows_loaded = 0
+        self.loaded_ids = None
+        self.last_update = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def add_bytes(self, count):
+        with self.lock:
+            self.bytes_processed += count
+            self._update()
+
+    def add_rows(self, count):
+        with self.lock:
+            self.rows_loaded += count or 0
+            self._update()
+
+    def flush(self):
+        with self.lock:
+            self._update(force=True)
+
+    def _update(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self.last_update < UPLOAD_PROGRESS_INTERVAL:
+            return
+        self.last_update = now
+        db.engine.execute('UPDATE Upload_Job SET bytes_processed = {}, rows_loaded = {}, updated = NOW() '
+                          'WHERE id = {};'.format(int(self.bytes_processed), int(self.rows_loaded), int(self.job_id)))
+
+
+class UploadRegistry:
+    """
+     Keeps track of the content (SHA-256 digest) of the files that were loaded into the tables of a dataset & the rows
+     they became (in the Upload_Registry table). A file that is uploaded again is then served from the raw table
+     of the table that already holds it instead of being parsed & loaded again.
+     Entries are removed when their table is deleted.
+    """
+
+    def __init__(self, data_loader):
+        self.data_loader = data_loader
+
+    def register(self, schema_id, digest, type_deduction, table_name, first_id, last_id):
+        """ Registers that the file with the given digest was loaded into the rows of a table with the given ids """
+        schema_name = 'schema-' + str(schema_id)
+        try:
+            if last_id < first_id:
+                return
+            db.engine.execute(
+                'INSERT INTO Upload_Registry (id_dataset, digest, type_deduction, table_name, first_id, last_id, '
+                'created) VALUES ({}, {}, {}, {}, {}, {}, NOW()) ON CONFLICT DO NOTHING;'.format(
+                    *_cv(schema_name, digest), 'TRUE' if type_deduction else 'FALSE', _cv(table_name),
+                    int(first_id), int(last_id)))
+        except Exception as e:
+            app.logger.error("[ERROR] Unable to register the upload of table '{}'".format(table_name))
+            app.logger.exception(e)
+            raise e
+
+    def serve(self, schema_id, digest, type_deduction, table_name, table_desc='Default description'):
+        """
+         Serves an upload of the file with the given digest into table_name from the registry, if possible:
+          - if the file was already loaded into table_name, nothing has to be done
+          - if table_name doesn't exist yet, it's created as a copy of the rows that another table got from the file
+         Returns a (name of the table that holds the file, rows copied) tuple, or None if the file has to be loaded.
+        """
+        schema_name = 'schema-' + str(schema_id)
+        try:
+            entries = db.engine.execute(
+                'SELECT * FROM Upload_Registry WHERE id_dataset = {} AND digest = {} AND type_deduction = {} '
+                'ORDER BY created;'.format(*_cv(schema_name, digest), 'TRUE' if type_deduction else 'FALSE'))
+            entries = [entry for entry in entries
+                       if self.data_loader.table_exists('_raw_' + entry['table_name'], schema_id)]
+
+            table_exists = self.data_loader.table_exists(table_name, schema_id)
+            for entry in entries:
+                if table_exists and entry['table_name'] == table_name:
+                    app.logger.info("[INFO] '{}' already holds this upload, skipping it".format(table_name))
+                    return table_name, 0
+            if table_exists or not len(entries):
+                return None
+
+            entry = entries[0]
+            row_count = self._copy_rows(schema_id, entry['table_name'], table_name, table_desc, entry['first_id'],
+                                        entry['last_id'])
+            # The copy is a new table, so its rows are numbered from 1
+            self.register(schema_id, digest, type_deduction, table_name, 1, row_count)
+            app.logger.info("[INFO] Served the upload of '{}' from '{}' ({} rows)".format(
+                table_name, entry['table_name'], row_count))
+            return entry['table_name'], row_count
+        except Exception as e:
+            app.logger.error("[ERROR] Unable to serve the upload of table '{}' from the registry".format(table_name))
+            app.logger.exception(e)
+            raise e
+
+    def _copy_rows(self, schema_id, source_table, table_name, table_desc, first_id, last_id):
+        """ Creates table_name (& its raw table) from the rows of the raw table of source_table with the given ids """
+        schema_name = 'schema-' + str(schema_id)
+        raw_source_table = '_raw_' + source_table
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            types = self.data_loader._get_column_types(cursor, schema_id, raw_source_table)
+            columns = [column for column in self.data_loader.get_column_names(schema_id, raw_source_table)
+                       if column != 'id']
+            staging_name = self.data_loader._create_staging_table(cursor, schema_id, columns,
+                                                                  [types[column] for column in columns])
+
+            column_list = ', '.join(_ci(column) for column in columns)
+            cursor.execute('INSERT INTO {}.{} ({}) SELECT {} FROM {}.{} WHERE id BETWEEN {} AND {} ORDER BY id;'.format(
+                *_ci(schema_name, staging_name), column_list, column_list, *_ci(schema_name, raw_source_table),
+                int(first_id), int(last_id)))
+            row_count = cursor.rowcount
+            self.data_loader._promote_staging_table(cursor, schema_id, staging_name, table_name, table_desc)
+            cursor.execute(raw_table_query(schema_name, table_name, columns))
+            connection.commit()
+            self.data_loader._log_created_table(schema_id, table_name)
+            return row_count
+        except Exception as e:
+            connection.rollback()
+            raise e
+        finally:
+            connection.close()
+
+
+class UploadSessionReader(io.RawIOBase):
+    """
+     Reads a file that is still being uploaded by an upload session. Only chunks that have been received completely
+     (& verified) are read, when the reader catches up with the upload it waits for the next chunk.
+     The import that reads the file keeps its transaction open while it waits, so it waits at most
+     UPLOAD_SESSION_STALL_TIMEOUT seconds for a chunk: then stalled is set & the read fails, the import is run again
+     once the upload is complete (see UploadJobHandler._postpone_job).
+     Chunks received by this process wake the reader up (see notify), chunks received by another process of the app
+     are noticed within UPLOAD_SESSION_POLL_INTERVAL seconds.
+    """
+
+    # Session id -> bytes received, of the sessions that are read by this process
+    _received = dict()
+    _chunk_received = threading.Condition()
+
+    def __init__(self, session_id, path):
+        self.session_id = session_id
+        row = self._get_session()
+        self.size = row['size']
+        self.received = row['received']
+        self.position = 0
+        self.stalled = False
+        self.file = open(path, 'rb')
+        with UploadSessionReader._chunk_received:
+            UploadSessionReader._received[session_id] = self.received
+
+    @classmethod
+    def notify(cls, session_id, received):
+        """ Wakes up the reader of an upload session (if this process has one) after a chunk was received """
+        with cls._chunk_received:
+            if session_id in cls._received:
+                cls._received[session_id] = received
+                cls._chunk_received.notify_all()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        deadline = time.perf_counter() + UPLOAD_SESSION_STALL_TIMEOUT
+        while self.position >= self.received:
+            if self.received >= self.size:
+                return 0
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                self.stalled = True
+                raise Exception("No chunks were uploaded for {} seconds".format(UPLOAD_SESSION_STALL_TIMEOUT))
+            with UploadSessionReader._chunk_received:
+                if UploadSessionReader._received[self.session_id] <= self.received:
+                    UploadSessionReader._chunk_received.wait(min(remaining, UPLOAD_SESSION_POLL_INTERVAL))
+                received = UploadSessionReader._received[self.session_id]
+            if received <= self.received:
+                # The chunk may have been received by another process
+                received = self._get_session()['received']
+            self.received = max(self.received, received)
+
+        data = self.file.read(min(len(buffer), self.received - self.position))
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def close(self):
+        with UploadSessionReader._chunk_received:
+            UploadSessionReader._received.pop(self.session_id, None)
+        self.file.close()
+        super().close()
+
+    def _get_session(self):
+        row = db.engine.execute('SELECT size, received FROM Upload_Session WHERE id = {};'.format(
+            _cv(self.session_id))).first()
+        if row is None:
+            raise Exception("Upload session {} doesn't exist anymore".format(self.session_id))
+        return row
+
+
+class SearchIndexer:
+    """
+     Builds search indexes for tables in the background. A substring search index is a trigram (pg_trgm) GIN index on
+     the text of all columns of a table (see search_expression), a full-text search index is a GIN index on the
+     tsvector of that text (see search_document). They let the search of the table view (see
+     DataLoader._search_condition) use the index instead of scanning & casting every value of the table. Both are
+     expression indexes, so PostgreSQL keeps them up to date when rows are inserted or updated.
+     The indexes are kept track of in the Search_Index table. An index is only used while the table has the columns
+     it was built on, after columns are added or renamed it has to be built again.
+     The indexes are built by a pool of SEARCH_INDEX_WORKERS threads, with CREATE INDEX CONCURRENTLY so the table
+     can still be changed in the meantime.
+    """
+
+    def __init__(self, data_loader):
+        self.data_loader = data_loader
+        self.executor = ThreadPoolExecutor(max_workers=SEARCH_INDEX_WORKERS)
+
+    def build_index(self, schema_id, table_name, search_type='substring'):
+        """
+         Queues building a search index (of one of SEARCH_TYPES) for a table, unless the index is already built (or
+         being built) for its current columns
+        """
+        if search_type not in SEARCH_TYPES:
+            raise ValueError("Invalid search type '{}'".format(search_type))
+        schema_name = 'schema-' + str(schema_id)
+        try:
+            columns = [column for column in self.data_loader.get_column_names(schema_id, table_name) if column != 'id']
+            index = self.get_index(schema_id, table_name, search_type)
+            if index is not None and index['state'] != 'failed' and json.loads(index['columns']) == columns:
+                return
+            index_name = '_search_' + uuid4().hex
+            db.engine.execute(
+                "INSERT INTO Search_Index (id_dataset, id_table, search_type, index_name, columns, state, owner, "
+                "updated) VALUES ({0}, {1}, {2}, {3}, {4}, 'building', {5}, NOW()) "
+                "ON CONFLICT (id_dataset, id_table, search_type) DO UPDATE SET "
+                "index_name = {3}, columns = {4}, state = 'building', owner = {5}, updated = NOW();".format(
+                    *_cv(schema_name, table_name, search_type, index_name, _escape_percent(json.dumps(columns))),
+                    int(ServerProcess().get_id())))
+            old_index_name = None if index is None else index['index_name']
+            self.executor.submit(self._build, schema_id, table_name, search_type, columns, index_name,
+                                 old_index_name)
+        except Exception as e:
+            app.logger.error("[ERROR] Unable to queue the search index of table '{}'".format(table_name))
+            app.logger.exception(e)
+            raise e
+
+    def _build(self, schema_id, table_name, search_type, columns, index_name, old_index_name):
+        schema_name = 'schema-' + str(schema_id)
+        start_time = time.perf_counter()
+        # CREATE INDEX CONCURRENTLY can't be run in a transaction
+        connection = db.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        try:
+            if old_index_name is not None:
+                connection.execute('DROP INDEX CONCURRENTLY IF EXISTS {}.{};'.format(
+                    *_ci(schema_name, old_index_name)))
+            if search_type == 'fulltext':
+                indexed = '({})'.format(search_document(columns))
+            else:
+                indexed = '{} gin_trgm_ops'.format(search_expression(columns))
+            connection.execute('CREATE INDEX CONCURRENTLY {} ON {}.{} USING gin ({});'.format(
+                _ci(index_name), *_ci(schema_name, table_name), indexed))
+            self._set_state(schema_name, table_name, index_name, 'ready')
+            app.logger.info("[INFO] Built the search index of '{}' in {:.2f}s".format(
+                table_name, time.perf_counter() - start_time))
+        except Exception as e:
+            app.logger.error("[ERROR] Unable to build the search index of table '{}'".format(table_name))
+            app.logger.exception(e)
+            try:
+                # A failed concurrent build leaves an invalid index behind
+                connection.execute('DROP INDEX IF EXISTS {}.{};'.format(*_ci(schema_name, index_name)))
+                self._set_state(schema_name, table_name, index_name, 'failed')
+            except Exception as cleanup_error:
+                app.logger.error("[ERROR] Unable to clean up the search index of table '{}'".format(table_name))
+                app.logger.exception(cleanup_error)
+        finally:
+            connection.close()
+
+    def fail_interrupted_builds(self):
+        """
+         Marks the search indexes that were being built by processes of the app that stopped as failed & drops
+         what's left of them (an interrupted concurrent build leaves an invalid index behind), so they can be built
+         again. The builds of processes that are still running are left alone (see ServerProcess).
+         This is called when the server starts.
+        """
+        try:
+            rows = db.engine.execute("SELECT * FROM Search_Index WHERE state = 'building' AND {};".format(
+                ServerProcess().gone('owner'))).fetchall()
+            for row in rows:
+                db.engine.execute('DROP INDEX IF EXISTS {}.{};'.format(*_ci(row['id_dataset'], row['index_name'])))
+                self._set_state(row['id_dataset'], row['id_table'], row['index_name'], 'failed')
+        except Exception as e:
+            app.logger.error("[ERROR] Unable to clean up the interrupted search index builds")
+            app.logger.exception(e)
+            raise e
+
+    def _set_state(self, schema_name, table_name, index_name, state):
+        # The table may have been deleted (or indexed again) in the meantime
+        db.engine.execute('UPDATE Search_Index SET state = {}, updated = NOW() WHERE id_dataset = {} AND '
+                          'id_table = {} AND index_name = {};'.format(*_cv(state, schema_name, table_name,
+                                                                           index_name)))
+
+    def drop_index(self, schema_id, table_name, search_type='substring'):
+        """ Drops the search index (of one of SEARCH_TYPES) of a table, if any """
+        schema_name = 'schema-' + str(schema_id)
+        try:
+            index = self.get_index(schema_id, table_name, search_type)
+            if index is None:
+                return
+            db.engine.execute('DELETE FROM Search_Index WHERE id_dataset={} AND id_table={} AND search_type={};'.format(
+                *_cv(schema_name, table_name, search_type)))
+            db.engine.execute('DROP INDEX IF EXISTS {}.{};'.format(*_ci(schema_name, index['index_name'])))
+        except Exception as e:
+            app.logger.error("[ERROR] Unable to drop the search index of table '{}'".format(table_name))
+            app.logger.exception(e)
+            raise e
+
+    def get_index(self, schema_id, table_name, search_type='substring'):
+        """ Returns the Search_Index record of a table, or None if it has no search index of this type """
+        schema_name = 'schema-' + str(schema_id)
+        return db.engine.execute(
+            'SELECT * FROM Search_Index WHERE id_dataset={} AND id_table={} AND search_type={};'.format(
+                *_cv(schema_name, table_name, search_type))).first()
+
+    def build_after_import(self, schema_id, table_name):
+        """ Builds a search index for a table that was imported into, if it has at least SEARCH_INDEX_MIN_ROWS rows """
+        if SEARCH_INDEX_MIN_ROWS is None:
+            return
+        try:
+            if RowCounter().get_count(schema_id, table_name)[0] >= SEARCH_INDEX_MIN_ROWS:
+                self.build_index(schema_id, table_name)
+        except Exception as e:
+            # The import itself succeeded, the table can still be searched without an index
+            app.logger.error("[ERROR] Unable to index table '{}' after its import".format(table_name))
+            app.logger.exception(e)
+
+
+class IndexAdvisor:
+    """
+     Indexes the columns of tables that are sorted often & the tables that are searched often, so the pages of big
+     tables don't need a sort or scan of the whole table. Every page that is shown is recorded (see record_page), the
+     uses are counted in memory & saved to the Column_Usage table when the advisor runs. It runs in the background,
+     at most once every INDEX_ADVISOR_INTERVAL seconds.
+     A column that is sorted at least INDEX_ADVISOR_MIN_USES times gets a B-tree index on (column, id), which serves
+     both the ordering & the keyset pagination of get_table. Only columns of which every value fits in an index entry
+     are indexed, a value that doesn't would make the writes of the table fail (see _sortable). A table that is
+     searched that often gets a search index (see SearchIndexer). Only tables with at least INDEX_ADVISOR_MIN_ROWS
+     rows are indexed. Indexes that weren't needed for INDEX_ADVISOR_UNUSED_DAYS days are dropped again, indexes that
+     failed to build are tried again after INDEX_ADVISOR_RETRY_HOURS hours. Indexes are built & dropped CONCURRENTLY,
+     so the tables can still be changed in the meantime.
+     The decisions of the advisor are kept in the Advised_Index table, see get_decisions.
+    """
+
+    # Character columns of at most this many characters always fit in a B-tree entry (of about 2.7 kB)
+    _max_sort_chars = 600
+
+    # (schema id, table name, column name, usage) -> uses since the last run, shared by all IndexAdvisors
+    _uses = dict()
+    _uses_lock = threading.Lock()
+    _last_run = None
+
+    def __init__(self, data_loader, search_indexer):
+        self.data_loader = data_loader
+        self.search_indexer = search_indexer
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def record_page(self, schema_id, table_name, ordering=None, search=None, search_type='substring'):
+        """ Records the ordering & search of a page of a table that was shown, starts a run if one is due """
+        if INDEX_ADVISOR_INTERVAL is None:
+            return
+        keys = list()
+        if ordering is not None and ordering[0] != 'id':
+            keys.append((str(schema_id), table_name, ordering[0], 'sort'))
+        if search:
+            keys.append((str(schema_id), table_name, '', search_type))
+        run = False
+        with IndexAdvisor._uses_lock:
+            for key in keys:
+                IndexAdvisor._uses[key] = IndexAdvisor._uses.get(key, 0) + 1
+            now = time.monotonic()
+            if IndexAdvisor._last_run is None or now - IndexAdvisor._last_run >= INDEX_ADVISOR_INTERVAL:
+                IndexAdvisor._last_run = now
+                run = True
+        if run:
+            self.executor.submit(self.run)
+
+    def run(self):
+        """ Saves the recorded uses, builds the indexes that are needed & drops those that aren't anymore """
+        try:
+            self._save_uses()
+            self._build_indexes()
+            self._drop_indexes()
+        except Exception as e:
+            app.logger.error("[ERROR] The index advisor failed")
+            app.logger.exception(e)
+
+    def _save_uses(self):
+        with IndexAdvisor._uses_lock:
+            uses = IndexAdvisor._uses
+            IndexAdvisor._uses = dict()
+        for (schema_id, table_name, column_name, usage), count in uses.items():
+            # The dataset may have been deleted in the meantime
+            db.engine.execute(
+                'INSERT INTO Column_Usage (id_dataset, id_table, column_name, usage, uses, last_used) '
+                'SELECT {0}, {1}, {2}, {3}, {4}, NOW() WHERE EXISTS (SELECT 1 FROM Dataset WHERE id = {0}) '
+                'ON CONFLICT (id_dataset, id_table, column_name, usage) DO UPDATE '
+                'SET uses = Column_Usage.uses + EXCLUDED.uses, last_used = NOW();'.format(
+                    *_cv('schema-' + schema_id, table_name, column_name, usage), int(count)))
+
+    def _build_indexes(self):
+        # Columns & tables without a decision, or of which the index failed to build a while ago
+        rows = db.engine.execute(
+            "SELECT u.id_dataset, u.id_table, u.column_name, u.usage FROM Column_Usage u "
+            "LEFT JOIN Advised_Index a ON a.id_dataset = u.id_dataset AND a.id_table = u.id_table AND "
+            "a.column_name = u.column_name AND a.usage = u.usage "
+            "LEFT JOIN Search_Index s ON u.usage <> 'sort' AND s.id_dataset = u.id_dataset AND "
+            "s.id_table = u.id_table AND s.search_type = u.usage "
+            "WHERE u.uses >= {} AND u.last_used > NOW() - INTERVAL '{} days' AND (a.id_table IS NULL OR "
+            "(COALESCE(s.state, a.state) = 'failed' AND a.decided < NOW() - INTERVAL '{} hours'));".format(
+                int(INDEX_ADVISOR_MIN_USES), int(INDEX_ADVISOR_UNUSED_DAYS), int(INDEX_ADVISOR_RETRY_HOURS))).fetchall()
+        for row in rows:
+            schema_id = int(row['id_dataset'][len('schema-'):])
+            table_name = row['id_table']
+            if not self.data_loader.table_exists(table_name, schema_id):
+                continue
+            if RowCounter().get_count(schema_id, table_name)[0] < INDEX_ADVISOR_MIN_ROWS:
+                continue
+            if row['usage'] == 'sort':
+                if self._sortable(schema_id, table_name, row['column_name']):
+                    self._build_sort_index(schema_id, table_name, row['column_name'])
+            else:
+                # A search index that was built on request isn't the advisor's to drop
+                index = self.search_indexer.get_index(schema_id, table_name, row['usage'])
+                if index is None or index['state'] == 'failed':
+                    self._decide(schema_id, table_name, '', row['usage'], None, 'ready')
+                    self.search_indexer.build_index(schema_id, table_name, row['usage'])
+
+    def _sortable(self, schema_id, table_name, column_name):
+        """
+         Whether a column exists & every value it can hold fits in an index entry: columns of fixed size types,
+         numbers & character columns of at most _max_sort_chars characters. Text (of unlimited length) isn't indexed,
+         a single long value would make inserts & updates of the table fail.
+        """
+        schema_name = 'schema-' + str(schema_id)
+        row = db.engine.execute(
+            "SELECT t.typlen > 0 OR t.typname = 'numeric' OR (t.typname IN ('varchar', 'bpchar') AND "
+            "a.atttypmod - 4 BETWEEN 0 AND {}) AS sortable FROM pg_attribute a JOIN pg_type t ON t.oid = a.atttypid "
+            "WHERE a.attrelid = {}::regclass AND a.attname = {} AND NOT a.attisdropped;".format(
+                int(self._max_sort_chars), *_cv('{}.{}'.format(*_ci(schema_name, table_name)), column_name))).first()
+        return row is not None and row['sortable']
+
+    def _build_sort_index(self, schema_id, table_name, column_name):
+        schema_name = 'schema-' + str(schema_id)
+        index_name = '_sort_' + uuid4().hex
+        self._decide(schema_id, table_name, column_name, 'sort', index_name, 'building')
+        start_time = time.perf_counter()
+        # CREATE INDEX CONCURRENTLY can't be run in a transaction
+        connection = db.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        try:
+            connection.execute('CREATE INDEX CONCURRENTLY {} ON {}.{} ({}, "id");'.format(
+                _ci(index_name), *_ci(schema_name, table_name, column_name)))
+            state = 'ready'
+            app.logger.info("[INFO] Built the sort index of '{}'.'{}' in {:.2f}s".format(
+                table_name, column_name, time.perf_counter() - start_time))
+        except Exception as e:
+            app.logger.error("[ERROR] Unable to build the sort index of '{}'.'{}'".format(table_name, column_name))
+            app.logger.exception(e)
+            state = 'failed'
+            try:
+                # A failed concurrent build leaves an invalid index behind
+                connection.execute('DROP INDEX IF EXISTS {}.{};'.format(*_ci(schema_name, index_name)))
+            except Exception as cleanup_error:
+                app.logger.error("[ERROR] Unable to clean up the sort index of '{}'".format(table_name))
+                app.logger.exception(cleanup_error)
+        finally:
+            connection.close()
+        db.engine.execute('UPDATE Advised_Index SET state = {} WHERE id_dataset = {} AND index_name = {};'.format(
+            *_cv(state, schema_name, index_name)))
+
+    def fail_interrupted_builds(self):
+        """
+         Marks the sort indexes that were being built by processes of the app that stopped as failed & drops what's
+         left of them, so they're tried again later. The builds of processes that are still running are left alone
+         (see ServerProcess). This is called when the server starts.
+        """
+        try:
+            rows = db.engine.execute("SELECT * FROM Advised_Index WHERE usage = 'sort' AND state = 'building' AND "
+                                     "{};".format(ServerProcess().gone('owner')))
+            for row in rows.fetchall():
+                db.engine.execute('DROP INDEX IF EXISTS {}.{};'.format(*_ci(row['id_dataset'], row['index_name'])))
+                db.engine.execute("UPDATE Advised_Index SET state = 'failed' WHERE id_dataset = {} AND "
+                                  "index_name = {};".format(*_cv(row['id_dataset'], row['index_name'])))
+        except Exception as e:
+            app.logger.error("[ERROR] Unable to clean up the interrupted builds of the index advisor")
+            app.logger.exception(e)
+            raise e
+
+    def _decide(self, schema_id, table_name, column_name, usage, index_name, state):
+        # A decision that failed before is replaced
+        db.engine.execute(
+            'INSERT INTO Advised_Index (id_dataset, id_table, column_name, usage, index_name, state, owner, decided) '
+            'VALUES ({}, {}, {}, {}, {}, {}, {}, NOW()) ON CONFLICT (id_dataset, id_table, column_name, usage) '
+            'DO UPDATE SET index_name = EXCLUDED.index_name, state = EXCLUDED.state, owner = EXCLUDED.owner, '
+            'decided = EXCLUDED.decided;'.format(
+                *_cv('schema-' + str(schema_id), table_name, column_name, usage),
+                'NULL' if index_name is None else _cv(index_name), _cv(state), int(ServerProcess().get_id())))
+
+    def _drop_indexes(self):
+        rows = db.engine.execute(
+            "SELECT a.* FROM Advised_Index a LEFT JOIN Column_Usage u ON u.id_dataset = a.id_dataset AND "
+            "u.id_table = a.id_table AND u.column_name = a.column_name AND u.usage = a.usage "
+            "WHERE u.last_used IS NULL OR u.last_used < NOW() - INTERVAL '{} days';".format(
+                int(INDEX_ADVISOR_UNUSED_DAYS))).fetchall()
+        for row in rows:
+            schema_id = int(row['id_dataset'][len('schema-'):])
+            if row['usage'] == 'sort':
+                connection = db.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+                try:
+                    connection.execute('DROP INDEX CONCURRENTLY IF EXISTS {}.{};'.format(
+                        *_ci(row['id_dataset'], row['index_name'])))
+                finally:
+                    connection.close()
+            else:
+                self.search_indexer.drop_index(schema_id, row['id_table'], row['usage'])
+            db.engine.execute('DELETE FROM Advised_Index WHERE id_dataset = {} AND id_table = {} AND '
+                              'column_name = {} AND usage = {};'.format(*_cv(row['id_dataset'], row['id_table'],
+                                                                             row['column_name'], row['usage'])))
+            app.logger.info("[INFO] Dropped the unused {} index of '{}'".format(row['usage'], row['id_table']))
+        # Uses are counted again from the start once a column isn't used anymore
+        db.engine.execute("DELETE FROM Column_Usage WHERE last_used < NOW() - INTERVAL '{} days';".format(
+            int(INDEX_ADVISOR_UNUSED_DAYS)))
+
+    def get_decisions(self):
+        """
+         Returns the indexes the advisor decided to build (most recent first), with how often their column was used
+         since, their size & how often PostgreSQL used them (scans)
+        """
+        try:
+            return db.engine.execute(
+                "SELECT a.id_dataset, a.id_table, a.column_name, a.usage, a.decided, "
+                "COALESCE(a.index_name, s.index_name) AS index_name, COALESCE(s.state, a.state) AS state, "
+                "u.uses, u.last_used, pg_size_pretty(pg_relation_size(i.indexrelid)) AS size, i.idx_scan AS scans "
+                "FROM Advised_Index a "
+                "LEFT JOIN Search_Index s ON a.usage <> 'sort' AND s.id_dataset = a.id_dataset AND "
+                "s.id_table = a.id_table AND s.search_type = a.usage "
+                "LEFT JOIN Column_Usage u ON u.id_dataset = a.id_dataset AND u.id_table = a.id_table AND "
+                "u.column_name = a.column_name AND u.usage = a.usage "
+                "LEFT JOIN pg_stat_user_indexes i ON i.schemaname = a.id_dataset AND "
+                "i.indexrelname = COALESCE(a.index_name, s.index_name) "
+                "ORDER BY a.decided DESC;").fetchall()
+        except Exception as e:
+            app.logger.error("[ERROR] Unable to fetch the decisions of the index advisor")
+            app.logger.exception(e)
+            raise e
+
+
+class UploadJobHandler:
+    """
+     Imports uploaded files in the background. Every upload gets a job record (in the Upload_Job table) that can be
+     polled for its state & progress, the imports themselves are run by a pool of UPLOAD_WORKERS threads.
+     Files that are read while their upload session is still receiving chunks spend most of their time waiting for
+     the next chunk, they're imported by a separate pool of UPLOAD_SESSION_WORKERS threads so they don't hold up the
+     other uploads. If such an upload stalls, its job is 'waiting' until the upload is complete (see _postpone_job).
+    """
+
+    def __init__(self, data_loader, upload_registry, search_indexer):
+        self.data_loader = data_loader
+        self.upload_registry = upload_registry
+        self.search_indexer = search_indexer
+        self.executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS)
+        self.session_executor = ThreadPoolExecutor(max_workers=UPLOAD_SESSION_WORKERS)
+
+    def submit_job(self, schema_id, user_id, path, filename, table_name, table_desc='Default description',
+                   type_deduction=False, session_id=None, digest=None):
+        """
+         Creates a job record for an uploaded file (stored at path) and queues its import.
+         If session_id is given, the file is still being uploaded in chunks by that upload session and it's read
+         as the chunks arrive.
+         digest is the SHA-256 digest of the file, if it was already computed while the file was saved.
+         The file is removed once it has been imported. Returns the id of the job.
+        """
+        schema_name = 'schema-' + str(schema_id)
+        try:
+            job_id = db.engine.execute(
+                'INSERT INTO Upload_Job (id_dataset, id_user, filename, table_name, path, state, owner, created, '
+                "updated) VALUES ({}, {}, {}, {}, {}, 'queued', {}, NOW(), NOW()) RETURNING id;".format(
+                    *_cv(schema_name, user_id, filename, table_name, _escape_percent(path)),
+                    int(ServerProcess().get_id()))).first()[0]
+        except Exception as e:
+            app.logger.error("[ERROR] Unable to create an upload job for file '{}'".format(filename))
+            app.logger.exception(e)
+            raise e
+
+        executor = self.executor if session_id is None else self.session_executor
+        executor.submit(self._run_job, job_id, schema_id, path, filename, table_name, table_desc, type_deduction,
+                        session_id, digest)
+        return job_id
+
+    def _run_job(self, job_id, schema_id, path, filename, table_name, table_desc, type_deduction, session_id=None,
+                 digest=None):
+        """
+         Imports the file of an upload job, this is run by one of the workers.
+         If the same content was loaded into a table of this dataset before (see UploadRegistry), it's served from
+         that table instead.
+        """
+        progress = UploadProgress(job_id)
+        source = path
+        # Compressed files are handled like the file they contain, their progress is measured in compressed bytes
+        file_format = get_format(filename)
+        single_table = file_format == 'csv' or file_format in COLUMNAR_EXTENSIONS
+        # Only files that are loaded into a single table are registered
+        registered = UPLOAD_DEDUPLICATION and single_table
+        content_hash = None
+        session_reader = None
+        postponed = False
+        try:
+            if session_id is not None:
+                session_reader = UploadSessionReader(session_id, path)
+                bytes_total = session_reader.size
+                # The upload is still arriving, so it can only be hashed while it's being loaded
+                content_hash = hashlib.sha256()
+                source = open_text(session_reader, progress, get_compression(filename), digest=content_hash)
+            elif file_format == 'zip':
+                with ZipFile(path) as archive:
+                    # The progress of an archive is measured in decompressed bytes
+                    bytes_total = sum(m.file_size for m in archive.infolist())
+            else:
+                bytes_total = os.path.getsize(path)
+            db.engine.execute("UPDATE Upload_Job SET state = 'running', bytes_total = {}, updated = NOW() "
+                              "WHERE id = {};".format(int(bytes_total), int(job_id)))
+
+            error = None
+            duplicate_of = None
+            if registered and session_id is None:
+                digest = digest or file_digest(path)
+                served = self.upload_registry.serve(schema_id, digest, type_deduction, table_name, table_desc)
+                if served is not None:
+                    duplicate_of, row_count = served
+                    progress.add_bytes(bytes_total)
+                    progress.add_rows(row_count)
+            if duplicate_of is None:
+                error = self._load_file(source, path, file_format, schema_id, table_name, table_desc, type_deduction,
+                                        progress)
+
+            # The loader reports the ids of the rows it added, other uploads may have appended to the table since
+            if registered and duplicate_of is None and error is None and progress.loaded_ids is not None:
+                self.upload_registry.register(schema_id, digest or content_hash.hexdigest(), type_deduction,
+                                              table_name, *progress.loaded_ids)
+            if single_table and error is None:
+                self.search_indexer.build_after_import(schema_id, table_name)
+
+            progress.flush()
+            db.engine.execute("UPDATE Upload_Job SET state = 'finished', error = {}, duplicate_of = {}, "
+                              "updated = NOW() WHERE id = {};".format(
+                                  'NULL' if error is None else _cv(_escape_percent(error)),
+                                  'NULL' if duplicate_of is None else _cv(duplicate_of), int(job_id)))
+        except Exception as e:
+            if session_reader is not None and session_reader.stalled:
+                # The load was rolled back, it's run again from the complete file
+                app.logger.warning("[WARNING] The upload of job {} stalled, it's imported once it's complete".format(
+                    job_id))
+                postponed = self._postpone_job(job_id, schema_id, path, filename, table_name, table_desc,
+                                               type_deduction, session_id)
+                if postponed:
+                    return
+            app.logger.error("[ERROR] Upload job {} failed to process file '{}'".format(job_id, filename))
+            app.logger.exception(e)
+            try:
+                progress.flush()
+                db.engine.execute("UPDATE Upload_Job SET state = 'failed', error = {}, updated = NOW() "
+                                  "WHERE id = {};".format(_cv(_escape_percent(str(e) or type(e).__name__)),
+                                                          int(job_id)))
+            except Exception as update_error:
+                app.logger.error("[ERROR] Unable to mark upload job {} as failed".format(job_id))
+                app.logger.exception(update_error)
+            if session_id is not None:
+                # Chunks may still arrive, the session has to refuse them before its file is removed
+                try:
+                    db.engine.execute('UPDATE Upload_Session SET failed = TRUE, updated = NOW() WHERE id = {};'.format(
+                        _cv(session_id)))
+                except Exception as update_error:
+                    app.logger.error("[ERROR] Unable to mark upload session {} as failed".format(session_id))
+                    app.logger.exception(update_error)
+        finally:
+            if source is not path:
+                source.close()
+            if not postponed and os.path.exists(path):
+                os.remove(path)
+
+    def _postpone_job(self, job_id, schema_id, path, filename, table_name, table_desc, type_deduction, session_id):
+        """
+         Puts the job of an upload session that stopped sending chunks in the 'waiting' state, so no worker or
+         transaction is tied up until the last chunk arrives & resumes it (see UploadSessionHandler.write_chunk).
+         If the upload was completed in the meantime, the job is resumed right away.
+         Returns False if the job can't be postponed because its session is gone.
+        """
+        connection = db.engine.connect()
+        transaction = connection.begin()
+        try:
+            # Lock the session, so write_chunk either sees the job waiting or completes the upload before this
+            row = connection.execute('SELECT received, size FROM Upload_Session WHERE id = {} FOR UPDATE;'.format(
+                _cv(session_id))).first()
+            if row is None:
+                transaction.rollback()
+                return False
+            complete = row['received'] >= row['size']
+            connection.execute("UPDATE Upload_Job SET state = 'waiting', bytes_processed = 0, rows_loaded = 0, "
+                               "updated = NOW() WHERE id = {};".format(int(job_id)))
+            transaction.commit()
+        except Exception as e:
+            transaction.rollback()
+            app.logger.error("[ERROR] Unable to postpone upload job {}".format(job_id))
+            app.logger.exception(e)
+            return False
+        finally:
+            connection.close()
+
+        if complete:
+            self.resume_job(job_id, schema_id, path, filename, table_name, table_desc, type_deduction)
+        return True
+
+    def resume_job(self, job_id, schema_id, path, filename, table_name, table_desc, type_deduction):
+        """ Queues a waiting job (see _postpone_job) again, now that its file is complete """
+        try:
+            db.engine.execute("UPDATE Upload_Job SET state = 'queued', owner = {}, updated = NOW() "
+                              "WHERE id = {};".format(int(ServerProcess().get_id()), int(job_id)))
+        except Exception as e:
+            app.logger.error("[ERROR] Unable to resume upload job {}".format(job_id))
+            app.logger.exception(e)
+            raise e
+        self.executor.submit(self._run_job, job_id, schema_id, path, filename, table_name, table_desc,
+                             type_deduction)
+
+    def fail_interrupted_jobs(self):
+        """
+         Marks the jobs that were queued or running in processes of the app that stopped as failed & removes their
+         files, the threads that ran them are gone. The jobs of processes that are still running are left alone (see
+         ServerProcess), as are the jobs that wait for the rest of their upload. The upload sessions that fed the
+         failed jobs refuse their remaining chunks.
+         This is called when the server starts.
+        """
+        try:
+            rows = db.engine.execute(
+                "UPDATE Upload_Job SET state = 'failed', error = 'The server was restarted', updated = NOW() "
+                "WHERE state IN ('queued', 'running') AND {} RETURNING id, path;".format(
+                    ServerProcess().gone('owner'))).fetchall()
+            for row in rows:
+                db.engine.execute('UPDATE Upload_Session SET failed = TRUE, updated = NOW() WHERE id_job = {};'.format(
+                    int(row['id'])))
+                if row['path'] is not None and os.path.exists(row['path']):
+                    os.remove(row['path'])
+            if len(rows):
+                app.logger.warning("[WARNING] {} upload jobs were interrupted by a restart".format(len(rows)))
+        except Exception as e:
+            app.logger.error("[ERROR] Unable to clean up the interrupted upload jobs")
+            app.logger.exception(e)
+            raise e
+
+    def _load_file(self, source, path, file_format, schema_id, table_name, table_desc, type_deduction, progress):
+        """ Loads the file of an upload job with the loader for its format, returns an error message for the job """
+        if file_format == 'zip':
+            failed_members = self.data_loader.process_zip(path, schema_id, type_deduction=type_deduction,
+                                                          progress=progress)
+            if failed_members:
+                return "The following files couldn't be imported: " + ', '.join(failed_members)
+        elif file_format == 'csv':
+            create_new = not self.data_loader.table_exists(table_name, schema_id)
+            self.data_loader.process_csv(source, schema_id, table_name, table_description=table_desc,
+                                         append=not create_new, type_deduction=type_deduction, progress=progress)
+        elif file_format in COLUMNAR_EXTENSIONS:
+            create_new = not self.data_loader.table_exists(table_name, schema_id)
+            self.data_loader.process_columnar(source, schema_id, table_name, table_description=table_desc,
+                                              append=not create_new, progress=progress)
+        else:
+            self.data_loader.process_dump(source, schema_id, table_name=table_name, table_description=table_desc,
+                                          progress=progress)
+        return None
+
+    def get_job(self, schema_id, job_id):
+        """ Returns the UploadJob with the given id (None if the dataset has no such job) """
+        schema_name = 'schema-' + str(schema_id)
+        try:
+            row = db.engine.execute('SELECT * FROM Upload_Job WHERE id = {} AND id_dataset = {};'.format(
+                int(job_id), _cv(schema_name))).first()
+            if row is None:
+                return None
+            return self._to_job(row)
+        except Exception as e:
+            app.logger.error("[ERROR] Unable to fetch upload job {}".format(job_id))
+            app.logger.exception(e)
+            raise e
+
+    def get_jobs(self, schema_id):
+        """ Returns the UploadJobs of a dataset, most recent first """
+        schema_name = 'schema-' + str(schema_id)
+        try:
+            rows = db.engine.execute('SELECT * FROM Upload_Job WHERE id_dataset = {} ORDER BY id DESC;'.format(
+                _cv(schema_name)))
+            return [self._to_job(row) for row in rows]
+        except Exception as e:
+            app.logger.error("[ERROR] Unable to fetch upload jobs of dataset {}".format(schema_name))
+            app.logger.exception(e)
+            raise e
+
+    def _to_job(self, row):
+        return UploadJob(row['id'], row['id_dataset'], row['filename'], row['table_name'], row['state'],
+                         row['bytes_total'], row['bytes_processed'], row['rows_loaded'], row['error'],
+                         row['created'], row['updated'], row['duplicate_of'])
+
+
+class UploadSession:
+    def __init__(self, id, dataset, filename, size, received=0, job_id=None):
+        self.id = id
+        self.dataset = dataset
+        self.filename = filename
+        self.size = size
+        self.received = received
+        self.job_id = job_id
+
+    def to_dct(self):
+        return {'id': self.id, 'filename': self.filename, 'size': self.size, 'offset': self.received,
+                'job_id': self.job_id, 'chunk_size': UPLOAD_CHUNK_SIZE}
+
+
+class UploadSessionHandler:
+    """
+     Receives files in chunks of at most UPLOAD_CHUNK_SIZE bytes, so an interrupted upload can be resumed after the
+     last chunk that was received. Every upload session has a record in the Upload_Session table.
+     CSV files & dumps are handed to an upload job right away and are loaded while their chunks arrive,
+     ZIP archives & columnar files can only be read once they're complete & are handed to an upload job after their
+     last chunk.
+    """
+
+    def __init__(self, upload_job_handler):
+        self.upload_job_handler = upload_job_handler
+
+    def create_session(self, schema_id, user_id, filename, size, table_name, table_desc='Default description',
+                       type_deduction=False):
+        """ Starts a chunked upload of size bytes, returns the UploadSession """
+        self.remove_abandoned_sessions()
+        schema_name = 'schema-' + str(schema_id)
+        session_id = uuid4().hex
+        try:
+            if size <= 0:
+                raise ValueError("Can't upload an empty file")
+            if not os.path.exists(UPLOAD_FOLDER):
+                os.makedirs(UPLOAD_FOLDER)
+            open(self._get_path(session_id, filename), 'wb').close()
+
+            db.engine.execute(
+                'INSERT INTO Upload_Session (id, id_dataset, id_user, filename, table_name, table_desc, '
+                'type_deduction, size, received, created, updated) '
+                'VALUES ({}, {}, {}, {}, {}, {}, {}, {}, 0, NOW(), NOW());'.format(
+                    *_cv(session_id, schema_name, user_id, filename, table_name, table_desc),
+                    'TRUE' if type_deduction else 'FALSE', int(size)))
+
+            # Archives & columnar files can only be read once they're complete
+            if get_format(filename) != 'zip' and get_format(filename) not in COLUMNAR_EXTENSIONS:
+                job_id = self.upload_job_handler.submit_job(schema_id, user_id, self._get_path(session_id, filename),
+                                                            filename, table_name, table_desc, type_deduction,
+                                                            session_id=session_id)
+                db.engine.execute('UPDATE Upload_Session SET id_job = {} WHERE id = {};'.format(
+                    int(job_id), _cv(session_id)))
+            return self.get_session(schema_id, session_id)
+        except Exception as e:
+            app.logger.error("[ERROR] Unable to start a chunked upload of file '{}'".format(filename))
+            app.logger.exception(e)
+            raise e
+
+    def write_chunk(self, schema_id, session_id, offset, stream, checksum=None):
+        """
+         Appends the chunk in stream (a binary stream) to the upload, offset has to be the amount of bytes that were
+         received so far. If a checksum of the form '<algorithm> <hex digest>' (e.g. 'sha256 9f86d0...') is given,
+         the chunk is only accepted if it matches. Returns the updated UploadSession.
+        """
+        schema_name = 'schema-' + str(schema_id)
+        connection = db.engine.connect()
+        transaction = connection.begin()
+        path = None
+        try:
+            # Lock the session, so two requests can't write a chunk at the same time
+            row = connection.execute(
+                'SELECT * FROM Upload_Session WHERE id = {} AND id_dataset = {} FOR UPDATE;'.format(
+                    *_cv(session_id, schema_name))).first()
+            if row is None:
+                raise ValueError("Upload session {} doesn't exist".format(session_id))
+            if row['failed']:
+                raise ValueError("The import of upload session {} failed, see its upload job".format(session_id))
+            if offset != row['received']:
+                raise ValueError("Expected the chunk at offset {}".format(row['received']))
+            # Read after the lock, so a job that was postponed before it is seen as waiting
+            job_state = None
+            if row['id_job'] is not None:
+                job_state = connection.execute('SELECT state FROM Upload_Job WHERE id = {};'.format(
+                    int(row['id_job']))).first()[0]
+
+            digest = None
+            if checksum:
+                algorithm, expected = checksum.split()
+                digest = hashlib.new(algorithm.lower())
+
+            path = self._get_path(session_id, row['filename'])
+            length = 0
+            with open(path, 'r+b') as upload:
+                # Drop whatever is left of an earlier attempt at this chunk
+                upload.seek(offset)
+                upload.truncate()
+                while True:
+                    block = stream.read(COPY_BUFFER_SIZE)
+                    if not block:
+                        break
+                    length += len(block)
+                    if length > UPLOAD_CHUNK_SIZE or offset + length > row['size']:
+                        raise ValueError("Chunks can be at most {} bytes and can't exceed the size of the upload"
+                                         .format(UPLOAD_CHUNK_SIZE))
+                    if digest is not None:
+                        digest.update(block)
+                    upload.write(block)
+                if digest is not None and digest.hexdigest() != expected.lower():
+                    raise ValueError("The checksum of the chunk doesn't match")
+                upload.flush()
+                os.fsync(upload.fileno())
+
+            connection.execute('UPDATE Upload_Session SET received = {}, updated = NOW() WHERE id = {};'.format(
+                offset + length, _cv(session_id)))
+            transaction.commit()
+        except Exception as e:
+            transaction.rollback()
+            if path is not None and os.path.exists(path):
+                with open(path, 'r+b') as upload:
+                    upload.truncate(offset)
+            app.logger.error("[ERROR] Unable to write chunk at offset {} of upload session {}".format(offset,
+                                                                                                    session_id))
+            app.logger.exception(e)
+            raise e
+        finally:
+            connection.close()
+
+        UploadSessionReader.notify(session_id, offset + length)
+        if offset + length == row['size'] and row['id_job'] is None:
+            # The file is complete, so it can be imported now
+            job_id = self.upload_job_handler.submit_job(schema_id, row['id_user'], path, row['filename'],
+                                                        row['table_name'], row['table_desc'], row['type_deduction'])
+            db.engine.execute('UPDATE Upload_Session SET id_job = {} WHERE id = {};'.format(
+                int(job_id), _cv(session_id)))
+        elif offset + length == row['size'] and job_state == 'waiting':
+            self.upload_job_handler.resume_job(row['id_job'], schema_id, path, row['filename'], row['table_name'],
+                                               row['table_desc'], row['type_deduction'])
+        return self.get_session(schema_id, session_id)
+
+    def get_session(self, schema_id, session_id):
+        """ Returns the UploadSession with the given id (None if the dataset has no such session) """
+        schema_name = 'schema-' + str(schema_id)
+        try:
+            row = db.engine.execute('SELECT * FROM Upload_Session WHERE id = {} AND id_dataset = {};'.format(
+                *_cv(session_id, schema_name))).first()
+            if row is None:
+                return None
+            return UploadSession(row['id'], row['id_dataset'], row['filename'], row['size'], row['received'],
+                                 row['id_job'])
+        except Exception as e:
+            app.logger.error("[ERROR] Unable to fetch upload session {}".format(session_id))
+            app.logger.exception(e)
+            raise e
+
+    def remove_abandoned_sessions(self):
+        """
+         Removes the sessions (& the files of incomplete uploads) that didn't receive a chunk for a long time, the jobs
+         that were waiting for the rest of these uploads fail
+        """
+        try:
+            db.engine.execute(
+                "UPDATE Upload_Job SET state = 'failed', error = 'The upload was abandoned', updated = NOW() "
+                "WHERE state = 'waiting' AND id IN (SELECT id_job FROM Upload_Session WHERE received < size AND "
+                "EXTRACT(EPOCH FROM (NOW() - updated)) > {});".format(UPLOAD_SESSION_TIMEOUT))
+            rows = db.engine.execute(
+                'SELECT id, filename FROM Upload_Session WHERE received < size AND '
+                'EXTRACT(EPOCH FROM (NOW() - updated)) > {};'.format(UPLOAD_SESSION_TIMEOUT))
+            for row in rows:
+                path = self._get_path(row['id'], row['filename'])
+                if os.path.exists(path):
+                    os.remove(path)
+            db.engine.execute('DELETE FROM Upload_Session WHERE EXTRACT(EPOCH FROM (NOW() - updated)) > {};'.format(
+                UPLOAD_SESSION_TIMEOUT))
+        except Exception as e:
+            app.logger.error("[ERROR] Unable to remove abandoned upload sessions")
+            app.logger.exception(e)
+            raise e
+
+    def _get_path(self, session_id, filename):
+        return os.path.join(UPLOAD_FOLDER, '{}_{}'.format(session_id, filename))
@@ -1,7 +1,17 @@
+import csv
+import gzip
+import hashlib
+import io
+import os
+import tempfile
+import time
 import unittest
-from app import user_data_access, data_loader, database as db
+from app import user_data_access, data_loader, upload_job_handler, upload_session_handler, search_indexer, \
+    index_advisor, database as db
 from app.user_service.models import User
-from app.data_service.models import Dataset, Column, Table, _cv, _ci
+from app.data_service import models as data_service_models
+from app.data_service.helpers import csv_ranges, pyarrow
+from app.data_service.models import Dataset, Column, ServerProcess, Table, _cv, _ci
 
 username = "test_username"
 password = "test_pass"
@@ -26,6 +36,24 @@ class TestDataService(unittest.TestCase):
     def tearDownClass(cls):
         user_data_access.delete_user(data_loader, username)
 
+    def wait_for(self, predicate, message, timeout=10):
+        """ Calls predicate until it returns a true value & returns that, fails the test after timeout seconds """
+        deadline = time.monotonic() + timeout
+        while True:
+            result = predicate()
+            if result:
+                return result
+            if time.monotonic() > deadline:
+                self.fail('Timed out: ' + message)
+            time.sleep(0.1)
+
+    def wait_for_job(self, schema_id, job_id):
+        """ Waits until an upload job has finished or failed & returns it """
+        def done():
+            job = upload_job_handler.get_job(schema_id, job_id)
+            return job if job.state in ('finished', 'failed') else None
+        return self.wait_for(done, "upload job {} didn't finish".format(job_id))
+
     def test_create_dataset(self):
         name = 'test_dataset'
         owner_id = username
@@ -100,6 +128,316 @@ class TestDataService(unittest.TestCase):
             data_loader.delete_table(table_name, schema_id)
             data_loader.delete_dataset(schema_id)
 
+    def test_get_table_keyset(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        schema_id = 0
+        values = ['b', None, 'a', 'b', None, 'c', 'a']
+        try:
+            data_loader.create_dataset(schema_name, username)
+            data_loader.create_table(table_name, schema_id, ['name'])
+            for value in values:
+                db.engine.execute('INSERT INTO {}.{} (name) VALUES ({});'.format(
+                    *_ci('schema-0', table_name), 'NULL' if value is None else _cv(value)))
+
+            for ordering in [None, ('name', 'asc'), ('name', 'desc'), ('id', 'desc')]:
+                expected = data_loader.get_table(schema_id, table_name, ordering=ordering or ('id', 'asc')).rows
+                if ordering is not None and ordering[0] == 'name':
+                    # Rows with the same name are ordered by id
+                    expected = sorted(expected, key=lambda row: row[0] if ordering[1] == 'asc' else -row[0])
+                    expected = sorted(expected, key=lambda row: (row[1] is None, row[1] or ''),
+                                      reverse=ordering[1] == 'desc')
+                # Page through the table 3 rows at a time
+                rows = list()
+                cursor = ''
+                while cursor is not None:
+                    table = data_loader.get_table(schema_id, table_name, limit=3, ordering=ordering, after=cursor)
+                    rows.extend(table.rows)
+                    cursor = table.next_cursor
+                self.assertEqual(expected, rows)
+
+            # A cursor can only be used with the ordering it was made for
+            cursor = data_loader.get_table(schema_id, table_name, limit=3, after='').next_cursor
+            with self.assertRaises(ValueError):
+                data_loader.get_table(schema_id, table_name, limit=3, ordering=('name', 'asc'), after=cursor)
+        finally:
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
+    def test_get_table_row_count(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        columns = ['test-column']
+        schema_id = 0
+        threshold = data_service_models.ROW_COUNT_ESTIMATE_THRESHOLD
+        try:
+            data_loader.create_dataset(schema_name, username)
+            data_loader.create_table(table_name, schema_id, columns)
+            table = data_loader.get_table(schema_id, table_name)
+            self.assertEqual((0, True), (table.total_size, table.total_size_exact))
+
+            # The count is kept up to date as rows are added & deleted
+            data_loader.insert_row(table_name, schema_id, columns, {'test-column': 'a'})
+            data_loader.insert_row(table_name, schema_id, columns, {'test-column': 'b'})
+            data_loader.delete_row(schema_id, table_name, [1])
+            self.assertEqual(1, data_loader.get_table(schema_id, table_name).total_size)
+            count = db.engine.execute("SELECT row_count FROM Row_Count WHERE id_dataset = 'schema-0' AND "
+                                      "id_table = 'test-table';").first()[0]
+            self.assertEqual(1, count)
+
+            # Large tables (& tables that were never counted) show the estimate of PostgreSQL
+            data_service_models.ROW_COUNT_ESTIMATE_THRESHOLD = 0
+            db.engine.execute("DELETE FROM Row_Count WHERE id_dataset = 'schema-0';")
+            self.assertFalse(data_loader.get_table(schema_id, table_name).total_size_exact)
+        finally:
+            data_service_models.ROW_COUNT_ESTIMATE_THRESHOLD = threshold
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
+    def test_get_table_filtered_count(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        columns = ['test-column']
+        schema_id = 0
+        try:
+            data_loader.create_dataset(schema_name, username)
+            data_loader.create_table(table_name, schema_id, columns)
+            for value in ['a', 'ab', 'b']:
+                data_loader.insert_row(table_name, schema_id, columns, {'test-column': value})
+            table = data_loader.get_table(schema_id, table_name, limit=1, search='a')
+            self.assertEqual((3, 2), (table.total_size, table.filtered_size))
+            self.assertEqual(1, len(table.rows))
+
+            # The cached count belongs to a version of the table, so it's counted again after a change
+            data_loader.insert_row(table_name, schema_id, columns, {'test-column': 'abc'})
+            self.assertEqual(3, data_loader.get_table(schema_id, table_name, limit=1, search='a').filtered_size)
+            self.assertEqual(4, data_loader.get_table(schema_id, table_name, limit=1).filtered_size)
+        finally:
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
+    def test_get_table_search_index(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        columns = ['test-column', 'other-column']
+        schema_id = 0
+        try:
+            data_loader.create_dataset(schema_name, username)
+            data_loader.create_table(table_name, schema_id, columns)
+            for values in [('abc', 'x'), ('b', 'xab'), ('c', ''), ("it's", 'a_b')]:
+                data_loader.insert_row(table_name, schema_id, columns, dict(zip(columns, values)))
+            # Quotes & wildcards are searched for as they are, an unescaped 'c_x' would match across the columns
+            searches = ['ab', "it's", 'a_b', 'c_x']
+            unindexed = [[list(row) for row in data_loader.get_table(schema_id, table_name, search=search).rows]
+                         for search in searches]
+            self.assertEqual([2, 1, 1, 0], [len(rows) for rows in unindexed])
+
+            search_indexer.build_index(schema_id, table_name)
+            self.wait_for(lambda: search_indexer.get_index(schema_id, table_name)['state'] != 'building',
+                          'the search index is still building')
+            self.assertEqual('ready', search_indexer.get_index(schema_id, table_name)['state'])
+            indexed = [[list(row) for row in data_loader.get_table(schema_id, table_name, search=search).rows]
+                       for search in searches]
+            self.assertEqual(unindexed, indexed)
+
+            # After a change of the columns the index isn't used until it's built again
+            data_loader.insert_column(schema_id, table_name, 'new-column', 'VARCHAR(255)')
+            self.assertEqual(2, data_loader.get_table(schema_id, table_name, search='ab').filtered_size)
+            search_indexer.drop_index(schema_id, table_name)
+            self.assertIsNone(search_indexer.get_index(schema_id, table_name))
+        finally:
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
+    def test_get_table_fulltext_search(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        columns = ['title', 'body']
+        schema_id = 0
+        try:
+            data_loader.create_dataset(schema_name, username)
+            data_loader.create_table(table_name, schema_id, columns)
+            for values in [('notes', 'a red fox'), ('fox', 'the quick brown fox'), ('foxes', 'none here'),
+                           ('other', 'redfox')]:
+                data_loader.insert_row(table_name, schema_id, columns, dict(zip(columns, values)))
+            # Whole words only, the row that mentions fox the most ranks first
+            table = data_loader.get_table(schema_id, table_name, search='fox', search_type='fulltext')
+            self.assertEqual([2, 1], [row[0] for row in table.rows])
+            self.assertEqual(2, table.filtered_size)
+            # The substring search of the same term is counted separately
+            self.assertEqual(4, data_loader.get_table(schema_id, table_name, search='fox').filtered_size)
+            with self.assertRaises(ValueError):
+                data_loader.get_table(schema_id, table_name, search='fox', search_type='regex')
+
+            search_indexer.build_index(schema_id, table_name, 'fulltext')
+            self.wait_for(lambda: search_indexer.get_index(schema_id, table_name, 'fulltext')['state'] != 'building',
+                          'the full-text search index is still building')
+            self.assertEqual('ready', search_indexer.get_index(schema_id, table_name, 'fulltext')['state'])
+            self.assertIsNone(search_indexer.get_index(schema_id, table_name))
+            # The index is kept up to date by PostgreSQL
+            data_loader.insert_row(table_name, schema_id, columns, {'title': 'fox', 'body': 'fox fox'})
+            table = data_loader.get_table(schema_id, table_name, search='brown fox', search_type='fulltext')
+            self.assertEqual([2], [row[0] for row in table.rows])
+            table = data_loader.get_table(schema_id, table_name, search='fox', search_type='fulltext')
+            self.assertEqual([5, 2, 1], [row[0] for row in table.rows])
+        finally:
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
+    def test_get_table_metadata_only(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        columns = ['test-column']
+        schema_id = 0
+        try:
+            data_loader.create_dataset(schema_name, username)
+            data_loader.create_table(table_name, schema_id, columns)
+            for value in ['a', 'b']:
+                data_loader.insert_row(table_name, schema_id, columns, {'test-column': value})
+            # The table view renders the columns & size only
+            table = data_loader.get_table(schema_id, table_name, limit=0)
+            self.assertEqual([], table.rows)
+            self.assertEqual(['id', 'test-column'], [column.name for column in table.columns])
+            self.assertEqual(2, table.total_size)
+        finally:
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
+    def test_get_table_stream(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        columns = ['a', 'b', 'c']
+        schema_id = 0
+        batch_size = data_service_models.TABLE_STREAM_BATCH_SIZE
+        try:
+            data_loader.create_dataset(schema_name, username)
+            data_loader.create_table(table_name, schema_id, columns)
+            for i in range(5):
+                data_loader.insert_row(table_name, schema_id, columns, {'a': str(i), 'b': str(i % 2), 'c': 'x'})
+            data_service_models.TABLE_STREAM_BATCH_SIZE = 2
+            table = data_loader.get_table(schema_id, table_name, limit=4, ordering=('b', 'asc'), after='',
+                                          fields=['c', 'a'], stream=True)
+            self.assertEqual(['id', 'c', 'a'], [column.name for column in table.columns])
+            rows = list(table.rows)
+            self.assertEqual([[1, 'x', '0'], [3, 'x', '2'], [5, 'x', '4'], [2, 'x', '1']], rows)
+            # The next page is the same with & without streaming, although the ordering column isn't projected
+            self.assertIsNotNone(table.next_cursor)
+            page = data_loader.get_table(schema_id, table_name, limit=4, ordering=('b', 'asc'),
+                                         after=table.next_cursor, fields=['c', 'a'])
+            self.assertEqual([[4, 'x', '3']], page.rows)
+            with self.assertRaises(ValueError):
+                data_loader.get_table(schema_id, table_name, fields=['d'])
+        finally:
+            data_service_models.TABLE_STREAM_BATCH_SIZE = batch_size
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
+    def test_get_table_page_cache(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        columns = ['test-column']
+        schema_id = 0
+        try:
+            data_loader.create_dataset(schema_name, username)
+            data_loader.create_table(table_name, schema_id, columns)
+            for value in ['a', 'b']:
+                data_loader.insert_row(table_name, schema_id, columns, {'test-column': value})
+            page = data_loader.get_table(schema_id, table_name, limit=10, ordering=('id', 'asc'))
+            self.assertEqual([[1, 'a'], [2, 'b']], page.rows)
+            page.rows[0][1] = 'changed'
+
+            # A change that doesn't bump the version of the table isn't seen, the page is served from the cache
+            db.engine.execute('UPDATE {}.{} SET {} = {} WHERE id = 2;'.format(
+                *_ci('schema-0', table_name, 'test-column'), _cv('c')))
+            page = data_loader.get_table(schema_id, table_name, limit=10, ordering=('id', 'asc'))
+            self.assertEqual([[1, 'a'], [2, 'b']], page.rows)
+            # Another page isn't cached yet
+            self.assertEqual([[2, 'c']], data_loader.get_table(schema_id, table_name, offset=1, limit=10,
+                                                                 ordering=('id', 'asc')).rows)
+
+            data_loader.insert_row(table_name, schema_id, columns, {'test-column': 'd'})
+            page = data_loader.get_table(schema_id, table_name, limit=10, ordering=('id', 'asc'))
+            self.assertEqual([[1, 'a'], [2, 'c'], [3, 'd']], page.rows)
+            self.assertEqual(3, page.total_size)
+        finally:
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
+    def test_get_column_names_cache(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        columns = ['b', 'a']
+        schema_id = 0
+        try:
+            data_loader.create_dataset(schema_name, username)
+            data_loader.create_table(table_name, schema_id, columns)
+            self.assertEqual(['id', 'b', 'a'], data_loader.get_column_names(schema_id, table_name))
+
+            # Changes that aren't made through the app aren't seen until the columns are invalidated
+            db.engine.execute('ALTER TABLE {}.{} ADD COLUMN {} text;'.format(*_ci('schema-0', table_name, 'c')))
+            self.assertEqual(['id', 'b', 'a'], data_loader.get_column_names(schema_id, table_name))
+            data_loader.rename_column(schema_id, table_name, 'a', 'd')
+            self.assertEqual(['id', 'b', 'd', 'c'], data_loader.get_column_names(schema_id, table_name))
+            data_loader.insert_column(schema_id, table_name, 'e', 'integer', enable_history=False)
+            self.assertEqual([('e', 'integer')], [(column.name, column.type) for column in
+                                                   data_loader.get_column_names_and_types(schema_id, table_name)[4:]])
+        finally:
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+        self.assertEqual([], data_loader.get_column_names(schema_id, table_name))
+
+    def test_index_advisor(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        columns = ['test-column', 'note']
+        schema_id = 0
+        settings = (data_service_models.INDEX_ADVISOR_INTERVAL, data_service_models.INDEX_ADVISOR_MIN_USES,
+                    data_service_models.INDEX_ADVISOR_MIN_ROWS)
+        try:
+            # The advisor is run by hand
+            data_service_models.INDEX_ADVISOR_INTERVAL = 3600
+            data_service_models.IndexAdvisor._last_run = time.monotonic()
+            data_service_models.INDEX_ADVISOR_MIN_USES = 2
+            data_service_models.INDEX_ADVISOR_MIN_ROWS = 0
+            data_loader.create_dataset(schema_name, username)
+            data_loader.create_table(table_name, schema_id, columns, types=['varchar(255)', 'text'])
+            data_loader.insert_row(table_name, schema_id, columns, {'test-column': 'a', 'note': 'b'})
+
+            index_advisor.record_page(schema_id, table_name, ('test-column', 'asc'))
+            index_advisor.run()
+            self.assertEqual([], index_advisor.get_decisions())
+            index_advisor.record_page(schema_id, table_name, ('test-column', 'desc'))
+            index_advisor.record_page(schema_id, table_name, ('id', 'asc'))
+            # Text can be too long for an index entry, so it isn't indexed
+            index_advisor.record_page(schema_id, table_name, ('note', 'asc'))
+            index_advisor.record_page(schema_id, table_name, ('note', 'asc'))
+            index_advisor.run()
+            decisions = index_advisor.get_decisions()
+            self.assertEqual([('test-column', 'sort', 'ready', 2)],
+                             [(d['column_name'], d['usage'], d['state'], d['uses']) for d in decisions])
+            self.assertIsNotNone(decisions[0]['size'])
+
+            # An index that failed to build is tried again after a while
+            db.engine.execute("UPDATE Advised_Index SET state = 'failed', decided = NOW() - INTERVAL '1 hour';")
+            index_advisor.run()
+            self.assertEqual('failed', index_advisor.get_decisions()[0]['state'])
+            db.engine.execute("UPDATE Advised_Index SET decided = NOW() - INTERVAL '1 year';")
+            index_advisor.run()
+            decisions = index_advisor.get_decisions()
+            self.assertEqual([('test-column', 'ready')], [(d['column_name'], d['state']) for d in decisions])
+
+            # Indexes of columns that aren't sorted anymore are dropped
+            db.engine.execute("UPDATE Column_Usage SET last_used = NOW() - INTERVAL '1 year';")
+            index_advisor.run()
+            self.assertEqual([], index_advisor.get_decisions())
+            self.assertIsNone(db.engine.execute('SELECT to_regclass({});'.format(
+                _cv('"schema-0".' + _ci(decisions[0]['index_name'])))).first()[0])
+        finally:
+            (data_service_models.INDEX_ADVISOR_INTERVAL, data_service_models.INDEX_ADVISOR_MIN_USES,
+             data_service_models.INDEX_ADVISOR_MIN_ROWS) = settings
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
     def test_table_exists(self):
         schema_name = 'test-schema'
         table_name = 'test-table'
@@ -198,6 +536,442 @@ class TestDataService(unittest.TestCase):
             data_loader.delete_table(table_name, schema_id)
             data_loader.delete_dataset(schema_id)
 
+    def test_process_csv(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        schema_id = 0
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+            csv_file.write('name,"amount",note\n')
+            csv_file.write('a,1,"comma, inside"\n')
+            csv_file.write('b,2,\n')
+        try:
+            data_loader.create_dataset(schema_name, username)
+            self.assertEqual(2, data_loader.process_csv(csv_file.name, schema_id, table_name))
+            table = data_loader.get_table(schema_id, table_name)
+            self.assertEqual(['id', 'name', 'amount', 'note'], [column.name for column in table.columns])
+            self.assertEqual([1, 'a', '1', 'comma, inside'], table.rows[0])
+            self.assertEqual([2, 'b', '2', None], table.rows[1])
+            self.assertEqual(2, len(data_loader.get_table(schema_id, '_raw_' + table_name).rows))
+        finally:
+            os.remove(csv_file.name)
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
+    def test_process_csv_compressed(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        schema_id = 0
+        with tempfile.NamedTemporaryFile(suffix='.csv.gz', delete=False) as csv_file:
+            csv_file.write(gzip.compress(b'name,amount\na,1\nb,2\n'))
+        try:
+            data_loader.create_dataset(schema_name, username)
+            self.assertEqual(2, data_loader.process_csv(csv_file.name, schema_id, table_name))
+            self.assertEqual([[1, 'a', '1'], [2, 'b', '2']], data_loader.get_table(schema_id, table_name).rows)
+        finally:
+            os.remove(csv_file.name)
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
+    def test_process_csv_staging(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        schema_id = 0
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+            csv_file.write('name,amount\na,1\nb,2,3\n')
+        try:
+            data_loader.create_dataset(schema_name, username)
+            # The load fails halfway, neither the table nor its staging table may be left behind
+            with self.assertRaises(Exception):
+                data_loader.process_csv(csv_file.name, schema_id, table_name)
+            self.assertFalse(data_loader.table_exists(table_name, schema_id))
+            tables = db.engine.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = "
+                                       "'schema-0';")
+            self.assertEqual([], [row[0] for row in tables if row[0].startswith('_staging_')])
+
+            with open(csv_file.name, 'w') as csv_stream:
+                csv_stream.write('name,amount\na,1\nb,2\n')
+            # The names the pkey & sequence would get may be taken by other tables of the dataset
+            db.engine.execute('CREATE TABLE "schema-0"."test-table_id_seq" (id integer);')
+            db.engine.execute('CREATE TABLE "schema-0"."test-table_pkey" (id integer);')
+            self.assertEqual(2, data_loader.process_csv(csv_file.name, schema_id, table_name))
+            # The promoted table has its primary key & sequence, so new rows still get an id
+            db.engine.execute('INSERT INTO "schema-0"."test-table" (name, amount) VALUES (\'c\', \'3\');')
+            self.assertEqual([1, 2, 3], [row[0] for row in data_loader.get_table(schema_id, table_name).rows])
+        finally:
+            os.remove(csv_file.name)
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
+    def test_process_csv_parallel(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        schema_id = 0
+        rows = [['a', '1'], ['multi\nline, "quoted"', '2'], ['c', '3'], ['d', '4'], ['e', '5']]
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', newline='', delete=False) as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(['name', 'amount'])
+            writer.writerows(rows)
+        parallel_size = data_service_models.CSV_PARALLEL_SIZE
+        parts = list()
+        try:
+            # Every range holds whole records, even if it starts in the middle of a quoted value
+            ranges = csv_ranges(csv_file.name, 4)
+            self.assertLess(1, len(ranges))
+            with open(csv_file.name, newline='') as csv_stream:
+                content = csv_stream.read()
+            self.assertEqual(rows, [row for start, end in ranges
+                                    for row in csv.reader(io.StringIO(content[start:end], newline=''))])
+
+            data_service_models.CSV_PARALLEL_SIZE = 0
+            data_loader.create_dataset(schema_name, username)
+            self.assertEqual(len(rows), data_loader.process_csv(csv_file.name, schema_id, table_name))
+            self.assertEqual([[r_ix + 1] + row for r_ix, row in enumerate(rows)],
+                             data_loader.get_table(schema_id, table_name).rows)
+            tables = db.engine.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = "
+                                       "'schema-0';")
+            self.assertEqual([], [row[0] for row in tables if row[0].startswith('_part_')])
+
+            # Only the parts that a process which stopped left behind are dropped, not those of running loads
+            stopped = db.engine.execute("SELECT nextval('Server_Process');").first()[0]
+            parts = ['_part_{}_{}_0'.format(process, '0' * 32) for process in [stopped, ServerProcess().get_id()]]
+            for part in parts:
+                db.engine.execute('CREATE TABLE "_csv_parts".{} (name text);'.format(_ci(part)))
+            data_loader.drop_csv_parts()
+            tables = db.engine.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = "
+                                       "'_csv_parts';")
+            self.assertEqual(parts[1:], [row[0] for row in tables])
+        finally:
+            data_service_models.CSV_PARALLEL_SIZE = parallel_size
+            for part in parts:
+                db.engine.execute('DROP TABLE IF EXISTS "_csv_parts".{};'.format(_ci(part)))
+            os.remove(csv_file.name)
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_process_columnar(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        schema_id = 0
+        table = pyarrow.Table.from_arrays([pyarrow.array(['a', None]), pyarrow.array([1, 2]),
+                                           pyarrow.array([1.5, None])], ['name', 'amount', 'price'])
+        with tempfile.NamedTemporaryFile(suffix='.parquet', delete=False) as parquet_file:
+            pass
+        try:
+            pyarrow.parquet.write_table(table, parquet_file.name)
+            data_loader.create_dataset(schema_name, username)
+            self.assertEqual(2, data_loader.process_columnar(parquet_file.name, schema_id, table_name))
+            types = [column.type for column in data_loader.get_column_names_and_types(schema_id, table_name)]
+            self.assertEqual(['integer', 'text', 'integer', 'double'], types)
+            self.assertEqual([[1, 'a', 1, 1.5], [2, None, 2, None]], data_loader.get_table(schema_id, table_name).rows)
+        finally:
+            os.remove(parquet_file.name)
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_process_columnar_feather(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        schema_id = 0
+        data_frame = pyarrow.Table.from_arrays([pyarrow.array(['a', None]), pyarrow.array([1, 2])],
+                                               ['name', 'amount']).to_pandas()
+        with tempfile.NamedTemporaryFile(suffix='.feather', delete=False) as feather_file:
+            pass
+        try:
+            # Version 1 of the format isn't an Arrow IPC file
+            try:
+                pyarrow.feather.write_feather(data_frame, feather_file.name, version=1)
+            except TypeError:  # Older versions of pyarrow only write version 1
+                pyarrow.feather.write_feather(data_frame, feather_file.name)
+            data_loader.create_dataset(schema_name, username)
+            self.assertEqual(2, data_loader.process_columnar(feather_file.name, schema_id, table_name))
+            self.assertEqual([[1, 'a', 1], [2, None, 2]], data_loader.get_table(schema_id, table_name).rows)
+        finally:
+            os.remove(feather_file.name)
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
+    def test_process_csv_type_deduction(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        schema_id = 0
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+            csv_file.write('name,amount,price,date\n')
+            csv_file.write('a,1,1.5,2018-01-02\n')
+            csv_file.write('b,2,2.5,2018-03-04\n')
+        try:
+            data_loader.create_dataset(schema_name, username)
+            data_loader.process_csv(csv_file.name, schema_id, table_name, type_deduction=True)
+            types = [column.type for column in data_loader.get_column_names_and_types(schema_id, table_name)]
+            self.assertEqual(['integer', 'text', 'integer', 'double', 'timestamp'], types)
+            data_loader.process_csv(csv_file.name, schema_id, table_name, append=True, type_deduction=True)
+            self.assertEqual([1, 2, 3, 4], [row[0] for row in data_loader.get_table(schema_id, table_name).rows])
+        finally:
+            os.remove(csv_file.name)
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
+    def test_process_csv_append(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        schema_id = 0
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+            csv_file.write('name,amount,price\n')
+            csv_file.write('a,1,1.5\n')
+        try:
+            data_loader.create_dataset(schema_name, username)
+            data_loader.process_csv(csv_file.name, schema_id, table_name, type_deduction=True)
+            self.assertEqual(1, data_loader.get_table(schema_id, '_raw_' + table_name).total_size)
+
+            # The header is matched to the existing columns, missing columns are left NULL
+            with open(csv_file.name, 'w') as csv_stream:
+                csv_stream.write(' Price ,NAME\n')
+                csv_stream.write('2.5,b\n')
+            self.assertEqual(1, data_loader.process_csv(csv_file.name, schema_id, table_name, append=True))
+            self.assertEqual([[1, 'a', 1, 1.5], [2, 'b', None, 2.5]],
+                             data_loader.get_table(schema_id, table_name).rows)
+            raw_table = data_loader.get_table(schema_id, '_raw_' + table_name)
+            self.assertEqual(2, len(raw_table.rows))
+            self.assertEqual(2, raw_table.total_size)
+
+            # A column that doesn't exist in the table is an error & nothing is appended
+            with open(csv_file.name, 'w') as csv_stream:
+                csv_stream.write('name,colour\n')
+                csv_stream.write('c,red\n')
+            with self.assertRaises(ValueError):
+                data_loader.process_csv(csv_file.name, schema_id, table_name, append=True)
+            self.assertEqual(2, len(data_loader.get_table(schema_id, table_name).rows))
+        finally:
+            os.remove(csv_file.name)
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
+    def test_process_csv_type_deduction_mixed_values(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        schema_id = 0
+        sample_head = data_service_models.TYPE_SAMPLE_HEAD
+        sample_size = data_service_models.TYPE_SAMPLE_SIZE
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+            csv_file.write('amount\n1\n2\nnot a number\n')
+        try:
+            # Only the first row is sampled, so the column is deduced as a number & falls back to text while loading
+            data_service_models.TYPE_SAMPLE_HEAD = 1
+            data_service_models.TYPE_SAMPLE_SIZE = 0
+            data_loader.create_dataset(schema_name, username)
+            data_loader.process_csv(csv_file.name, schema_id, table_name, type_deduction=True)
+            types = [column.type for column in data_loader.get_column_names_and_types(schema_id, table_name)]
+            self.assertEqual(['integer', 'text'], types)
+            self.assertEqual([[1, '1'], [2, '2'], [3, 'not a number']],
+                             data_loader.get_table(schema_id, table_name).rows)
+        finally:
+            data_service_models.TYPE_SAMPLE_HEAD = sample_head
+            data_service_models.TYPE_SAMPLE_SIZE = sample_size
+            os.remove(csv_file.name)
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
+    def test_process_dump(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        schema_id = 0
+        with tempfile.NamedTemporaryFile('w', suffix='.sql', delete=False) as dump_file:
+            dump_file.write('-- Dump; with a comment\n')
+            dump_file.write('CREATE TABLE "test-table" (name varchar(255), note varchar(255));\n')
+            dump_file.write('INSERT INTO "test-table" (name, note) VALUES (\'a\', \'semi;colon\'), (\'b\', NULL);\n')
+            dump_file.write('INSERT INTO "test-table" (name, note) VALUES (\'it\'\'s\', \'(1, 2)\');\n')
+        try:
+            data_loader.create_dataset(schema_name, username)
+            data_loader.process_dump(dump_file.name, schema_id, table_name)
+            table = data_loader.get_table(schema_id, table_name)
+            self.assertEqual([[1, 'a', 'semi;colon'], [2, 'b', None], [3, "it's", '(1, 2)']], table.rows)
+            self.assertEqual(3, len(data_loader.get_table(schema_id, '_raw_' + table_name).rows))
+        finally:
+            os.remove(dump_file.name)
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
+    def test_upload_job(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        schema_id = 0
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+            csv_file.write('name,amount\n')
+            csv_file.write('a,1\n')
+            csv_file.write('b,2\n')
+        try:
+            data_loader.create_dataset(schema_name, username)
+            job_id = upload_job_handler.submit_job(schema_id, username, csv_file.name, 'test.csv', table_name)
+            job = self.wait_for_job(schema_id, job_id)
+            self.assertEqual('finished', job.state)
+            self.assertEqual(2, job.rows_loaded)
+            self.assertEqual(job.bytes_total, job.bytes_processed)
+            self.assertFalse(os.path.exists(csv_file.name))  # The upload is removed once it has been imported
+            self.assertEqual(2, len(data_loader.get_table(schema_id, table_name).rows))
+            self.assertEqual([job_id], [job.id for job in upload_job_handler.get_jobs(schema_id)])
+        finally:
+            if os.path.exists(csv_file.name):
+                os.remove(csv_file.name)
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
+    def test_upload_deduplication(self):
+        schema_name = 'test-schema'
+        table_names = ['test-table', 'test-table-copy']
+        schema_id = 0
+        uploads = [('test-table', None), ('test-table-copy', 'test-table'), ('test-table', 'test-table')]
+        paths = list()
+        try:
+            data_loader.create_dataset(schema_name, username)
+            for table_name, duplicate_of in uploads:
+                with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+                    csv_file.write('name,amount\na,1\nb,2\n')
+                paths.append(csv_file.name)
+                job_id = upload_job_handler.submit_job(schema_id, username, csv_file.name, 'test.csv', table_name)
+                job = self.wait_for_job(schema_id, job_id)
+                self.assertEqual('finished', job.state)
+                self.assertEqual(duplicate_of, job.duplicate_of)
+            # The copy has the same rows & the repeated upload wasn't appended again
+            self.assertEqual(2, len(data_loader.get_table(schema_id, 'test-table').rows))
+            self.assertEqual(data_loader.get_table(schema_id, 'test-table').rows,
+                             data_loader.get_table(schema_id, 'test-table-copy').rows)
+
+            # Another file appended to the table is registered with the ids of its own rows
+            with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+                csv_file.write('name,amount\nc,3\n')
+            paths.append(csv_file.name)
+            job_id = upload_job_handler.submit_job(schema_id, username, csv_file.name, 'test.csv', 'test-table')
+            self.assertEqual('finished', self.wait_for_job(schema_id, job_id).state)
+            entries = db.engine.execute("SELECT table_name, first_id, last_id FROM Upload_Registry "
+                                        "WHERE id_dataset = 'schema-0' ORDER BY table_name, first_id;")
+            self.assertEqual([('test-table', 1, 2), ('test-table', 3, 3), ('test-table-copy', 1, 2)],
+                             [tuple(entry) for entry in entries])
+        finally:
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+            for table_name in table_names:
+                data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
+    def test_chunked_upload(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        schema_id = 0
+        chunks = [b'name,amount\na,', b'1\nb,2\n']
+        try:
+            data_loader.create_dataset(schema_name, username)
+            session = upload_session_handler.create_session(schema_id, username, 'test.csv',
+                                                            sum(len(chunk) for chunk in chunks), table_name)
+            self.assertEqual(0, session.received)
+
+            session = upload_session_handler.write_chunk(schema_id, session.id, 0, io.BytesIO(chunks[0]))
+            self.assertEqual(len(chunks[0]), session.received)
+            # A chunk with the wrong checksum is rejected & can be sent again
+            with self.assertRaises(ValueError):
+                upload_session_handler.write_chunk(schema_id, session.id, session.received, io.BytesIO(b'9\n'),
+                                                   'sha256 ' + hashlib.sha256(chunks[1]).hexdigest())
+            session = upload_session_handler.write_chunk(schema_id, session.id, session.received,
+                                                         io.BytesIO(chunks[1]),
+                                                         'sha256 ' + hashlib.sha256(chunks[1]).hexdigest())
+
+            job = self.wait_for_job(schema_id, session.job_id)
+            self.assertEqual('finished', job.state)
+            self.assertEqual([[1, 'a', '1'], [2, 'b', '2']], data_loader.get_table(schema_id, table_name).rows)
+        finally:
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
+    def test_chunked_upload_stalled(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        schema_id = 0
+        chunks = [b'name,amount\na,', b'1\nb,2\n']
+        stall_timeout = data_service_models.UPLOAD_SESSION_STALL_TIMEOUT
+        try:
+            data_service_models.UPLOAD_SESSION_STALL_TIMEOUT = 0.5
+            data_loader.create_dataset(schema_name, username)
+            session = upload_session_handler.create_session(schema_id, username, 'test.csv',
+                                                            sum(len(chunk) for chunk in chunks), table_name)
+            session = upload_session_handler.write_chunk(schema_id, session.id, 0, io.BytesIO(chunks[0]))
+            # The import gives up waiting for the next chunk & waits for the upload to be complete instead
+            self.wait_for(lambda: upload_job_handler.get_job(schema_id, session.job_id).state == 'waiting',
+                          "the stalled upload job isn't waiting")
+            self.assertFalse(data_loader.table_exists(table_name, schema_id))
+
+            upload_session_handler.write_chunk(schema_id, session.id, session.received, io.BytesIO(chunks[1]))
+            job = self.wait_for_job(schema_id, session.job_id)
+            self.assertEqual('finished', job.state)
+            self.assertEqual(2, job.rows_loaded)
+            self.assertEqual([[1, 'a', '1'], [2, 'b', '2']], data_loader.get_table(schema_id, table_name).rows)
+        finally:
+            data_service_models.UPLOAD_SESSION_STALL_TIMEOUT = stall_timeout
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
+    def test_chunked_upload_failed(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        schema_id = 0
+        # The header has a duplicate column, so the import fails before the upload is complete
+        chunks = [b'name,name\n', b'a,b\n']
+        try:
+            data_loader.create_dataset(schema_name, username)
+            session = upload_session_handler.create_session(schema_id, username, 'test.csv',
+                                                            sum(len(chunk) for chunk in chunks), table_name)
+            session = upload_session_handler.write_chunk(schema_id, session.id, 0, io.BytesIO(chunks[0]))
+            job = self.wait_for_job(schema_id, session.job_id)
+            self.assertEqual('failed', job.state)
+            # The rest of the upload is refused instead of being written to the removed file
+            with self.assertRaises(ValueError):
+                upload_session_handler.write_chunk(schema_id, session.id, session.received, io.BytesIO(chunks[1]))
+        finally:
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
+    def test_fail_interrupted_jobs(self):
+        schema_name = 'test-schema'
+        table_name = 'test-table'
+        schema_id = 0
+        paths = list()
+        for _ in range(2):
+            with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+                csv_file.write('name\na\n')
+            paths.append(csv_file.name)
+        # A process of the app that stopped & this process, which is still running
+        stopped = db.engine.execute("SELECT nextval('Server_Process');").first()[0]
+        running = ServerProcess().get_id()
+        try:
+            data_loader.create_dataset(schema_name, username)
+            data_loader.create_table(table_name, schema_id, ['name'])
+            # The jobs & search index builds that were in progress in both processes
+            job_ids = list()
+            for path, owner in zip(paths, [stopped, running]):
+                job_ids.append(db.engine.execute(
+                    "INSERT INTO Upload_Job (id_dataset, id_user, filename, table_name, path, state, owner, created, "
+                    "updated) VALUES ('schema-0', {}, 'test.csv', {}, {}, 'running', {}, NOW(), NOW()) "
+                    "RETURNING id;".format(*_cv(username, table_name, path), owner)).first()[0])
+            for search_type, owner in [('substring', stopped), ('fulltext', running)]:
+                db.engine.execute(
+                    "INSERT INTO Search_Index (id_dataset, id_table, search_type, index_name, columns, state, owner, "
+                    "updated) VALUES ('schema-0', {}, {}, {}, '[\"name\"]', 'building', {}, NOW());".format(
+                        *_cv(table_name, search_type, '_search_' + search_type), owner))
+
+            upload_job_handler.fail_interrupted_jobs()
+            search_indexer.fail_interrupted_builds()
+            self.assertEqual(['failed', 'running'],
+                             [upload_job_handler.get_job(schema_id, job_id).state for job_id in job_ids])
+            self.assertEqual([False, True], [os.path.exists(path) for path in paths])
+            self.assertEqual('failed', search_indexer.get_index(schema_id, table_name)['state'])
+            self.assertEqual('building', search_indexer.get_index(schema_id, table_name, 'fulltext')['state'])
+        finally:
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+            data_loader.delete_table(table_name, schema_id)
+            data_loader.delete_dataset(schema_id)
+
     def test_grant_access(self):
         contrib_username = "contrib_test_username"
         contrib_password = "contrib_test_pass"
@@ -7,7 +7,8 @@ from recordlinkage.preprocessing import clean
 
 from app import app, database as db
 from app.data_transform.helpers import create_serial_sequence
-from app.data_service.models import DataLoader, Table
+from app.data_service.helpers import ColumnCache
+from app.data_service.models import DataLoader, RowCounter, Table
 from app.history.models import History
 
 
@@ -462,7 +463,8 @@ class DataDeduplicator:
             delete_rows_query = "DELETE FROM {}.{} WHERE id IN ({});".format(*_ci(schema_name, table_name),
                                                                              identical_rows_query)
 
-            db.engine.execute(delete_rows_query)
+            deleted = db.engine.execute(delete_rows_query).rowcount
+            RowCounter().add_rows(schema_id, table_name, -deleted)
         except Exception as e:
             app.logger.error("[ERROR] Unable to remove identical rows from table '{}'".format(table_name))
             app.logger.exception(e)
@@ -513,6 +515,8 @@ class DataDeduplicator:
                 *_ci(schema_name, table_name, dedup_table_name))
 
             db.engine.execute(query)
+            # The view has the columns the table has now
+            ColumnCache().invalidate(schema_id, dedup_view_name)
         except Exception as e:
             app.logger.error("[ERROR] Could not create view for \'duplicate\' rows for table '{}'".format(table_name))
             app.logger.exception(e)
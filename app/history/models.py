@@ -1,4 +1,5 @@
 from app import app, database as db
+from app.data_service.helpers import ColumnCache
 
 
 def _ci(*args: str):
@@ -17,11 +18,22 @@ class History:
     def __init__(self):
         pass
 
-    def log_action(self, dataset_id, table_name, date, desc, inverse_query):
+    def log_action(self, dataset_id, table_name, date, desc, inverse_query, row_delta=None):
+        """
+         Saves an action & its inverse query to the history of a table & bumps the version of the table.
+         The cached row count of the table (see RowCounter) is changed by row_delta, or dropped if it isn't given.
+        """
         dataset_name = 'schema-' + str(dataset_id)
         try:
             db.engine.execute(
                     "INSERT INTO HISTORY (id_dataset, id_table, date, action_desc, inv_query, undone) VALUES ({}, {}, '{}', {}, {}, FALSE)".format(*_cv(dataset_name, table_name), date, *_cv(desc, inverse_query)))
+            self.bump_version(dataset_id, table_name)
+            if row_delta is None:
+                db.engine.execute('DELETE FROM Row_Count WHERE id_dataset={} AND id_table={};'.format(
+                    *_cv(dataset_name, table_name)))
+            elif row_delta:
+                db.engine.execute('UPDATE Row_Count SET row_count = row_count + {} WHERE id_dataset={} AND id_table={};'.format(
+                    int(row_delta), *_cv(dataset_name, table_name)))
             if app.config['HISTORY_LIMIT']:
                 db.engine.execute(
                         'UPDATE HISTORY SET UNDONE=TRUE, INV_QUERY=NULL ' +
@@ -35,6 +47,16 @@ class History:
             app.logger.exception(e)
             raise e
 
+    def bump_version(self, dataset_id, table_name):
+        """
+         Bumps the version of a table, which tells the caches of its contents (e.g. row counts) that it has changed.
+         The cached columns of the table (see ColumnCache) are dropped as well.
+        """
+        dataset_name = 'schema-' + str(dataset_id)
+        db.engine.execute('UPDATE metadata SET version = version + 1 WHERE id_dataset={} AND id_table={};'.format(
+            *_cv(dataset_name, table_name)))
+        ColumnCache().invalidate(dataset_id, table_name)
+
     def get_actions(self, dataset_id, table_name, offset=0, limit='ALL', ordering=None, search=None):
         dataset_name = 'schema-' + str(dataset_id)
         try:
@@ -82,6 +104,9 @@ class History:
             raise e
         try:
             db.engine.execute('UPDATE HISTORY SET UNDONE=TRUE WHERE ACTION_ID={}'.format(action_id))
+            self.bump_version(dataset_id, table_name)
+            db.engine.execute('DELETE FROM Row_Count WHERE id_dataset={} AND id_table={};'.format(
+                *_cv(dataset_name, table_name)))
         except Exception as e:
             app.logger.error('[ERROR] Failed to set action with id {} as undone'.format(action_id))
             app.logger.exception(e)
@@ -2,7 +2,7 @@ from flask import Blueprint, request, render_template, url_for, redirect, abort,
 from flask_login import login_required, current_user, login_user, logout_user
 from passlib.hash import sha256_crypt
 
-from app import app, data_loader, login, user_data_access, active_user_handler
+from app import app, data_loader, login, user_data_access, active_user_handler, index_advisor
 from app.user_service.models import User
 from config import ADMIN_USERNAME
 
@@ -125,6 +125,19 @@ def admin_page():
                                admins=admins, main_admin=ADMIN_USERNAME)
 
 
+@user_service.route('/admin-page/indexes', methods=['GET'])
+@login_required
+def admin_indexes():
+    if current_user.status != 'admin':
+        return abort(403)
+    try:
+        decisions = index_advisor.get_decisions()
+    except Exception:
+        flash(u"Indexes couldn't be shown!", 'danger')
+        return redirect(url_for('user_service.admin_page'), code=303)
+    return render_template('user_service/admin-indexes.html', decisions=decisions)
+
+
 @user_service.route('/admin-page/<string:username>/delete', methods=['DELETE'])
 @login_required
 def delete_user_as_admin(username):
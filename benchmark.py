@@ -0,0 +1,316 @@
+# Ingestion benchmark: generates synthetic CSV, ZIP & SQL dump files and times how long it takes to load them.
+#
+# Usage (see --help for all options):
+#   python3 benchmark.py --rows 100000 --columns 10 --formats csv,zip,dump --output results.json
+#
+# The benchmark always runs against the test database (test_userdb), so it never touches the data of the app itself.
+# The results are written as JSON.
+
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from uuid import uuid4
+from zipfile import ZipFile, ZIP_DEFLATED
+
+# config.py selects the test database if there's a command line argument, so make sure there always is one
+if len(sys.argv) == 1:
+    sys.argv.append('--repeat=1')
+
+from app import user_data_access, data_loader, database as db
+from app.user_service.models import User
+import app.data_service.models as data_service_models
+
+BENCHMARK_USER = 'benchmark_user'
+STRING_CHARACTERS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 ,"\''
+COLUMN_TYPES = ['int', 'float', 'text', 'date', 'bool']
+
+
+# Synthetic data
+def generate_value(rng, column_type, string_length):
+    if column_type == 'int':
+        return str(rng.randint(-10 ** 9, 10 ** 9))
+    if column_type == 'float':
+        return repr(rng.uniform(-10 ** 6, 10 ** 6))
+    if column_type == 'date':
+        return (datetime(2000, 1, 1) + timedelta(seconds=rng.randint(0, 20 * 365 * 24 * 3600))).isoformat(' ')
+    if column_type == 'bool':
+        return rng.choice(['true', 'false'])
+    return ''.join(rng.choice(STRING_CHARACTERS) for _ in range(rng.randint(1, string_length)))
+
+
+def generate_rows(options, row_count, seed):
+    """ Yields row_count rows (lists of strings, None stands for NULL) """
+    rng = random.Random(seed)
+    types = [options.types[c_ix % len(options.types)] for c_ix in range(options.columns)]
+    for _ in range(row_count):
+        yield [None if rng.random() < options.null_fraction else generate_value(rng, column_type, options.string_length)
+               for column_type in types]
+
+
+def column_names(options):
+    return ['col_{}_{}'.format(c_ix, options.types[c_ix % len(options.types)]) for c_ix in range(options.columns)]
+
+
+def write_csv(stream, options, row_count, seed):
+    writer = csv.writer(stream)
+    writer.writerow(column_names(options))
+    for row in generate_rows(options, row_count, seed):
+        writer.writerow(['' if value is None else value for value in row])
+
+
+def generate_csv(directory, options):
+    path = os.path.join(directory, 'benchmark.csv')
+    with open(path, 'w', newline='') as stream:
+        write_csv(stream, options, options.rows, options.seed)
+    return path
+
+
+def generate_zip(directory, options):
+    """ An archive with options.zip_members CSV files (each a table of its own) that share the rows """
+    path = os.path.join(directory, 'benchmark.zip')
+    with ZipFile(path, 'w', ZIP_DEFLATED) as archive:
+        for m_ix in range(options.zip_members):
+            member_rows = options.rows // options.zip_members + (m_ix < options.rows % options.zip_members)
+            member_path = os.path.join(directory, 'member_{}.csv'.format(m_ix))
+            with open(member_path, 'w', newline='') as stream:
+                write_csv(stream, options, member_rows, options.seed + m_ix)
+            archive.write(member_path, 'benchmark_{}.csv'.format(m_ix))
+            os.remove(member_path)
+    return path
+
+
+def generate_dump(directory, options):
+    """ A dump with a CREATE TABLE statement & multi row INSERT statements of options.dump_statement_rows rows """
+    path = os.path.join(directory, 'benchmark.sql')
+    columns = ', '.join('"{}"'.format(column) for column in column_names(options))
+    with open(path, 'w') as stream:
+        stream.write('-- Synthetic dump generated by benchmark.py\n')
+        stream.write('CREATE TABLE benchmark ({});\n'.format(
+            ', '.join('"{}" text'.format(column) for column in column_names(options))))
+        statement = list()
+        for row in generate_rows(options, options.rows, options.seed):
+            statement.append('({})'.format(', '.join(
+                'NULL' if value is None else "'{}'".format(value.replace("'", "''")) for value in row)))
+            if len(statement) == options.dump_statement_rows:
+                stream.write('INSERT INTO benchmark ({}) VALUES\n{};\n'.format(columns, ',\n'.join(statement)))
+                statement = list()
+        if len(statement):
+            stream.write('INSERT INTO benchmark ({}) VALUES\n{};\n'.format(columns, ',\n'.join(statement)))
+    return path
+
+
+GENERATORS = OrderedDict([('csv', generate_csv), ('zip', generate_zip), ('dump', generate_dump)])
+
+
+# Measurements
+class PeakMemory:
+    """ Samples the resident set size of this process in the background & keeps the peak (in bytes) """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self.running = False
+        self.thread = None
+
+    def __enter__(self):
+        self.peak = self.current()
+        self.running = True
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.running = False
+        self.thread.join()
+        self.peak = max(self.peak, self.current())
+
+    def _sample(self):
+        while self.running:
+            self.peak = max(self.peak, self.current())
+            time.sleep(self.interval)
+
+    @staticmethod
+    def current():
+        try:
+            with open('/proc/self/status') as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except (IOError, OSError, ValueError):
+            pass
+        # No /proc (e.g. macOS), fall back to the peak of the whole process (in bytes on macOS)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class PhaseTimer:
+    """
+     Times the phases of a load by wrapping the functions the loaders use for them.
+     With ZIP archives several members are loaded at once, so phase times are summed over the workers.
+    """
+    PHASES = [('create_table', data_service_models.DataLoader, 'create_table'),
+              ('create_table', data_service_models.DataLoader, '_create_staging_table'),
+              ('promote', data_service_models.DataLoader, '_promote_staging_table'),
+              ('copy', data_service_models, 'copy_csv'),
+              ('copy', data_service_models, 'copy_rows')]
+
+    def __init__(self):
+        self.timings = OrderedDict()
+        self.lock = threading.Lock()
+        self.originals = list()
+
+    def __enter__(self):
+        for phase, owner, name in self.PHASES:
+            original = getattr(owner, name)
+            self.originals.append((owner, name, original))
+            setattr(owner, name, self._timed(phase, original))
+        return self
+
+    def __exit__(self, *args):
+        for owner, name, original in reversed(self.originals):
+            setattr(owner, name, original)
+        self.originals = list()
+
+    def _timed(self, phase, function):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(phase, time.perf_counter() - start)
+
+        return timed
+
+    def add(self, phase, seconds):
+        with self.lock:
+            self.timings[phase] = self.timings.get(phase, 0) + seconds
+
+
+# Benchmark
+def load(file_format, path, schema_id, options):
+    if file_format == 'csv':
+        data_loader.process_csv(path, schema_id, 'benchmark', type_deduction=options.type_deduction)
+    elif file_format == 'zip':
+        failed = data_loader.process_zip(path, schema_id, type_deduction=options.type_deduction)
+        if failed:
+            raise Exception("Couldn't load {} from the archive".format(', '.join(failed)))
+    else:
+        data_loader.process_dump(path, schema_id, 'benchmark')
+
+
+def count_rows(schema_id):
+    schema_name = 'schema-' + str(schema_id)
+    row_count = 0
+    for table in data_loader.get_tables(schema_id, BENCHMARK_USER):
+        row_count += db.engine.execute('SELECT count(*) FROM "{}"."{}";'.format(schema_name, table.name)).first()[0]
+    return row_count
+
+
+def run(file_format, options, directory):
+    result = OrderedDict([('format', file_format), ('runs', list())])
+    start = time.perf_counter()
+    path = GENERATORS[file_format](directory, options)
+    result['generate_seconds'] = time.perf_counter() - start
+    result['file_bytes'] = os.path.getsize(path)
+
+    for _ in range(options.repeat):
+        dataset_name = 'benchmark-' + uuid4().hex
+        data_loader.create_dataset(dataset_name, BENCHMARK_USER)
+        schema_id = data_loader.get_dataset_id(dataset_name)[0].split('-')[1]
+        try:
+            with PeakMemory() as memory, PhaseTimer() as phases:
+                start = time.perf_counter()
+                load(file_format, path, schema_id, options)
+                load_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            row_count = count_rows(schema_id)
+            verify_seconds = time.perf_counter() - start
+        finally:
+            start = time.perf_counter()
+            data_loader.delete_dataset(schema_id)
+            cleanup_seconds = time.perf_counter() - start
+
+        timings = OrderedDict([('load', load_seconds)])
+        timings.update(phases.timings)
+        # Everything the loaders do besides creating, copying & promoting: parsing, type deduction, raw copy, commit
+        timings['other'] = max(0, load_seconds - sum(phases.timings.values()))
+        timings['verify'] = verify_seconds
+        timings['cleanup'] = cleanup_seconds
+        result['runs'].append(OrderedDict([
+            ('rows', row_count),
+            ('rows_per_second', row_count / load_seconds if load_seconds else None),
+            ('bytes_per_second', result['file_bytes'] / load_seconds if load_seconds else None),
+            ('peak_rss_bytes', memory.peak),
+            ('seconds', timings)]))
+    return result
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark the CSV, ZIP & SQL dump loaders on synthetic data.')
+    parser.add_argument('--formats', default='csv,zip,dump', help='comma separated formats to benchmark')
+    parser.add_argument('--rows', type=int, default=100000, help='rows per file')
+    parser.add_argument('--columns', type=int, default=10, help='columns per file')
+    parser.add_argument('--types', default=','.join(COLUMN_TYPES),
+                        help='comma separated mix of column types that is repeated over the columns '
+                             '(choose from {})'.format(', '.join(COLUMN_TYPES)))
+    parser.add_argument('--string-length', type=int, default=32, help='maximum length of text values')
+    parser.add_argument('--null-fraction', type=float, default=0.0, help='fraction of the values that is NULL')
+    parser.add_argument('--zip-members', type=int, default=4, help='CSV files per ZIP archive')
+    parser.add_argument('--dump-statement-rows', type=int, default=1000, help='rows per INSERT statement of a dump')
+    parser.add_argument('--type-deduction', action='store_true', help='load CSV files with type deduction')
+    parser.add_argument('--repeat', type=int, default=1, help='loads per format')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the synthetic data')
+    parser.add_argument('--output', help='file to write the results to (default: stdout)')
+    options = parser.parse_args()
+
+    options.formats = [file_format.strip() for file_format in options.formats.split(',')]
+    options.types = [column_type.strip() for column_type in options.types.split(',')]
+    for file_format in options.formats:
+        if file_format not in GENERATORS:
+            parser.error('unknown format: {}'.format(file_format))
+    for column_type in options.types:
+        if column_type not in COLUMN_TYPES:
+            parser.error('unknown column type: {}'.format(column_type))
+    if options.rows < 0 or options.columns < 1 or options.zip_members < 1 or options.repeat < 1:
+        parser.error('--rows must be >= 0 and --columns, --zip-members & --repeat must be >= 1')
+    return options
+
+
+def main():
+    options = parse_arguments()
+    user_data_access.add_user(User(BENCHMARK_USER, 'benchmark', firstname='Benchmark', lastname='Benchmark',
+                                   email='benchmark@benchmark', status='user', active=True))
+    directory = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        results = OrderedDict([
+            ('started', datetime.now().isoformat()),
+            ('python', platform.python_version()),
+            ('postgresql', db.engine.execute('SHOW server_version;').first()[0]),
+            ('options', OrderedDict((key, value) for key, value in sorted(vars(options).items())
+                                    if key != 'output')),
+            ('results', [run(file_format, options, directory) for file_format in options.formats])])
+    finally:
+        shutil.rmtree(directory)
+        user_data_access.delete_user(data_loader, BENCHMARK_USER)
+
+    output = json.dumps(results, indent=2)
+    if options.output:
+        with open(options.output, 'w') as stream:
+            stream.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
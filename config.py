@@ -23,9 +23,49 @@ CSRF_SESSION_KEY = 'NotSoSecret'
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 SECRET_KEY = '*^*(*&)(*)(*afafafaSDD47j\3yX R~X@H!jmM]Lwf/,?KT'
 
-ALLOWED_EXTENSIONS = ['zip', 'csv', 'dump', 'sql']
+ALLOWED_EXTENSIONS = ['zip', 'csv', 'dump', 'sql', 'parquet', 'feather', 'arrow']
+COLUMNAR_EXTENSIONS = ['parquet', 'feather', 'arrow']  # loaded with pyarrow, the column types are taken from the file
+COMPRESSED_EXTENSIONS = ['gz', 'bz2', 'xz']  # CSV files & dumps can be uploaded compressed (e.g. 'data.csv.gz')
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'input')
 
+# Bulk loading (COPY ... FROM STDIN)
+TYPE_SAMPLE_HEAD = 1000  # first rows of an upload that are always used for type deduction
+TYPE_SAMPLE_SIZE = 10000  # randomly chosen rows that are used for type deduction on top of those
+COPY_BUFFER_SIZE = 1024 * 1024  # bytes sent to the server per COPY write
+DUMP_BATCH_SIZE = 10000  # rows of a SQL dump that are sent to the server at once
+ZIP_WORKERS = 4  # ZIP archive members that are loaded at the same time (each uses its own connection)
+CSV_WORKERS = 4  # byte ranges of a large CSV file that are loaded at the same time (each uses its own connection)
+CSV_PARALLEL_SIZE = 256 * 1024 * 1024  # (uncompressed) CSV files of at least this many bytes are loaded in parallel
+
+# Table views
+ROW_COUNT_ESTIMATE_THRESHOLD = 1000000  # tables with more (estimated) rows show PostgreSQL's estimate, not an exact count
+FILTERED_COUNT_CACHE_SIZE = 1024  # amount of (table version, search) row counts that are kept in memory
+SEARCH_INDEX_WORKERS = 1  # search indexes (see SearchIndexer) that are built at the same time
+SEARCH_INDEX_MIN_ROWS = None  # imports into tables with at least this many rows build a search index (None: on request)
+FULL_TEXT_CONFIG = 'simple'  # text search configuration of the full-text search (e.g. 'english' to match word stems)
+TABLE_STREAM_BATCH_SIZE = 1000  # rows that are fetched at once when a page of a table is streamed
+PAGE_CACHE_SIZE = 256  # amount of table pages (see PageCache) that are kept in memory
+PAGE_CACHE_TTL = 300  # seconds a cached table page is served for
+COLUMN_CACHE_SIZE = 4096  # amount of tables of which the columns (see ColumnCache) are kept in memory
+COLUMN_CACHE_TTL = 60  # seconds the cached columns of a table are used for (other processes don't invalidate them)
+
+# Index advisor
+INDEX_ADVISOR_INTERVAL = 600  # minimum seconds between two runs of the index advisor (see IndexAdvisor), None: off
+INDEX_ADVISOR_MIN_USES = 20  # sorts of a column (or searches of a table) after which the advisor indexes it
+INDEX_ADVISOR_MIN_ROWS = 10000  # tables with fewer rows aren't indexed by the advisor
+INDEX_ADVISOR_UNUSED_DAYS = 14  # indexes of the advisor that weren't needed for this many days are dropped
+INDEX_ADVISOR_RETRY_HOURS = 24  # indexes the advisor failed to build are tried again after this many hours
+
+# Upload jobs
+UPLOAD_WORKERS = 2  # uploads that are imported at the same time, the others wait in the queue
+UPLOAD_PROGRESS_INTERVAL = 1  # minimum amount of seconds between two progress updates of an upload job
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # maximum size of a chunk of a chunked upload
+UPLOAD_SESSION_TIMEOUT = 3600  # seconds without a new chunk after which a chunked upload is abandoned
+UPLOAD_SESSION_WORKERS = 8  # chunked uploads that are imported while their chunks arrive (on top of UPLOAD_WORKERS)
+UPLOAD_SESSION_STALL_TIMEOUT = 30  # seconds such an import waits for the next chunk before it waits for the whole file
+UPLOAD_SESSION_POLL_INTERVAL = 5  # seconds between checks for chunks that another server process received
+UPLOAD_DEDUPLICATION = True  # serve files that were uploaded before from the table that holds them (see UploadRegistry)
+
 ACTIVE_USER_TIME_SECONDS = 300
 
 BACKUP_LIMIT = 10
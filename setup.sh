@@ -48,6 +48,10 @@ if [ -x "$(command -v psql)" ]; then
 	psql -U postgres -c "GRANT ALL PRIVILEGES ON DATABASE test_userdb TO dbadmin;"
 	psql -U postgres -c 'ALTER DATABASE test_userdb SET datestyle TO "ISO, MDY";'
 
+	# Only a superuser can create pg_trgm before PostgreSQL 13
+	psql -U postgres -d userdb -c "CREATE EXTENSION IF NOT EXISTS pg_trgm;"
+	psql -U postgres -d test_userdb -c "CREATE EXTENSION IF NOT EXISTS pg_trgm;"
+
 	psql -U dbadmin -d userdb -f sql/tables.sql
 	psql -U dbadmin -d test_userdb -f sql/tables.sql
 else
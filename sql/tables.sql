@@ -1,3 +1,17 @@
+-- Trigram indexes for the substring search of table views (see SearchIndexer). Before PostgreSQL 13 only a superuser
+-- can create the extension, so setup.sh creates it as postgres first.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- The text of a value, for in the search index of a table. The text of dates, times, floating point numbers & binary
+-- values depends on settings of the session, which are fixed here, so every session gets the same text (an index
+-- needs an immutable expression). Functions with settings aren't inlined, so it's called for every value.
+CREATE FUNCTION search_text(anyelement) RETURNS text AS 'SELECT $1::text' LANGUAGE sql IMMUTABLE
+  SET DateStyle = 'ISO, MDY' SET IntervalStyle = 'postgres' SET TimeZone = 'UTC' SET extra_float_digits = 1
+  SET bytea_output = 'hex';
+
+-- The parts of large CSV files that are loaded in parallel, apart from the tables of the datasets
+CREATE SCHEMA _csv_parts;
+
 CREATE TABLE Member (
   Username  VARCHAR(255),
   Pass      VARCHAR(255) NOT NULL,
@@ -49,6 +63,7 @@ CREATE TABLE Metadata (
   id_dataset VARCHAR(255),
   id_table   VARCHAR(255),
   metadata   VARCHAR(255),
+  version    BIGINT NOT NULL DEFAULT 0,
 
   FOREIGN KEY (id_dataset) REFERENCES Dataset(id) ON DELETE CASCADE,
   PRIMARY KEY (id_dataset, id_table)
@@ -79,3 +94,119 @@ CREATE TABLE Backups (
   FOREIGN KEY (id_dataset) REFERENCES Dataset(id) ON DELETE CASCADE,
   PRIMARY KEY (id_dataset, table_name, timestamp)
 );
+
+-- Numbers the processes of the app, see ServerProcess
+CREATE SEQUENCE Server_Process;
+
+CREATE TABLE Upload_Job (
+  id              SERIAL,
+  id_dataset      VARCHAR(255),
+  id_user         VARCHAR(255),
+  filename        VARCHAR(255),
+  table_name      VARCHAR(255),
+  path            TEXT,
+  state           VARCHAR(255) DEFAULT 'queued',
+  bytes_total     BIGINT DEFAULT 0,
+  bytes_processed BIGINT DEFAULT 0,
+  rows_loaded     BIGINT DEFAULT 0,
+  error           TEXT,
+  duplicate_of    VARCHAR(255),
+  owner           INTEGER,  -- the process that runs the job (see ServerProcess)
+  created         TIMESTAMP,
+  updated         TIMESTAMP,
+
+  FOREIGN KEY (id_dataset) REFERENCES Dataset(id) ON DELETE CASCADE,
+  FOREIGN KEY (id_user) REFERENCES Member(Username) ON DELETE CASCADE,
+  PRIMARY KEY (id),
+  CHECK (state IN ('queued', 'waiting', 'running', 'finished', 'failed'))
+);
+
+CREATE TABLE Row_Count (
+  id_dataset VARCHAR(255),
+  id_table   VARCHAR(255),
+  table_oid  OID,
+  row_count  BIGINT,
+
+  FOREIGN KEY (id_dataset) REFERENCES Dataset(id) ON DELETE CASCADE,
+  PRIMARY KEY (id_dataset, id_table)
+);
+
+CREATE TABLE Search_Index (
+  id_dataset VARCHAR(255),
+  id_table   VARCHAR(255),
+  search_type VARCHAR(16) NOT NULL DEFAULT 'substring',
+  index_name  VARCHAR(255),
+  columns     TEXT,
+  state       VARCHAR(16) NOT NULL DEFAULT 'building',
+  owner       INTEGER,  -- the process that builds the index (see ServerProcess)
+  updated     TIMESTAMP,
+
+  FOREIGN KEY (id_dataset) REFERENCES Dataset(id) ON DELETE CASCADE,
+  PRIMARY KEY (id_dataset, id_table, search_type),
+  CHECK (search_type IN ('substring', 'fulltext')),
+  CHECK (state IN ('building', 'ready', 'failed'))
+);
+
+-- How often the columns of tables are sorted & the tables are searched (see IndexAdvisor)
+CREATE TABLE Column_Usage (
+  id_dataset  VARCHAR(255),
+  id_table    VARCHAR(255),
+  column_name VARCHAR(255),  -- '' for searches, which use all columns
+  usage       VARCHAR(16),
+  uses        BIGINT NOT NULL DEFAULT 0,
+  last_used   TIMESTAMP,
+
+  FOREIGN KEY (id_dataset) REFERENCES Dataset(id) ON DELETE CASCADE,
+  PRIMARY KEY (id_dataset, id_table, column_name, usage),
+  CHECK (usage IN ('sort', 'substring', 'fulltext'))
+);
+
+-- The indexes the index advisor decided to build, search indexes are kept track of in Search_Index
+CREATE TABLE Advised_Index (
+  id_dataset  VARCHAR(255),
+  id_table    VARCHAR(255),
+  column_name VARCHAR(255),
+  usage       VARCHAR(16),
+  index_name  VARCHAR(255),
+  state       VARCHAR(16) NOT NULL DEFAULT 'building',
+  owner       INTEGER,  -- the process that builds the index (see ServerProcess)
+  decided     TIMESTAMP,
+
+  FOREIGN KEY (id_dataset) REFERENCES Dataset(id) ON DELETE CASCADE,
+  PRIMARY KEY (id_dataset, id_table, column_name, usage),
+  CHECK (state IN ('building', 'ready', 'failed'))
+);
+
+CREATE TABLE Upload_Registry (
+  id_dataset     VARCHAR(255),
+  digest         VARCHAR(64),
+  type_deduction BOOL,
+  table_name     VARCHAR(255),
+  first_id       BIGINT,
+  last_id        BIGINT,
+  created        TIMESTAMP,
+
+  FOREIGN KEY (id_dataset) REFERENCES Dataset(id) ON DELETE CASCADE,
+  PRIMARY KEY (id_dataset, digest, type_deduction, table_name)
+);
+
+CREATE TABLE Upload_Session (
+  id             VARCHAR(255),
+  id_dataset     VARCHAR(255),
+  id_user        VARCHAR(255),
+  filename       VARCHAR(255),
+  table_name     VARCHAR(255),
+  table_desc     VARCHAR(255),
+  type_deduction BOOL,
+  size           BIGINT,
+  received       BIGINT DEFAULT 0,
+  id_job         INTEGER,
+  failed         BOOL DEFAULT FALSE,
+  created        TIMESTAMP,
+  updated        TIMESTAMP,
+
+  FOREIGN KEY (id_dataset) REFERENCES Dataset(id) ON DELETE CASCADE,
+  FOREIGN KEY (id_user) REFERENCES Member(Username) ON DELETE CASCADE,
+  FOREIGN KEY (id_job) REFERENCES Upload_Job(id) ON DELETE SET NULL,
+  PRIMARY KEY (id)
+);